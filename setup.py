@@ -46,6 +46,10 @@ setup(
         'repodono.storage',
     ],
     extras_require={
+        'async': [
+            'futures',
+            'trollius',
+        ],
         'test': [
             'plone.app.testing',
             'plone.app.contenttypes',
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous access to the git storage, for use with asyncio (or its
+trollius backport, from the async extra).
+
+All the blocking work with pygit2 and dulwich is done on bounded thread
+pools, with reads and syncs on pools of their own so that slow fetches
+cannot hold up the reads.  The pygit2 handles are shared between threads
+(see pool), and reads through them run concurrently; what is serialized
+is the use of a storage that can be checked out, so every call sees the
+revision left by the calls before it, and the syncs of the same local
+repository.  Serialized calls wait for their turn on the event loop,
+before being dispatched, so waiting never holds up a worker.  Snapshots
+(see GitStorage.at) are not serialized at all.  Every call returns a
+future, which may be cancelled while it is still waiting; streaming
+operations return AsyncIterator instances, which produce one item per
+step on the pool.
+"""
+
+from os.path import realpath
+from threading import Lock
+from weakref import WeakKeyDictionary
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:  # pragma: no cover
+        asyncio = None
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:  # pragma: no cover
+    ThreadPoolExecutor = None
+
+try:
+    StopAsyncIteration = StopAsyncIteration
+except NameError:
+    class StopAsyncIteration(Exception):
+        """
+        Raised by AsyncIterator once exhausted, where Python does not
+        provide it.
+        """
+
+from .blobio import DEFAULT_CHUNK_SIZE
+from .utility import GitStorage
+from .utility import GitStorageBackend
+from .utility import GitStorageSnapshot
+
+READ_WORKERS = 8
+SYNC_WORKERS = 2
+
+# the GitStorage methods that return their complete result.
+BLOCKING_METHODS = (
+    'ahead_behind',
+    'blame',
+    'branches',
+    'build_last_modified',
+    'build_manifest',
+    'build_search_index',
+    'checkout',
+    'diff_stats',
+    'file',
+    'files',
+    'last_modified',
+    'listdir',
+    'log',
+    'log_page',
+    'pathinfo',
+    'tags',
+)
+
+# the GitStorage methods that return iterators.
+STREAMING_METHODS = (
+    'archive',
+    'diff',
+    'iterfiles',
+    'iterlog',
+    'search',
+)
+
+_executors = {}
+_locks = WeakKeyDictionary()
+_lock = Lock()
+
+
+def available():
+    return asyncio is not None and ThreadPoolExecutor is not None
+
+
+def shared_executor(name, workers):
+    """
+    Return the executor shared by the instances using the pool called
+    name, creating it with workers threads if needed.
+    """
+
+    with _lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(workers)
+        return _executors[name]
+
+
+def serial_lock(loop, *key):
+    """
+    Return the asyncio lock for key on loop, shared by everything using
+    the same key with that loop.
+    """
+
+    with _lock:
+        locks = _locks.setdefault(loop, {})
+        if key not in locks:
+            locks[key] = asyncio.Lock(loop=loop)
+        return locks[key]
+
+
+def _run(loop, executor, lock, func, *a, **kw):
+    # return a future for func, submitted to executor once lock is
+    # acquired (right away without a lock).  The lock is released once
+    # the call has finished on the worker, even if the future returned
+    # got cancelled while it was running.
+    result = asyncio.Future(loop=loop)
+    acquire = None
+    submitted = []
+
+    def finished(call):
+        if lock is not None:
+            lock.release()
+        if result.cancelled():
+            return
+        if call.cancelled():
+            result.cancel()
+        elif call.exception() is not None:
+            result.set_exception(call.exception())
+        else:
+            result.set_result(call.result())
+
+    def submit():
+        try:
+            call = executor.submit(lambda: func(*a, **kw))
+        except RuntimeError as e:
+            # the executor got shut down.
+            if lock is not None:
+                lock.release()
+            result.set_exception(e)
+            return
+        submitted.append(call)
+        call.add_done_callback(
+            lambda call: loop.call_soon_threadsafe(finished, call))
+
+    def acquired(acquire):
+        if acquire.cancelled():
+            return
+        if result.cancelled():
+            lock.release()
+            return
+        submit()
+
+    def cancelled(result):
+        if not result.cancelled():
+            return
+        if submitted:
+            # only stops calls still waiting for a worker; the ones
+            # running finish, and release the lock, on their own.
+            submitted[0].cancel()
+        elif acquire is not None:
+            acquire.cancel()
+
+    result.add_done_callback(cancelled)
+    if lock is None:
+        submit()
+    else:
+        acquire = asyncio.ensure_future(lock.acquire(), loop=loop)
+        acquire.add_done_callback(acquired)
+    return result
+
+
+class AsyncIterator(object):
+    """
+    Asynchronous iteration over the iterator made by factory, with every
+    step done on the executor in its turn on lock, if any.  Provides __anext__
+    for use with async for, which returns a future for the next item or
+    for StopAsyncIteration once exhausted.
+    """
+
+    def __init__(self, loop, executor, lock, factory):
+        self.loop = loop
+        self.executor = executor
+        self.lock = lock
+        self.factory = factory
+        self._iterator = None
+
+    def _step(self):
+        if self._iterator is None:
+            self._iterator = iter(self.factory())
+        try:
+            return False, next(self._iterator)
+        except StopIteration:
+            return True, None
+
+    def _close(self):
+        close = getattr(self._iterator, 'close', None)
+        if close is not None:
+            close()
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        result = asyncio.Future(loop=self.loop)
+        step = _run(self.loop, self.executor, self.lock, self._step)
+
+        def stepped(step):
+            if result.cancelled():
+                return
+            if step.cancelled():
+                result.cancel()
+            elif step.exception() is not None:
+                result.set_exception(step.exception())
+            else:
+                done, item = step.result()
+                if done:
+                    result.set_exception(StopAsyncIteration())
+                else:
+                    result.set_result(item)
+
+        def cancelled(result):
+            if result.cancelled():
+                step.cancel()
+
+        step.add_done_callback(stepped)
+        result.add_done_callback(cancelled)
+        return result
+
+    def aclose(self):
+        """
+        Return a future for closing the underlying iterator, for
+        abandoning the iteration early.
+        """
+
+        return _run(self.loop, self.executor, self.lock, self._close)
+
+
+class AsyncGitStorage(object):
+    """
+    The asynchronous counterpart of a GitStorage.
+    """
+
+    def __init__(self, storage, executor=None, loop=None):
+        if not available():
+            raise ImportError('asyncio (or trollius) and futures required')
+        self.storage = storage
+        self.executor = executor or shared_executor('read', READ_WORKERS)
+        self.loop = loop or asyncio.get_event_loop()
+        # calls into a storage that can be checked out are taken one at
+        # a time, in order.
+        self.lock = None
+        if not isinstance(storage, GitStorageSnapshot):
+            self.lock = asyncio.Lock(loop=self.loop)
+
+    @classmethod
+    def from_context(cls, context, executor=None, loop=None):
+        """
+        Return a future for the AsyncGitStorage for context, with the
+        GitStorage created on the executor.
+        """
+
+        executor = executor or shared_executor('read', READ_WORKERS)
+        loop = loop or asyncio.get_event_loop()
+        return loop.run_in_executor(executor, lambda: cls(
+            GitStorage(context), executor, loop))
+
+    def _call(self, func, *a, **kw):
+        return _run(self.loop, self.executor, self.lock, func, *a, **kw)
+
+    def _iterate(self, factory):
+        return AsyncIterator(self.loop, self.executor, self.lock, factory)
+
+    def open(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Return an AsyncIterator of the chunks of the file at path.
+        """
+
+        return self._iterate(lambda: self.storage.open(path, chunk_size))
+
+
+def _blocking(name):
+    def method(self, *a, **kw):
+        return self._call(getattr(self.storage, name), *a, **kw)
+    method.__name__ = name
+    method.__doc__ = 'Return a future for GitStorage.%s.' % name
+    return method
+
+
+def _streaming(name):
+    def method(self, *a, **kw):
+        return self._iterate(lambda: getattr(self.storage, name)(*a, **kw))
+    method.__name__ = name
+    method.__doc__ = 'Return an AsyncIterator for GitStorage.%s.' % name
+    return method
+
+
+for _name in BLOCKING_METHODS:
+    setattr(AsyncGitStorage, _name, _blocking(_name))
+for _name in STREAMING_METHODS:
+    setattr(AsyncGitStorage, _name, _streaming(_name))
+
+
+class AsyncGitStorageBackend(object):
+    """
+    The asynchronous counterpart of a GitStorageBackend, for syncing.
+    """
+
+    def __init__(self, backend=None, executor=None, loop=None):
+        if not available():
+            raise ImportError('asyncio (or trollius) and futures required')
+        self.backend = backend or GitStorageBackend()
+        self.executor = executor or shared_executor('sync', SYNC_WORKERS)
+        self.loop = loop or asyncio.get_event_loop()
+
+    def sync_identifier(self, local_path, remote_id, branch=None,
+                        include=None, exclude=None):
+        """
+        Return a future for the results of syncing the repository at
+        local_path from remote_id, one sync of it at a time.
+        """
+
+        return _run(
+            self.loop, self.executor,
+            serial_lock(self.loop, 'sync', realpath(local_path)),
+            self.backend._sync_identifier, local_path, remote_id, branch,
+            include, exclude)
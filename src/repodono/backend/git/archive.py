@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming tar, tar.gz and zip archives of trees.
+
+The archives are produced as generators of chunks, straight from the
+walk of the tree, with the contents of only one blob held in memory at
+any time.  The zip archives use data descriptors, so that nothing needs
+to be known about an entry before its data got written, and neither
+format needs to seek.
+"""
+
+import os
+import struct
+import tarfile
+import time
+import zlib
+from hashlib import sha1
+from os.path import exists
+from os.path import join
+
+from pygit2 import GIT_FILEMODE_BLOB_EXECUTABLE
+from pygit2 import GIT_FILEMODE_COMMIT
+from pygit2 import GIT_FILEMODE_LINK
+from pygit2 import GIT_FILEMODE_TREE
+
+from .blobio import DEFAULT_CHUNK_SIZE
+from .blobio import blob_buffer
+from .disk import atomic_write
+from .disk import data_path
+from .walk import as_bytes
+from .walk import as_text
+from .walk import walk_tree
+
+FORMATS = ('tar', 'tar.gz', 'zip')
+COMPRESS_LEVEL = 6
+
+ZIP_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+ZIP_DATA_DESCRIPTOR = struct.Struct('<IIII')
+ZIP_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+ZIP_END = struct.Struct('<IHHHHIIH')
+ZIP_FLAGS = 0x08 | 0x800  # data descriptor, utf-8 names
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP_VERSION = 20
+ZIP_MADE_BY = (3 << 8) | ZIP_VERSION  # unix
+ZIP_MAX = 0xffffffff
+
+# the total size of the archives kept by ArchiveCache for a repository.
+CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+
+def _mode(filemode):
+    if filemode == GIT_FILEMODE_BLOB_EXECUTABLE:
+        return 0o755
+    if filemode == GIT_FILEMODE_LINK:
+        return 0o777
+    return 0o644
+
+
+def iter_entries(repo, tree, paths=None):
+    """
+    Return an iterator of (path, entry) for the entries that are not
+    trees within tree, or only the ones at or under paths.  Raises
+    KeyError right away for any of the paths not found.
+    """
+
+    if not paths:
+        return walk_tree(repo, tree)
+
+    roots = []
+    for path in sorted(set('/'.join(f for f in p.split('/') if f)
+                           for p in paths)):
+        if any(path.startswith(r + '/') for r, e in roots):
+            # already included through its parent.
+            continue
+        # raises KeyError.
+        roots.append((path, tree[path]))
+
+    def entries():
+        for path, entry in roots:
+            if entry.filemode == GIT_FILEMODE_TREE:
+                for item in walk_tree(repo, repo.get(entry.id), base=path):
+                    yield item
+            else:
+                yield path, entry
+
+    return entries()
+
+
+def _directories(entries, prefix):
+    # Yield (path, entry) for everything, along with (path, None) for
+    # every directory before the first of its contents.
+    seen = set()
+    base = u''
+    if prefix:
+        seen.add(prefix)
+        base = prefix + u'/'
+        yield prefix, None
+    for path, entry in entries:
+        path = base + as_text(path)
+        parts = path.split('/')
+        for i in range(1, len(parts)):
+            parent = '/'.join(parts[:i])
+            if parent not in seen:
+                seen.add(parent)
+                yield parent, None
+        yield path, entry
+
+
+def _coalesce(chunks, chunk_size):
+    # Join the small pieces (e.g. headers) into chunks of about
+    # chunk_size, passing the large ones through.
+    pending = []
+    size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        size += len(chunk)
+        if size >= chunk_size:
+            yield b''.join(pending)
+            pending = []
+            size = 0
+    if pending:
+        yield b''.join(pending)
+
+
+def _blob_chunks(buf, chunk_size):
+    for i in range(0, len(buf), chunk_size):
+        yield buf[i:i + chunk_size].tobytes()
+
+
+def tar_chunks(repo, entries, mtime, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield the chunks of the tar archive of entries, being tuples of
+    (path, entry), where entry is None for a directory.
+    """
+
+    def header(path, size, type_, mode, linkname=''):
+        info = tarfile.TarInfo(path)
+        info.size = size
+        info.mtime = mtime
+        info.mode = mode
+        info.type = type_
+        info.linkname = linkname
+        info.uname = info.gname = 'root'
+        return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'strict')
+
+    written = 0
+    for path, entry in entries:
+        if entry is None or entry.filemode == GIT_FILEMODE_COMMIT:
+            # directories, and submodules shown as empty ones.
+            chunk = header(path + '/', 0, tarfile.DIRTYPE, 0o755)
+            written += len(chunk)
+            yield chunk
+            continue
+
+        buf = blob_buffer(repo.get(entry.id))
+        if entry.filemode == GIT_FILEMODE_LINK:
+            chunk = header(path, 0, tarfile.SYMTYPE, 0o777,
+                           as_text(buf.tobytes()))
+            written += len(chunk)
+            yield chunk
+            continue
+
+        chunk = header(path, len(buf), tarfile.REGTYPE, _mode(entry.filemode))
+        written += len(chunk)
+        yield chunk
+        for chunk in _blob_chunks(buf, chunk_size):
+            yield chunk
+        written += len(buf)
+        remainder = len(buf) % tarfile.BLOCKSIZE
+        if remainder:
+            padding = tarfile.BLOCKSIZE - remainder
+            written += padding
+            yield tarfile.NUL * padding
+
+    # the end of archive marker, padded to a full record.
+    end = tarfile.BLOCKSIZE * 2
+    written += end
+    end += -written % tarfile.RECORDSIZE
+    yield tarfile.NUL * end
+
+
+def gzip_chunks(chunks, mtime, level=COMPRESS_LEVEL):
+    """
+    Yield the chunks of the gzip stream of chunks.
+    """
+
+    yield b'\x1f\x8b\x08\x00' + struct.pack('<I', mtime) + b'\x00\xff'
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    crc = 0
+    size = 0
+    for chunk in chunks:
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush() + struct.pack(
+        '<II', crc & 0xffffffff, size & 0xffffffff)
+
+
+def _dos_datetime(mtime):
+    t = time.gmtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday,
+    )
+
+
+def zip_chunks(repo, entries, mtime, chunk_size=DEFAULT_CHUNK_SIZE,
+               level=COMPRESS_LEVEL):
+    """
+    Yield the chunks of the zip archive of entries, being tuples of
+    (path, entry), where entry is None for a directory.  Raises
+    ValueError for archives needing the zip64 extensions.
+    """
+
+    dos_time, dos_date = _dos_datetime(mtime)
+    central = []
+    offset = 0
+    for path, entry in entries:
+        name = as_bytes(path)
+        if entry is None or entry.filemode == GIT_FILEMODE_COMMIT:
+            name += b'/'
+            mode = 0o40755
+            buf = None
+        else:
+            mode = entry.filemode
+            buf = blob_buffer(repo.get(entry.id))
+
+        method = ZIP_STORED
+        if buf is not None and entry.filemode != GIT_FILEMODE_LINK:
+            method = ZIP_DEFLATED
+
+        header = ZIP_LOCAL_HEADER.pack(
+            0x04034b50, ZIP_VERSION, ZIP_FLAGS, method, dos_time, dos_date,
+            0, 0, 0, len(name), 0) + name
+        yield header
+
+        crc = 0
+        size = 0
+        compressed = 0
+        if buf is not None:
+            size = len(buf)
+            compressor = None
+            if method == ZIP_DEFLATED:
+                compressor = zlib.compressobj(
+                    level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            for chunk in _blob_chunks(buf, chunk_size):
+                crc = zlib.crc32(chunk, crc)
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                compressed += len(chunk)
+                if chunk:
+                    yield chunk
+            if compressor is not None:
+                chunk = compressor.flush()
+                compressed += len(chunk)
+                yield chunk
+        crc &= 0xffffffff
+
+        if size >= ZIP_MAX or compressed >= ZIP_MAX or offset >= ZIP_MAX:
+            raise ValueError('archive too large for the zip format')
+
+        yield ZIP_DATA_DESCRIPTOR.pack(0x08074b50, crc, compressed, size)
+        central.append(ZIP_CENTRAL_HEADER.pack(
+            0x02014b50, ZIP_MADE_BY, ZIP_VERSION, ZIP_FLAGS, method,
+            dos_time, dos_date, crc, compressed, size, len(name), 0, 0, 0,
+            0, (mode << 16) | (0x10 if buf is None else 0), offset) + name)
+        offset += len(header) + compressed + ZIP_DATA_DESCRIPTOR.size
+
+    size = 0
+    for record in central:
+        size += len(record)
+        yield record
+    if len(central) > 0xffff or offset >= ZIP_MAX:
+        raise ValueError('archive too large for the zip format')
+    yield ZIP_END.pack(
+        0x06054b50, 0, 0, len(central), len(central), size, offset, 0)
+
+
+def archive(repo, tree, format='tar', prefix=None, paths=None, mtime=0,
+            chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Return a generator of the chunks of the archive of tree, in format,
+    with the paths within it placed under the prefix directory and
+    limited to the ones at or under paths, if given.  Raises ValueError
+    for unsupported formats and KeyError for paths not in tree.
+    """
+
+    if format not in FORMATS:
+        raise ValueError('unsupported archive format: %s' % format)
+
+    prefix = '/'.join(f for f in as_text(prefix or u'').split('/') if f)
+    entries = _directories(iter_entries(repo, tree, paths), prefix)
+
+    if format == 'zip':
+        chunks = zip_chunks(repo, entries, mtime, chunk_size)
+    else:
+        chunks = tar_chunks(repo, entries, mtime, chunk_size)
+        if format == 'tar.gz':
+            chunks = gzip_chunks(chunks, mtime)
+    return _coalesce(chunks, chunk_size)
+
+
+class ArchiveCache(object):
+    """
+    The archives produced for a repository, kept within its git
+    directory, as they only depend on the tree, the time given to the
+    entries and the format and prefix.  The least recently used ones
+    are removed once they take more than max_size in total.
+    """
+
+    def __init__(self, repo, max_size=CACHE_MAX_SIZE):
+        self.repo = repo
+        self.max_size = max_size
+        self.root = data_path(repo, 'archives')
+
+    def filename(self, tree_hex, format, mtime, prefix=None):
+        key = sha1(repr((mtime, as_text(prefix or u'')))).hexdigest()[:16]
+        return join(self.root, '%s-%s.%s' % (tree_hex, key, format))
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used archives, other than keep, until
+        the ones left fit within max_size.  Returns the number removed.
+        """
+
+        entries = []
+        names = os.listdir(self.root) if exists(self.root) else []
+        for name in names:
+            if name.startswith('tmp'):
+                # still being written.
+                continue
+            filename = join(self.root, name)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, filename))
+
+        total = sum(size for mtime, size, filename in entries)
+        removed = 0
+        for mtime, size, filename in sorted(entries):
+            if total <= self.max_size:
+                break
+            if filename == keep:
+                continue
+            try:
+                os.unlink(filename)
+            except OSError:
+                # removed by someone else in the mean time.
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+    def stream(self, tree, format='tar', prefix=None, mtime=0,
+               chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Return a generator of the chunks of the archive, read from the
+        cache or otherwise produced and written to it along the way.
+        """
+
+        filename = self.filename(tree.hex, format, mtime, prefix)
+        if exists(filename):
+            return self._read(filename, chunk_size)
+        return self._write(filename, archive(
+            self.repo, tree, format, prefix, mtime=mtime,
+            chunk_size=chunk_size))
+
+    def _read(self, filename, chunk_size):
+        try:
+            # marks it as recently used.
+            os.utime(filename, None)
+        except OSError:
+            pass
+        with open(filename, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def _write(self, filename, chunks):
+        # only kept if the archive got produced completely.
+        with atomic_write(filename) as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        self.evict(keep=filename)
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the git storage, over synthetic repositories.
+
+Run with ``python -m repodono.backend.git.benchmark --help`` for the
+options; the results are written as JSON, which can be compared with
+the results of a previous run.
+"""
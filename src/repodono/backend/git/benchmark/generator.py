@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Generator of large synthetic repositories.
+
+The repositories are made from a seeded random number generator, so
+the same parameters always produce the same repository (down to the
+commit ids), which keeps the results of different runs comparable.
+"""
+
+import os
+import random
+from hashlib import sha1
+from os.path import join
+
+from dulwich.repo import Repo
+from pygit2 import GIT_FILEMODE_BLOB
+from pygit2 import GIT_FILEMODE_COMMIT
+from pygit2 import GIT_FILEMODE_TREE
+from pygit2 import GIT_OBJ_COMMIT
+from pygit2 import Signature
+from pygit2 import init_repository
+
+DEFAULTS = {
+    'commits': 100,
+    'files': 1000,
+    'depth': 3,
+    'fanout': 8,
+    'lines': 20,
+    'changes': 10,
+    'branches': 10,
+    'tags': 50,
+    'large_blobs': 2,
+    'large_size': 1 << 20,
+    'submodules': 2,
+    'seed': 0,
+}
+
+START_TIME = 1400000000
+COMMIT_INTERVAL = 600
+
+
+class TreeWriter(object):
+    """
+    Writes the trees for a set of paths, only writing again the trees
+    along the paths that changed since the last write.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        # nested dicts of the entries, with the id of the tree written
+        # for a dict kept under None until something within changes.
+        self.root = {}
+
+    def set(self, path, oid, filemode=GIT_FILEMODE_BLOB):
+        parts = path.split('/')
+        node = self.root
+        node.pop(None, None)
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            node.pop(None, None)
+        node[parts[-1]] = (oid, filemode)
+
+    def write(self, node=None):
+        if node is None:
+            node = self.root
+        if None not in node:
+            builder = self.repo.TreeBuilder()
+            for name, value in node.items():
+                if name is None:
+                    continue
+                if isinstance(value, dict):
+                    builder.insert(name, self.write(value), GIT_FILEMODE_TREE)
+                else:
+                    builder.insert(name, value[0], value[1])
+            node[None] = builder.write()
+        return node[None]
+
+
+def _signature(i, time):
+    return Signature('user%d' % (i % 7), '%d@example.com' % (i % 7), time, 0)
+
+
+def _text(lines):
+    return ''.join(lines).encode('utf-8')
+
+
+def _large_text(index, size):
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        line = 'large blob %d line %d\n' % (index, i)
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return ''.join(lines).encode('utf-8')[:size]
+
+
+def create_large_repo(repodir, **params):
+    """
+    Create a bare repository within the .git directory of repodir with
+    the given parameters (see DEFAULTS), with all of its objects packed:
+
+    commits
+        number of commits on master, each changing some of the files.
+    files, depth, fanout, lines
+        number of text files, placed within directories up to depth
+        levels deep with fanout directories per level, each with lines
+        lines to begin with.
+    changes
+        number of files changed by every commit after the first.
+    branches
+        number of branches, each with a commit of its own on top of one
+        of the commits of master.
+    tags
+        number of tags on the commits of master, every other one being
+        annotated, all within the packed-refs file.
+    large_blobs, large_size
+        number of large text files, and their size in bytes.
+    submodules
+        number of submodules, along with their .gitmodules file.
+    seed
+        seed for the random choices.
+
+    Returns a dict with the parameters used, the revs of master in
+    order, the paths of the text files, large files and submodules, and
+    the names of the branches and the tags.
+    """
+
+    unknown = set(params) - set(DEFAULTS)
+    if unknown:
+        raise TypeError('unknown parameters: %s' % ', '.join(sorted(unknown)))
+    p = dict(DEFAULTS)
+    p.update(params)
+    rng = random.Random(p['seed'])
+
+    repo = init_repository(join(repodir, '.git'), bare=True)
+    writer = TreeWriter(repo)
+
+    paths = []
+    for i in range(p['files']):
+        dirs = ['d%d' % rng.randrange(p['fanout'])
+                for level in range(rng.randint(0, p['depth']))]
+        paths.append('/'.join(dirs + ['f%05d.txt' % i]))
+    contents = {}
+    for path in paths:
+        contents[path] = [
+            '%s line %d\n' % (path, n) for n in range(p['lines'])]
+        writer.set(path, repo.create_blob(_text(contents[path])))
+
+    large = []
+    for i in range(p['large_blobs']):
+        path = 'large/blob%d.txt' % i
+        large.append(path)
+        writer.set(path, repo.create_blob(_large_text(i, p['large_size'])))
+
+    submodules = []
+    gitmodules = []
+    for i in range(p['submodules']):
+        path = 'ext/module%d' % i
+        submodules.append(path)
+        gitmodules.append(
+            '[submodule "module%d"]\n'
+            '\tpath = %s\n'
+            '\turl = http://example.com/module%d.git\n' % (i, path, i))
+        writer.set(path, sha1(path).hexdigest(), GIT_FILEMODE_COMMIT)
+    if gitmodules:
+        writer.set('.gitmodules', repo.create_blob(_text(gitmodules)))
+
+    revs = []
+    parents = []
+    for i in range(p['commits']):
+        if i:
+            for path in rng.sample(paths, min(p['changes'], len(paths))):
+                lines = contents[path]
+                n = rng.randrange(len(lines) + 1)
+                change = '%s changed in %d\n' % (path, i)
+                if n < len(lines) and rng.random() < 0.5:
+                    lines[n] = change
+                else:
+                    lines.insert(n, change)
+                writer.set(path, repo.create_blob(_text(lines)))
+        sig = _signature(i, START_TIME + i * COMMIT_INTERVAL)
+        commit = repo.create_commit(
+            'refs/heads/master', sig, sig, 'commit %d\n' % i, writer.write(),
+            parents)
+        parents = [commit]
+        revs.append(commit.hex)
+
+    # the branches get a commit of their own, from a tree written aside
+    # from the one of master.
+    branches = []
+    for i in range(p['branches']):
+        name = 'branch%03d' % i
+        base = repo[revs[rng.randrange(len(revs))]]
+        builder = repo.TreeBuilder(base.tree)
+        builder.insert(
+            'BRANCH', repo.create_blob(_text([name + '\n'])),
+            GIT_FILEMODE_BLOB)
+        sig = _signature(i, base.commit_time + 1)
+        repo.create_commit(
+            'refs/heads/' + name, sig, sig, name + '\n', builder.write(),
+            [base.id])
+        branches.append(name)
+
+    tags = []
+    packed = []
+    for i in range(p['tags']):
+        name = 'v%d.%d' % (i // 10, i % 10)
+        target = revs[rng.randrange(len(revs))]
+        if i % 2:
+            sig = _signature(i, START_TIME)
+            tag = repo.create_tag(
+                name, target, GIT_OBJ_COMMIT, sig, name + '\n').hex
+            os.unlink(join(repo.path, 'refs', 'tags', name))
+            packed.append('%s refs/tags/%s\n^%s\n' % (tag, name, target))
+        else:
+            packed.append('%s refs/tags/%s\n' % (target, name))
+        tags.append(name)
+    if packed:
+        with open(join(repo.path, 'packed-refs'), 'w') as f:
+            f.write('# pack-refs with: peeled fully-peeled \n')
+            f.write(''.join(sorted(packed, key=lambda r: r.split()[1])))
+
+    # like the repositories being served, everything ends up in a pack
+    # rather than in loose objects.
+    Repo(repo.path).object_store.pack_loose_objects()
+
+    return {
+        'params': p,
+        'revs': revs,
+        'paths': paths,
+        'large': large,
+        'submodules': submodules,
+        'branches': branches,
+        'tags': sorted(tags),
+    }
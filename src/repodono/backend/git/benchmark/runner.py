@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Running the scenarios and reporting the results.
+
+The results are a JSON object with the metadata of the run (the
+parameters of the repository, and the versions of Python and of the
+libraries) under meta, and the timings of every scenario in seconds
+under results, keyed by name.  Scenarios raising an exception get the
+error recorded instead.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import traceback
+from fnmatch import fnmatchcase
+from os.path import join
+from shutil import rmtree
+from timeit import default_timer as timer
+
+import dulwich
+import pygit2
+import zope.component
+import zope.interface
+
+from repodono.storage.interfaces import IStorageInfo
+
+from ..utility import GitStorage
+from ..utility import GitStorageBackend
+from .generator import DEFAULTS
+from .generator import create_large_repo
+from .scenarios import storage_scenarios
+from .scenarios import sync_scenarios
+
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.1
+
+
+class BenchmarkItem(object):
+
+    def __init__(self, path):
+        self.path = path
+
+
+@zope.interface.implementer(IStorageInfo)
+class BenchmarkStorageInfo(object):
+
+    def __init__(self, context):
+        self.context = context
+
+    @property
+    def path(self):
+        return self.context.path
+
+
+def time_scenario(scenario, repeat=DEFAULT_REPEAT):
+    """
+    Return the timings of scenario, run repeat times unless it has a
+    number of repeats of its own.
+    """
+
+    repeat = scenario.repeat or repeat
+    timings = []
+    try:
+        for i in range(repeat):
+            arg = scenario.setup() if scenario.setup else None
+            try:
+                started = timer()
+                if scenario.setup:
+                    scenario.func(arg)
+                else:
+                    scenario.func()
+                timings.append(timer() - started)
+            finally:
+                if scenario.teardown:
+                    scenario.teardown(arg)
+    except Exception as e:  # XXX blind
+        return {'error': '%s: %s' % (type(e).__name__, e)}
+
+    timings.sort()
+    middle = len(timings) // 2
+    if len(timings) % 2:
+        median = timings[middle]
+    else:
+        median = (timings[middle - 1] + timings[middle]) / 2.0
+    return {
+        'repeat': repeat,
+        'min': timings[0],
+        'max': timings[-1],
+        'mean': sum(timings) / len(timings),
+        'median': median,
+        'total': sum(timings),
+    }
+
+
+def _selected(name, patterns):
+    return not patterns or any(fnmatchcase(name, p) for p in patterns)
+
+
+def metadata(params):
+    return {
+        'params': params,
+        'created': int(time.time()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pygit2': getattr(pygit2, '__version__', None),
+        'libgit2': getattr(pygit2, 'LIBGIT2_VERSION', None),
+        'dulwich': '.'.join(str(v) for v in dulwich.__version__),
+    }
+
+
+def run(workdir, repeat=DEFAULT_REPEAT, patterns=None, sync=True,
+        log=None, **params):
+    """
+    Generate a repository with params under workdir and run the
+    scenarios matching the glob patterns (all by default) on it,
+    including the sync ones if sync is set.  Returns the results.
+    """
+
+    zope.component.provideAdapter(BenchmarkStorageInfo, (BenchmarkItem,))
+
+    source = join(workdir, 'source')
+    started = timer()
+    info = create_large_repo(source, **params)
+    generated = timer() - started
+
+    storage = GitStorage(BenchmarkItem(source))
+    scenarios = storage_scenarios(storage, info, info['params']['seed'])
+    servers = []
+    if sync:
+        more, servers = sync_scenarios(GitStorageBackend(), source, workdir)
+        scenarios.extend(more)
+
+    results = {}
+    for server in servers:
+        server.start()
+    try:
+        for scenario in scenarios:
+            if not _selected(scenario.name, patterns):
+                continue
+            results[scenario.name] = time_scenario(scenario, repeat)
+            if log is not None:
+                log(scenario.name, results[scenario.name])
+    finally:
+        for server in servers:
+            server.stop()
+
+    meta = metadata(info['params'])
+    meta['generate'] = generated
+    meta['repeat'] = repeat
+    return {'meta': meta, 'results': results}
+
+
+def compare(base, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare the median timings of the scenarios found in both of the
+    results base and current, returning a list of dicts with the name,
+    both timings, their ratio and whether the scenario got 'slower',
+    'faster' or stayed the 'same' within threshold (a fraction).
+    """
+
+    rows = []
+    for name in sorted(set(base['results']) & set(current['results'])):
+        old = base['results'][name].get('median')
+        new = current['results'][name].get('median')
+        if old is None or new is None:
+            rows.append({'name': name, 'base': old, 'current': new,
+                         'ratio': None, 'status': 'error'})
+            continue
+        if old:
+            ratio = new / old
+        else:
+            ratio = float('inf') if new else 1.0
+        if ratio > 1 + threshold:
+            status = 'slower'
+        elif ratio < 1 - threshold:
+            status = 'faster'
+        else:
+            status = 'same'
+        rows.append({'name': name, 'base': old, 'current': new,
+                     'ratio': ratio, 'status': status})
+    return rows
+
+
+def _print_result(name, result, out=sys.stderr):
+    if 'error' in result:
+        out.write('%-24s error: %s\n' % (name, result['error']))
+    else:
+        out.write('%-24s %10.6f s (median of %d)\n' % (
+            name, result['median'], result['repeat']))
+
+
+def _print_comparison(rows, out=sys.stderr):
+    for row in rows:
+        if row['ratio'] is None:
+            out.write('%-24s error\n' % row['name'])
+            continue
+        out.write('%-24s %10.6f -> %10.6f s  x%.2f  %s\n' % (
+            row['name'], row['base'], row['current'], row['ratio'],
+            row['status']))
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m repodono.backend.git.benchmark',
+        description='Benchmark the git storage on a synthetic repository.')
+    for name, default in sorted(DEFAULTS.items()):
+        parser.add_argument(
+            '--' + name.replace('_', '-'), type=int, default=default,
+            dest=name, metavar='N', help='default: %(default)s')
+    parser.add_argument(
+        '--repeat', type=int, default=DEFAULT_REPEAT, metavar='N',
+        help='number of runs of every scenario (default: %(default)s)')
+    parser.add_argument(
+        '--scenario', action='append', dest='patterns', metavar='GLOB',
+        help='only run the scenarios matching GLOB (may be repeated)')
+    parser.add_argument(
+        '--no-sync', action='store_false', dest='sync',
+        help='skip the sync scenarios')
+    parser.add_argument(
+        '--workdir', help='where to generate the repositories (kept), '
+        'rather than a temporary directory (removed)')
+    parser.add_argument(
+        '--output', '-o', help='file to write the results to, rather '
+        'than the standard output')
+    parser.add_argument(
+        '--compare', metavar='FILE',
+        help='results of a previous run to compare against')
+    parser.add_argument(
+        '--threshold', type=float, default=DEFAULT_THRESHOLD,
+        help='fraction by which a scenario may differ from the one '
+        'compared against (default: %(default)s)')
+    parser.add_argument(
+        '--fail-on-regression', action='store_true',
+        help='exit with status 1 when any scenario got slower')
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    params = dict((name, getattr(args, name)) for name in DEFAULTS)
+
+    workdir = args.workdir or tempfile.mkdtemp()
+    try:
+        results = run(
+            workdir, args.repeat, args.patterns, args.sync,
+            log=_print_result, **params)
+    except Exception:  # XXX blind
+        traceback.print_exc()
+        return 2
+    finally:
+        if not args.workdir:
+            rmtree(workdir)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)
+        rows = compare(base, results, args.threshold)
+        _print_comparison(rows)
+        if args.fail_on_regression and any(
+                row['status'] == 'slower' for row in rows):
+            return 1
+    return 0
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+The timed scenarios, covering the public methods of GitStorage and the
+syncing done by GitStorageBackend.
+
+Every scenario is a callable to be timed, along with an optional setup
+callable which is run (untimed) before every call and whose result is
+passed to it, and to the optional teardown callable run (untimed) after
+it.  Iterators are always consumed completely.
+"""
+
+import random
+from os.path import join
+from shutil import rmtree
+
+from pygit2 import init_repository
+
+from .servers import GitServer
+
+SAMPLE_SIZE = 100
+
+
+class Scenario(object):
+
+    def __init__(self, name, func, setup=None, teardown=None, repeat=None):
+        self.name = name
+        self.func = func
+        self.setup = setup
+        self.teardown = teardown
+        # overrides the number of repeats, e.g. for the ones building
+        # indexes, which only do any work once.
+        self.repeat = repeat
+
+
+def storage_scenarios(storage, info, seed=0):
+    """
+    Return the scenarios for storage, on the repository described by
+    info (as returned by create_large_repo).
+    """
+
+    rng = random.Random(seed)
+    revs = info['revs']
+    paths = info['paths']
+    sample = rng.sample(paths, min(SAMPLE_SIZE, len(paths)))
+    dirs = sorted(set(p.rpartition('/')[0] for p in paths))
+    deepest = max(dirs, key=lambda d: (d.count('/'), d))
+    large = info['large'][0] if info['large'] else None
+    busiest = _busiest_path(storage, revs, paths)
+    head = revs[-1]
+
+    def each(func, items):
+        def run():
+            for item in items:
+                func(item)
+        return run
+
+    def consume(func, *a, **kw):
+        def run():
+            for item in func(*a, **kw):
+                pass
+        return run
+
+    def log_pages():
+        results, cursor = storage.log_page(None, 20)
+        while cursor is not None:
+            results, cursor = storage.log_page(None, 20, cursor=cursor)
+
+    def checkout():
+        for rev in revs[::max(1, len(revs) // 10)]:
+            storage.checkout(rev)
+        storage.checkout()
+
+    scenarios = [
+        Scenario('checkout', checkout),
+        Scenario('at', lambda: storage.at(revs[0]).files()),
+        Scenario('files', storage.files),
+        Scenario('iterfiles', consume(storage.iterfiles)),
+        Scenario('iterfiles_glob', consume(storage.iterfiles, glob='*1.txt')),
+        Scenario('listdir_root', lambda: storage.listdir('')),
+        Scenario('listdir_deep', lambda: storage.listdir(deepest)),
+        Scenario('listdir_info_root', lambda: storage.listdir_info('')),
+        Scenario('pathinfo', each(storage.pathinfo, sample)),
+        Scenario('_get_obj', each(storage._get_obj, sample)),
+        Scenario('file', each(storage.file, sample)),
+        Scenario('build_manifest', storage.build_manifest, repeat=1),
+        Scenario('pathinfo_manifest', each(storage.pathinfo, sample)),
+        Scenario('build_last_modified', storage.build_last_modified,
+                 repeat=1),
+        Scenario('last_modified', lambda: storage.last_modified(sample)),
+        Scenario('log', lambda: storage.log(None, 50)),
+        Scenario('log_shortlog', lambda: storage.log(None, 50, shortlog=True)),
+        Scenario('log_path', lambda: storage.log(None, 10, path=busiest)),
+        Scenario('iterlog', consume(storage.iterlog, shortlog=True)),
+        Scenario('log_page', log_pages),
+        Scenario('branches', storage.branches),
+        Scenario('tags', storage.tags),
+        Scenario('tags_by_date', lambda: storage.tags(
+            sort='date', reverse=True, limit=20, peeled=True)),
+        Scenario('ahead_behind', lambda: storage.ahead_behind(
+            info['branches'][0] if info['branches'] else head, revs[0])),
+        Scenario('diff', consume(storage.diff, revs[0], head)),
+        Scenario('diff_stats', lambda: storage.diff_stats(revs[0], head)),
+        Scenario('blame', lambda: storage.blame(busiest)),
+        Scenario('search', consume(
+            storage.search, 'changed in 1', limit=None)),
+        Scenario('search_regex', consume(
+            storage.search, r'f0+1\.txt line [0-9]+$', regex=True,
+            limit=None)),
+        Scenario('build_search_index', storage.build_search_index, repeat=1),
+        Scenario('search_indexed', consume(
+            storage.search, 'changed in 1', limit=None)),
+        Scenario('archive_tar', consume(
+            storage.archive, format='tar', cache=False)),
+        Scenario('archive_zip', consume(
+            storage.archive, format='zip', cache=False)),
+    ]
+
+    if large:
+        scenarios.extend([
+            Scenario('file_large', lambda: storage.file(large)),
+            Scenario('open_large', consume(storage.open, large)),
+            Scenario('blame_large', lambda: storage.blame(large)),
+        ])
+    if info['submodules']:
+        subpaths = [s + '/a/b' for s in info['submodules']]
+        scenarios.append(
+            Scenario('pathinfo_submodule', each(storage.pathinfo, subpaths)))
+    return scenarios
+
+
+def _busiest_path(storage, revs, paths):
+    # the path changed the most between the first and the last revs.
+    best = paths[0]
+    most = -1
+    for result in storage.diff(revs[0], revs[-1], stats_only=True):
+        changed = result['additions'] + result['deletions']
+        if changed > most:
+            best, most = result['new_path'], changed
+    return best
+
+
+def sync_scenarios(backend, source, workdir):
+    """
+    Return the scenarios for syncing the repository at source into new
+    repositories under workdir, from the local path and from local git
+    and http servers, along with the servers to be started and stopped
+    around them.
+    """
+
+    counter = [0]
+
+    def target():
+        counter[0] += 1
+        path = join(workdir, 'sync%d' % counter[0])
+        init_repository(join(path, '.git'), bare=True)
+        return path
+
+    def synced():
+        # an up to date target, for the syncs that find nothing new.
+        path = target()
+        backend._sync_identifier(path, source)
+        return path
+
+    def sync(url):
+        def run(path):
+            backend._sync_identifier(path, url())
+        return run
+
+    servers = {
+        'git': GitServer(source, 'git'),
+        'http': GitServer(source, 'http'),
+    }
+
+    scenarios = [
+        Scenario('sync_local', sync(lambda: source), target, rmtree),
+        Scenario(
+            'sync_local_noop', sync(lambda: source), synced, rmtree),
+    ]
+    for protocol, server in sorted(servers.items()):
+        scenarios.append(Scenario(
+            'sync_%s' % protocol, sync(lambda s=server: s.url), target,
+            rmtree))
+        scenarios.append(Scenario(
+            'sync_%s_noop' % protocol, sync(lambda s=server: s.url), synced,
+            rmtree))
+    return scenarios, list(servers.values())
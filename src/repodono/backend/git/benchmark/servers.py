@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Local dulwich servers for the sync benchmarks.
+"""
+
+import threading
+
+from dulwich.repo import Repo
+from dulwich.server import DictBackend
+from dulwich.server import TCPGitServer
+from dulwich.web import WSGIRequestHandlerLogger
+from dulwich.web import WSGIServerLogger
+from dulwich.web import make_server
+from dulwich.web import make_wsgi_chain
+
+
+class GitServer(object):
+    """
+    A dulwich server for the repository at path, serving it in a thread
+    of its own from start until stop, over the git protocol or over
+    http.
+    """
+
+    def __init__(self, path, protocol='git'):
+        if protocol not in ('git', 'http'):
+            raise ValueError('unsupported protocol: %s' % protocol)
+        self.path = path
+        self.protocol = protocol
+        self.server = None
+
+    def start(self):
+        backend = DictBackend({b'/': Repo(self.path)})
+        if self.protocol == 'git':
+            self.server = TCPGitServer(backend, b'localhost', 0)
+            serve = self.server.serve
+        else:
+            self.server = make_server(
+                'localhost', 0, make_wsgi_chain(backend),
+                handler_class=WSGIRequestHandlerLogger,
+                server_class=WSGIServerLogger)
+            serve = self.server.serve_forever
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+        return self.url
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return '%s://%s:%d/' % (self.protocol, host, port)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Line by line attribution of files, with the results cached.
+
+The blame of a version of a file is recorded against the id of its
+blob and the commit that introduced it (the newest commit with that
+blob at the path, going back through the parents that have the very
+same blob), as a list of [commit id, number of lines] runs.  When the
+blame of the previous versions in the parents is known, the blame of
+a new version is derived from those by mapping the lines outside of
+the changed hunks; otherwise it is computed by libgit2 from scratch.
+The commit found to have introduced the blob is remembered for the
+commit asked for, so blaming the same file again does not need to go
+back through the history where it did not change.
+"""
+
+import json
+import os
+from os.path import exists
+
+from .cache import LRUCache
+from .disk import atomic_write
+from .disk import data_path
+from .shallow import available_parents
+from .walk import walk_tree
+
+# loaded blames, keyed by their file path.
+blame_cache = LRUCache(256)
+# the commits found to have introduced the files blamed, keyed by the
+# git directory, the commit asked for and the path.
+origin_cache = LRUCache(4096)
+
+
+def count_lines(data):
+    if not data:
+        return 0
+    return data.count(b'\n') + (0 if data.endswith(b'\n') else 1)
+
+
+def expand(runs):
+    """
+    Return the list of commit ids, one per line, from runs.
+    """
+
+    lines = []
+    for commit_hex, count in runs:
+        lines.extend([commit_hex] * count)
+    return lines
+
+
+def compress(lines):
+    """
+    Return the runs of lines, a list of commit ids.
+    """
+
+    runs = []
+    for commit_hex in lines:
+        if runs and runs[-1][0] == commit_hex:
+            runs[-1][1] += 1
+        else:
+            runs.append([commit_hex, 1])
+    return runs
+
+
+def map_lines(old, new):
+    """
+    Return a list with, for every line of the blob new, the index of
+    the same line within the blob old or None if it is not from there.
+    """
+
+    total = count_lines(new.data)
+    mapping = [None] * total
+    patch = old.diff(new)
+    if patch.delta.is_binary:
+        return mapping
+
+    old_end = new_end = 0
+    for hunk in patch.hunks:
+        new_start = hunk.new_start - 1 if hunk.new_lines else hunk.new_start
+        for i in range(new_start - new_end):
+            mapping[new_end + i] = old_end + i
+        for line in hunk.lines:
+            if line.origin == ' ':
+                mapping[line.new_lineno - 1] = line.old_lineno - 1
+        old_end = hunk.old_start - 1 + hunk.old_lines if hunk.old_lines \
+            else hunk.old_start
+        new_end = new_start + hunk.new_lines
+    for i in range(total - new_end):
+        mapping[new_end + i] = old_end + i
+    return mapping
+
+
+def _entry_id(tree, path):
+    try:
+        return tree[path].id
+    except KeyError:
+        return None
+
+
+class BlameIndex(object):
+    """
+    The cached blames of the files of a repository.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.root = data_path(repo, 'blame')
+
+    def filename(self, blob_hex, commit_hex):
+        return '%s/%s-%s' % (self.root, blob_hex, commit_hex)
+
+    def get(self, blob_hex, commit_hex):
+        """
+        Return the runs for the blob introduced by the commit, or None
+        if not known.
+        """
+
+        filename = self.filename(blob_hex, commit_hex)
+        runs = blame_cache.get(filename)
+        if runs is None:
+            if not exists(filename):
+                return None
+            with open(filename, 'rb') as f:
+                runs = json.load(f)
+            blame_cache.put(filename, runs)
+        return runs
+
+    def put(self, blob_hex, commit_hex, runs):
+        filename = self.filename(blob_hex, commit_hex)
+        with atomic_write(filename) as f:
+            json.dump(runs, f, separators=(',', ':'))
+        blame_cache.put(filename, runs)
+
+    def gc(self, heads):
+        """
+        Remove the blames of the blobs other than the ones within the
+        trees of the commits of heads, the others being computed again
+        if ever needed.  Returns the number removed.
+        """
+
+        names = os.listdir(self.root) if exists(self.root) else []
+        names = [name for name in names if not name.startswith('tmp')]
+        if not names:
+            return 0
+        live = set()
+        for head in heads:
+            try:
+                tree = self.repo[head].tree
+            except (KeyError, AttributeError):
+                # gone, or not a commit.
+                continue
+            live.update(entry.hex for path, entry in walk_tree(
+                self.repo, tree))
+        removed = 0
+        for name in names:
+            if name.split('-')[0] in live:
+                continue
+            filename = '%s/%s' % (self.root, name)
+            blame_cache.pop(filename)
+            try:
+                os.unlink(filename)
+            except OSError:
+                # removed by someone else in the mean time.
+                continue
+            removed += 1
+        return removed
+
+    def origin(self, commit, path, blob_id):
+        """
+        Return the commit that introduced the blob at path, going back
+        from commit.
+        """
+
+        key = (self.repo.path, commit.hex, path)
+        known = origin_cache.get(key)
+        current = commit if known is None else self.repo[known]
+        # a known origin is checked again, as its parents may have been
+        # beyond a shallow boundary that has been deepened since.
+        while True:
+            for parent in available_parents(self.repo, current):
+                if _entry_id(parent.tree, path) == blob_id:
+                    current = parent
+                    break
+            else:
+                break
+        origin_cache.put(key, current.hex)
+        return current
+
+    def blame(self, commit, path):
+        """
+        Return the runs of the blame of the file at path within commit.
+        Raises KeyError if there is no such file.
+        """
+
+        blob_id = commit.tree[path].id
+        origin = self.origin(commit, path, blob_id)
+        runs = self.get(blob_id.hex, origin.hex)
+        if runs is not None:
+            return runs
+
+        # the previous versions of the file in the parents.
+        previous = []
+        for parent in available_parents(self.repo, origin):
+            parent_blob_id = _entry_id(parent.tree, path)
+            if parent_blob_id is None:
+                continue
+            parent_origin = self.origin(parent, path, parent_blob_id)
+            previous.append((parent_blob_id, self.get(
+                parent_blob_id.hex, parent_origin.hex)))
+
+        if any(runs is None for blob_id_, runs in previous):
+            runs = self._full(origin, path)
+        else:
+            runs = self._incremental(origin, blob_id, previous)
+        self.put(blob_id.hex, origin.hex, runs)
+        return runs
+
+    def _incremental(self, origin, blob_id, previous):
+        # Lines that can be traced to one of the previous versions keep
+        # their attribution, with the rest coming from origin.
+        blob = self.repo[blob_id]
+        lines = [None] * count_lines(blob.data)
+        for parent_blob_id, runs in previous:
+            parent_lines = expand(runs)
+            mapping = map_lines(self.repo[parent_blob_id], blob)
+            for i, old in enumerate(mapping):
+                if lines[i] is None and old is not None:
+                    lines[i] = parent_lines[old]
+        return compress([c or origin.hex for c in lines])
+
+    def _full(self, origin, path):
+        runs = []
+        for hunk in self.repo.blame(path, newest_commit=origin.id):
+            commit_hex = hunk.final_commit_id.hex
+            if runs and runs[-1][0] == commit_hex:
+                runs[-1][1] += hunk.lines_in_hunk
+            else:
+                runs.append([commit_hex, hunk.lines_in_hunk])
+        return runs
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+import os
+import zlib
+from binascii import unhexlify
+from os.path import exists
+from os.path import join
+
+from dulwich.pack import OFS_DELTA
+from dulwich.pack import REF_DELTA
+from dulwich.pack import load_pack_index
+
+DEFAULT_CHUNK_SIZE = 65536
+# enough for the header of a pack entry, and usually for the start of
+# its compressed data.
+HEADER_READ_SIZE = 512
+
+
+def blob_buffer(blob):
+    """
+    Return a memoryview over the contents of blob, without copying them
+    where pygit2 exposes the buffer of the underlying object.
+    """
+
+    try:
+        return memoryview(blob)
+    except TypeError:
+        return memoryview(blob.data)
+
+
+class BlobReader(object):
+    """
+    Read-only file-like access to the contents of a blob.  Iterating
+    over it yields the contents in chunks of chunk_size, starting from
+    the current position.
+    """
+
+    def __init__(self, blob, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._buffer = blob_buffer(blob)
+        self.size = len(self._buffer)
+        self._pos = 0
+        self.closed = False
+
+    def _check(self):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+    def read(self, size=-1):
+        self._check()
+        if size is None or size < 0:
+            end = self.size
+        else:
+            end = min(self._pos + size, self.size)
+        result = self._buffer[self._pos:end].tobytes()
+        self._pos = max(self._pos, end)
+        return result
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._check()
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError('invalid whence (%r)' % whence)
+        if pos < 0:
+            raise ValueError('negative seek position %d' % pos)
+        self._pos = pos
+        return pos
+
+    def tell(self):
+        self._check()
+        return self._pos
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self.closed = True
+        self._buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _varint(data, pos, shift=0, value=0):
+    # the little-endian base 128 numbers of pack and delta headers.
+    while True:
+        byte = ord(data[pos])
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        pos += 1
+        if not byte & 0x80:
+            return value, pos
+
+
+def _inflate_start(f, data, length):
+    # inflate at least length bytes from the zlib stream starting with
+    # data, reading more of it from f where needed.
+    d = zlib.decompressobj()
+    result = d.decompress(data, length)
+    while len(result) < length:
+        data = d.unconsumed_tail or f.read(HEADER_READ_SIZE)
+        if not data:
+            break
+        result += d.decompress(data, length - len(result))
+    return result
+
+
+def loose_object_size(filename):
+    """
+    Return the size of the object within the loose object file, from
+    its header.
+    """
+
+    with open(filename, 'rb') as f:
+        header = _inflate_start(f, f.read(HEADER_READ_SIZE), 32)
+    return int(header.split(b'\0', 1)[0].split(b' ')[1])
+
+
+def packed_object_size(filename, offset):
+    """
+    Return the size of the object at offset within the pack file, from
+    the header of its entry, which for deltas is the one found at the
+    start of the delta.
+    """
+
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        data = f.read(HEADER_READ_SIZE)
+        byte = ord(data[0])
+        type_num = (byte >> 4) & 0x07
+        size, pos = _varint(data, 1, 4, byte & 0x0f) if byte & 0x80 else (
+            byte & 0x0f, 1)
+        if type_num == OFS_DELTA:
+            pos = _varint(data, pos)[1]
+        elif type_num == REF_DELTA:
+            pos += 20
+        else:
+            return size
+        # the size of the base, then the one of the result.
+        delta = _inflate_start(f, data[pos:], 20)
+    return _varint(delta, _varint(delta, 0)[1])[0]
+
+
+class ObjectSizes(object):
+    """
+    Looks up the sizes of the objects of a repository from the headers
+    of their loose files or pack entries, so large blobs do not have to
+    be inflated for their size to be known.  Objects not found that way
+    (e.g. the ones within alternates) get loaded through pygit2.
+
+    The pack indexes are opened once, so an instance is meant for one
+    pass over a set of objects, to be closed after.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.objects = join(repo.path, 'objects')
+        self.packs = []
+        pack_dir = join(self.objects, 'pack')
+        names = sorted(os.listdir(pack_dir)) if exists(pack_dir) else []
+        for name in names:
+            if name.endswith('.idx'):
+                self.packs.append((
+                    load_pack_index(join(pack_dir, name)),
+                    join(pack_dir, name[:-4] + '.pack'),
+                ))
+
+    def __call__(self, hexsha):
+        try:
+            return self._header_size(hexsha)
+        except (IOError, OSError, ValueError, IndexError, zlib.error):
+            # a pack repacked away in the mean time, or something not
+            # understood.
+            return len(self.repo.read(hexsha)[1])
+
+    def _header_size(self, hexsha):
+        loose = join(self.objects, hexsha[:2], hexsha[2:])
+        if exists(loose):
+            return loose_object_size(loose)
+        binsha = unhexlify(hexsha)
+        for index, filename in self.packs:
+            try:
+                offset = index.object_index(binsha)
+            except KeyError:
+                continue
+            return packed_object_size(filename, offset)
+        return len(self.repo.read(hexsha)[1])
+
+    def close(self):
+        for index, filename in self.packs:
+            index.close()
+        self.packs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Changed-path Bloom filters for commits, in the spirit of the ones found
+in the commit-graph file of git.
+
+For every indexed commit there is a filter of the paths (and their
+parent directories) that differ from its first parent, which allows the
+history of a path to skip the commits that definitely did not touch it
+without diffing their trees.  The filters are kept in a single
+append-only file within the git directory::
+
+    header   'RDBF', version (<4sI)
+    records  raw commit id, filter size (<20sI), then the filter
+"""
+
+import struct
+from binascii import hexlify
+from binascii import unhexlify
+from hashlib import md5
+
+from .disk import RecordFile
+from .disk import data_path
+from .shallow import available_parents
+from .walk import as_bytes
+from .walk import changed_paths
+
+MAGIC = b'RDBF'
+VERSION = 1
+RECORD = struct.Struct('<20sI')
+HASH = struct.Struct('<II')
+
+BITS_PER_ENTRY = 10
+NUM_HASHES = 7
+# commits changing more paths than this get a filter that matches
+# everything, i.e. they always have to be checked.
+MAX_CHANGED_PATHS = 512
+
+
+def _hashes(path):
+    h1, h2 = HASH.unpack(md5(as_bytes(path)).digest()[:8])
+    return [h1 + i * h2 for i in range(NUM_HASHES)]
+
+
+def _with_parents(paths):
+    results = set()
+    for path in paths:
+        while path and path not in results:
+            results.add(path)
+            path = path.rpartition('/')[0]
+    return results
+
+
+def make_filter(paths):
+    """
+    Return the bloom filter (as bytes) for paths, and their parents.
+    """
+
+    paths = _with_parents(paths)
+    if len(paths) > MAX_CHANGED_PATHS:
+        return b''
+    nbits = max(64, len(paths) * BITS_PER_ENTRY)
+    nbits += -nbits % 8
+    bits = bytearray(nbits // 8)
+    for path in paths:
+        for h in _hashes(path):
+            pos = h % nbits
+            bits[pos // 8] |= 1 << (pos % 8)
+    return bytes(bits)
+
+
+def filter_contains(bloom, path):
+    """
+    Return False if path is definitely not within the bloom filter.
+    """
+
+    if not bloom:
+        # the filter that matches everything.
+        return True
+    nbits = len(bloom) * 8
+    bits = bytearray(bloom)
+    for h in _hashes(path):
+        pos = h % nbits
+        if not bits[pos // 8] & (1 << (pos % 8)):
+            return False
+    return True
+
+
+def _parse(data, pos):
+    if pos + RECORD.size > len(data):
+        return None
+    raw, size = RECORD.unpack_from(data, pos)
+    start = pos + RECORD.size
+    if start + size > len(data):
+        return None
+    return hexlify(raw), data[start:start + size], start + size
+
+
+class ChangedPathIndex(object):
+    """
+    The changed-path filters of the commits of a repository.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.filename = data_path(repo, 'bloom')
+        self.records = RecordFile(self.filename, MAGIC, VERSION, _parse)
+
+    def load(self):
+        """
+        Return the dict of the filters by commit id, for the lookups of
+        a query to be made without reading the file again.
+        """
+
+        return self.records.load()
+
+    def get(self, commit_hex):
+        """
+        Return the filter for the commit, or None if not indexed.
+        """
+
+        return self.load().get(commit_hex)
+
+    def maybe_changed(self, commit_hex, path, filters=None):
+        """
+        Return False if the commit definitely did not change path, True
+        if it may have, or None if the commit is not indexed.  filters
+        may be the ones already loaded.
+        """
+
+        if filters is None:
+            filters = self.load()
+        bloom = filters.get(commit_hex)
+        if bloom is None:
+            return None
+        return filter_contains(bloom, path)
+
+    def update(self, heads):
+        """
+        Index all the commits reachable from heads that have not been
+        indexed yet.  Returns the number of commits indexed.
+        """
+
+        filters = self.load()
+        records = []
+        pending = [h for h in heads if h not in filters]
+        seen = set(pending)
+        while pending:
+            commit = self.repo[pending.pop()]
+            parents = available_parents(self.repo, commit)
+            if parents:
+                bloom = make_filter(
+                    changed_paths(parents[0].tree, commit.tree))
+            else:
+                # root commits (or ones at a shallow boundary) have to
+                # be checked anyway.
+                bloom = b''
+            records.append(RECORD.pack(unhexlify(commit.hex), len(bloom)))
+            records.append(bloom)
+            for parent in parents:
+                if parent.hex in filters or parent.hex in seen:
+                    continue
+                seen.add(parent.hex)
+                pending.append(parent.hex)
+
+        if not records:
+            return 0
+
+        self.records.append(records)
+        return len(records) // 2
+
+
+def path_history(repo, walker, path, index=None):
+    """
+    Filter the commits produced by walker down to the ones that changed
+    path compared to all of their parents, using the filters in index
+    to skip the commits that definitely did not.
+    """
+
+    def entry_id(tree, path):
+        try:
+            return tree[path].hex
+        except KeyError:
+            return None
+
+    # loaded once, rather than for every commit.
+    filters = index.load() if index is not None else None
+    for commit in walker:
+        if filters is not None and index.maybe_changed(
+                commit.hex, path, filters) is False:
+            continue
+        current = entry_id(commit.tree, path)
+        parents = available_parents(repo, commit)
+        if not parents:
+            if current is not None:
+                yield commit
+            continue
+        for parent in parents:
+            if entry_id(parent.tree, path) == current:
+                # same as one parent, so the change came from there.
+                break
+        else:
+            yield commit
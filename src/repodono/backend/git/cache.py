@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from threading import RLock
+
+_marker = object()
+
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe mapping that evicts the least recently used
+    entry once maxsize is reached.  Keeps hit/miss/eviction counters so
+    the size can be tuned.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.pop(key, _marker)
+            if value is _marker:
+                self.misses += 1
+                return default
+            # reinsert to mark as most recently used.
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def items(self):
+        # a snapshot that does not affect ordering or the counters.
+        with self._lock:
+            return list(self._data.items())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
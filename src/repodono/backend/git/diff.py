@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Differences between trees, computed by libgit2.
+
+The changes are produced one file at a time from the diff of the two
+trees, optionally without the text of the patches.  The statistics of
+complete diffs are kept in a cache keyed by the ids of the two trees.
+"""
+
+from pygit2 import GIT_FILEMODE_TREE
+
+from .cache import LRUCache
+
+STATUSES = {
+    'A': 'added',
+    'C': 'copied',
+    'D': 'deleted',
+    'M': 'modified',
+    'R': 'renamed',
+    'T': 'typechange',
+}
+
+# the per file statistics of complete diffs, keyed by the pair of ids
+# of the trees diffed.
+DIFF_STATS_CACHE_SIZE = 256
+stats_cache = LRUCache(DIFF_STATS_CACHE_SIZE)
+
+
+def _join(base, path):
+    if not base:
+        return path
+    return '/'.join([base, path])
+
+
+def _entry(tree, path):
+    if tree is None:
+        return None
+    try:
+        return tree[path]
+    except KeyError:
+        return None
+
+
+def _subtree(repo, tree, path):
+    # the tree at path within tree, or None if it is not a tree.
+    if not path:
+        return tree
+    entry = _entry(tree, path)
+    if entry is None or entry.filemode != GIT_FILEMODE_TREE:
+        return None
+    return repo.get(entry.id)
+
+
+def _diff(old, new):
+    if old is None and new is None:
+        return []
+    if old is None:
+        return new.diff_to_tree(swap=True)
+    if new is None:
+        return old.diff_to_tree()
+    return old.diff_to_tree(new)
+
+
+def _patches(repo, old, new, paths):
+    # Yield (base, patch) for the patches of the diff between the trees,
+    # limited to paths, with base being the directory the paths within
+    # the patch are relative to.  Every path gets the diff between the
+    # trees at it or, for files, at its parent limited to the file.
+    if not paths:
+        for patch in _diff(old, new):
+            yield '', patch
+        return
+
+    normalized = sorted(set(
+        '/'.join(f for f in path.split('/') if f) for path in paths))
+    done = []
+    for path in normalized:
+        if any(not p or path.startswith(p + '/') for p in done):
+            # already covered by a parent.
+            continue
+        done.append(path)
+
+        if not path:
+            for patch in _diff(old, new):
+                yield '', patch
+            continue
+
+        entries = (_entry(old, path), _entry(new, path))
+        if (all(e is None or e.filemode == GIT_FILEMODE_TREE
+                for e in entries) and any(entries)):
+            subtrees = [e and repo.get(e.id) for e in entries]
+            for patch in _diff(*subtrees):
+                yield path, patch
+            continue
+
+        base, _, name = path.rpartition('/')
+        for patch in _diff(
+                _subtree(repo, old, base), _subtree(repo, new, base)):
+            delta = patch.delta
+            for p in (delta.old_file.path, delta.new_file.path):
+                if p == name or p.startswith(name + '/'):
+                    yield base, patch
+                    break
+
+
+def _patch_text(patch):
+    text = getattr(patch, 'text', None)
+    if text is None:
+        text = patch.patch
+    return text
+
+
+def iter_diff(repo, old, new, paths=None, stats_only=False):
+    """
+    Yield a dict for every file that differs between the trees old and
+    new (either may be None for the empty tree), optionally limited to
+    the ones at or under paths.  The text of the patch is included
+    unless stats_only is set.
+    """
+
+    for base, patch in _patches(repo, old, new, paths):
+        delta = patch.delta
+        context, additions, deletions = patch.line_stats
+        result = {
+            'status': STATUSES.get(delta.status_char(), 'modified'),
+            'old_path': _join(base, delta.old_file.path),
+            'new_path': _join(base, delta.new_file.path),
+            'old_id': delta.old_file.id.hex,
+            'new_id': delta.new_file.id.hex,
+            'binary': bool(delta.is_binary),
+            'additions': additions,
+            'deletions': deletions,
+        }
+        if not stats_only:
+            result['patch'] = _patch_text(patch)
+        yield result
+
+
+def _summarize(files):
+    return {
+        'files': files,
+        'files_changed': len(files),
+        'additions': sum(f['additions'] for f in files),
+        'deletions': sum(f['deletions'] for f in files),
+    }
+
+
+def _key(old, new):
+    return (old and old.hex, new and new.hex)
+
+
+def diff_stats(repo, old, new):
+    """
+    Return the statistics of the diff between the trees old and new,
+    as a dict with the per file entries of iter_diff (without the
+    patches) as files, and the totals of additions, deletions and
+    files_changed.
+    """
+
+    key = _key(old, new)
+    stats = stats_cache.get(key)
+    if stats is None:
+        stats = _summarize(list(iter_diff(repo, old, new, stats_only=True)))
+        stats_cache.put(key, stats)
+    return stats
+
+
+def cached_iter_diff(repo, old, new, paths=None, stats_only=False):
+    """
+    iter_diff, with the statistics of complete diffs served from (and
+    once iterated completely, recorded into) the cache.
+    """
+
+    if not stats_only or paths:
+        return iter_diff(repo, old, new, paths, stats_only)
+
+    key = _key(old, new)
+    stats = stats_cache.get(key)
+    if stats is not None:
+        return iter([dict(f) for f in stats['files']])
+
+    def record():
+        files = []
+        for result in iter_diff(repo, old, new, stats_only=True):
+            files.append(dict(result))
+            yield result
+        stats_cache.put(key, _summarize(files))
+
+    return record()
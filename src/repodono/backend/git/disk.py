@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for the data kept next to a repository, within its git dir.
+"""
+
+import os
+import struct
+from contextlib import contextmanager
+from os.path import exists
+from os.path import join
+from tempfile import mkstemp
+from threading import Lock
+
+from .cache import LRUCache
+
+DATA_DIR = 'repodono'
+HEADER = struct.Struct('<4sI')
+# the number of files to keep the records of loaded.
+LOADED_FILES = 32
+
+
+def data_path(repo, *names):
+    """
+    Return the path to names within the data directory of repo.
+    """
+
+    return join(repo.path, DATA_DIR, *names)
+
+
+def ensure_dir(path):
+    if exists(path):
+        return
+    try:
+        os.makedirs(path)
+    except OSError:
+        # created by someone else in the mean time.
+        if not exists(path):
+            raise
+
+
+@contextmanager
+def atomic_write(filename):
+    """
+    Yield a file object which replaces filename once the block has been
+    completed successfully, so the file will either show up complete or
+    not at all.
+    """
+
+    root = os.path.dirname(filename)
+    ensure_dir(root)
+    fd, tmp = mkstemp(dir=root)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.rename(tmp, filename)
+    finally:
+        if exists(tmp):
+            os.unlink(tmp)
+
+
+class RecordFile(object):
+    """
+    An append-only file of records following a header of magic and
+    version (<4sI).  The records read so far are shared by the readers
+    of the same file within the process, so loading only reads what
+    got appended since, for up to LOADED_FILES recently used files.
+
+    parse is called with the data and a position within it, and returns
+    the key, the value and the end of the record found there, or None
+    if that record is incomplete.
+    """
+
+    # filename to the records loaded and the position read up to.
+    _loaded = LRUCache(LOADED_FILES)
+    _lock = Lock()
+
+    def __init__(self, filename, magic, version, parse):
+        self.filename = filename
+        self.magic = magic
+        self.version = version
+        self.parse = parse
+
+    def load(self):
+        """
+        Return the dict of the records, including the ones appended
+        since the last load.  Raises ValueError if the file has an
+        unexpected header.
+        """
+
+        with self._lock:
+            records, offset, ino = self._loaded.get(
+                self.filename) or ({}, 0, None)
+            try:
+                st = os.stat(self.filename)
+            except OSError:
+                return records
+            if st.st_ino != ino or st.st_size < offset:
+                # the file got recreated or rewritten.
+                records, offset = {}, 0
+            with open(self.filename, 'rb') as f:
+                if not offset:
+                    header = f.read(HEADER.size)
+                    if len(header) < HEADER.size or HEADER.unpack(
+                            header) != (self.magic, self.version):
+                        raise ValueError('unexpected header in %s' % (
+                            self.filename))
+                    offset = HEADER.size
+                f.seek(offset)
+                data = f.read()
+            pos = 0
+            while True:
+                record = self.parse(data, pos)
+                if record is None:
+                    # the end, or an incomplete record from a concurrent
+                    # writer which will be read once complete.
+                    break
+                key, value, pos = record
+                records[key] = value
+            self._loaded.put(self.filename, (records, offset + pos, st.st_ino))
+            return records
+
+    def append(self, chunks):
+        """
+        Append the records already packed within chunks.
+        """
+
+        with self._lock:
+            ensure_dir(os.path.dirname(self.filename))
+            new = not exists(self.filename)
+            with open(self.filename, 'ab') as f:
+                if new:
+                    f.write(HEADER.pack(self.magic, self.version))
+                f.write(b''.join(chunks))
+
+    def rewrite(self, chunks):
+        """
+        Replace the file with one holding only the records already
+        packed within chunks.
+        """
+
+        with self._lock:
+            with atomic_write(self.filename) as f:
+                f.write(HEADER.pack(self.magic, self.version))
+                f.write(b''.join(chunks))
+            self._loaded.pop(self.filename, None)
+
+    def remove(self):
+        with self._lock:
+            self._loaded.pop(self.filename, None)
+            if exists(self.filename):
+                os.unlink(self.filename)
@@ -1,4 +1,9 @@
 # -*- coding: utf-8 -*-
+from .cache import LRUCache
+
+GITMODULES_CACHE_SIZE = 1024
+# the parsed .gitmodules files, keyed by the id of their blob.
+gitmodules_cache = LRUCache(GITMODULES_CACHE_SIZE)
 
 
 def parse_gitmodules(raw):
@@ -42,3 +47,47 @@ def parse_gitmodules(raw):
         add_result()
 
     return result
+
+
+class GitModules(dict):
+    """
+    The mapping of the paths of the submodules to their locations, as
+    parsed from a .gitmodules file, which also finds the submodule that
+    contains a given path.
+    """
+
+    def __init__(self, *a, **kw):
+        super(GitModules, self).__init__(*a, **kw)
+        # the numbers of path fragments of the submodules, shortest
+        # first, so only those prefixes of a path need to be checked.
+        self.depths = sorted(set(len(p.split('/')) for p in self))
+
+    def lookup(self, path):
+        """
+        Return a tuple of the path to the submodule containing path,
+        its location and the remainder of path within the submodule,
+        or None if path is not within any of the submodules.
+        """
+
+        fragments = path.split('/')
+        for depth in self.depths:
+            if depth > len(fragments):
+                break
+            prefix = '/'.join(fragments[:depth])
+            if prefix in self:
+                return prefix, self[prefix], '/'.join(fragments[depth:])
+        return None
+
+
+def load_gitmodules(repo, blob_id):
+    """
+    Return the GitModules for the .gitmodules blob with blob_id within
+    repo, parsing it only once.
+    """
+
+    key = (repo.path, blob_id.hex)
+    result = gitmodules_cache.get(key)
+    if result is None:
+        result = GitModules(parse_gitmodules(repo.get(blob_id).data))
+        gitmodules_cache.put(key, result)
+    return result
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+Generation numbered commit graph for answering ancestry queries.
+
+The parents, commit time and generation number (1 for root commits,
+otherwise one more than the highest of the parents) of the commits are
+read from the commit-graph file written by git where available, with
+the commits not found there inflated once and recorded within an
+append-only file under the git directory::
+
+    header   'RDCG', version (<4sI)
+    records  raw id, generation, time, number of parents (<20sIqB),
+             then the raw id of every parent
+
+Walks ordered by generation can stop as soon as the answer is known,
+without ever reaching the root commits.
+"""
+
+import mmap
+import struct
+from binascii import hexlify
+from binascii import unhexlify
+from heapq import heappop
+from heapq import heappush
+from os.path import exists
+from os.path import getmtime
+from os.path import join
+from threading import Lock
+
+from pygit2 import Commit
+from pygit2 import Tag
+
+from .disk import RecordFile
+from .disk import data_path
+
+MAGIC = b'RDCG'
+VERSION = 1
+RECORD = struct.Struct('<20sIqB')
+
+GIT_GRAPH_SIGNATURE = b'CGPH'
+GIT_GRAPH_NO_PARENT = 0x70000000
+GIT_GRAPH_EXTRA_EDGES = 0x80000000
+GIT_GRAPH_LAST_EDGE = 0x80000000
+
+
+def peel_commit(repo, obj):
+    """
+    Return the commit that obj, which may be an annotated tag, points
+    to.  Raises KeyError if that is not a commit.
+    """
+
+    while isinstance(obj, Tag):
+        obj = repo[obj.target]
+    if not isinstance(obj, Commit):
+        raise KeyError('not a commit')
+    return obj
+
+
+def _parse(data, pos):
+    if pos + RECORD.size > len(data):
+        return None
+    raw, generation, time, nparents = RECORD.unpack_from(data, pos)
+    end = pos + RECORD.size + 20 * nparents
+    if end > len(data):
+        return None
+    parents = tuple(
+        hexlify(data[i:i + 20]) for i in range(pos + RECORD.size, end, 20))
+    return hexlify(raw), (generation, time, parents), end
+
+
+class GitCommitGraphFile(object):
+    """
+    Reader for the commit-graph file written by git (version 1).
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        signature, version, hash_version, num_chunks = struct.unpack_from(
+            '>4sBBB', self.buf, 0)
+        if (signature != GIT_GRAPH_SIGNATURE or version != 1 or
+                hash_version != 1):
+            raise ValueError('unsupported commit-graph file')
+
+        chunks = {}
+        for i in range(num_chunks):
+            chunk_id, offset = struct.unpack_from('>4sQ', self.buf, 8 + 12 * i)
+            chunks[chunk_id] = offset
+        try:
+            self._fanout = chunks[b'OIDF']
+            self._oids = chunks[b'OIDL']
+            self._data = chunks[b'CDAT']
+        except KeyError:
+            raise ValueError('incomplete commit-graph file')
+        self._edges = chunks.get(b'EDGE')
+        self.count = struct.unpack_from('>I', self.buf, self._fanout + 1020)[0]
+
+    def _oid(self, pos):
+        start = self._oids + 20 * pos
+        return self.buf[start:start + 20]
+
+    def _position(self, raw):
+        first = ord(raw[0])
+        lo = 0
+        if first:
+            lo = struct.unpack_from(
+                '>I', self.buf, self._fanout + 4 * (first - 1))[0]
+        hi = struct.unpack_from('>I', self.buf, self._fanout + 4 * first)[0]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self._oid(mid)
+            if value < raw:
+                lo = mid + 1
+            elif value > raw:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def lookup(self, hexsha):
+        """
+        Return (generation, time, parents) for the commit, or None.
+        """
+
+        pos = self._position(unhexlify(hexsha))
+        if pos is None:
+            return None
+        p1, p2, high, low = struct.unpack_from(
+            '>II II', self.buf, self._data + 36 * pos + 20)
+        parents = []
+        if p1 != GIT_GRAPH_NO_PARENT:
+            parents.append(p1)
+        if p2 & GIT_GRAPH_EXTRA_EDGES:
+            i = p2 & ~GIT_GRAPH_EXTRA_EDGES
+            while True:
+                edge = struct.unpack_from(
+                    '>I', self.buf, self._edges + 4 * i)[0]
+                parents.append(edge & ~GIT_GRAPH_LAST_EDGE)
+                if edge & GIT_GRAPH_LAST_EDGE:
+                    break
+                i += 1
+        elif p2 != GIT_GRAPH_NO_PARENT:
+            parents.append(p2)
+
+        generation = high >> 2
+        if not generation:
+            # not computed by the version of git that wrote this.
+            return None
+        time = ((high & 3) << 32) | low
+        return generation, time, tuple(hexlify(self._oid(p)) for p in parents)
+
+
+class CommitGraph(object):
+    """
+    Ancestry queries over the commits of a repository.
+    """
+
+    # the commit-graph files of git, along with their mtime.
+    _git_files = {}
+    _lock = Lock()
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.filename = data_path(repo, 'commit-graph')
+        self.records = RecordFile(self.filename, MAGIC, VERSION, _parse)
+        self.git_filename = join(repo.path, 'objects', 'info', 'commit-graph')
+
+    def _git_file(self):
+        if not exists(self.git_filename):
+            return None
+        mtime = getmtime(self.git_filename)
+        # so concurrent queries load a changed file once, the first one
+        # holding the others until it is done.
+        with self._lock:
+            graph_file, loaded_mtime = self._git_files.get(
+                self.git_filename, (None, None))
+            if loaded_mtime != mtime:
+                try:
+                    graph_file = GitCommitGraphFile(self.git_filename)
+                except (ValueError, struct.error):
+                    graph_file = None
+                self._git_files[self.git_filename] = (graph_file, mtime)
+        return graph_file
+
+    def _state(self):
+        # what a query looks the commits up within, loaded once for all
+        # of its lookups: the records, the ones inflated during the
+        # query and the commit-graph file of git.
+        return self.records.load(), {}, self._git_file()
+
+    def _lookup(self, hexsha, state):
+        records, inflated, graph_file = state
+        node = records.get(hexsha) or inflated.get(hexsha)
+        if node is None and graph_file is not None:
+            node = graph_file.lookup(hexsha)
+        return node
+
+    def node(self, hexsha, state=None):
+        """
+        Return (generation, time, parents) for the commit, inflating it
+        and its ancestors not found in the graph.  Raises KeyError for
+        commits not in the repository.
+        """
+
+        if state is None:
+            state = self._state()
+        node = self._lookup(hexsha, state)
+        if node is not None:
+            return node
+
+        new = {}
+        inflated = {}
+        stack = [hexsha]
+        while stack:
+            current = stack[-1]
+            if current in new or self._lookup(current, state):
+                stack.pop()
+                continue
+            if current not in inflated:
+                commit = self.repo[current]
+                if not isinstance(commit, Commit):
+                    raise KeyError('not a commit')
+                inflated[current] = (commit.commit_time, tuple(
+                    # skip those beyond a shallow boundary.
+                    p.hex for p in commit.parent_ids if p.hex in self.repo))
+            time, parents = inflated[current]
+            missing = [
+                p for p in parents
+                if p not in new and self._lookup(p, state) is None
+            ]
+            if missing:
+                stack.extend(missing)
+                continue
+            generation = 1 + max([0] + [
+                (new.get(p) or self._lookup(p, state))[0] for p in parents
+            ])
+            new[current] = (generation, time, parents)
+            stack.pop()
+
+        self._save(new)
+        state[1].update(new)
+        return new[hexsha]
+
+    def _save(self, nodes):
+        data = []
+        for hexsha, (generation, time, parents) in nodes.items():
+            data.append(RECORD.pack(
+                unhexlify(hexsha), generation, time, len(parents)))
+            data.extend(unhexlify(p) for p in parents)
+        self.records.append(data)
+
+    def reset(self):
+        """
+        Forget the commits inflated so far, as needed once the shallow
+        boundary moved and the parents of the commits there changed.
+        """
+
+        self.records.remove()
+
+    def generation(self, hexsha, state=None):
+        return self.node(hexsha, state)[0]
+
+    def parents(self, hexsha, state=None):
+        return self.node(hexsha, state)[2]
+
+    def is_ancestor(self, ancestor, descendant):
+        """
+        Return True if ancestor is reachable from (or is) descendant.
+        """
+
+        if ancestor == descendant:
+            return True
+        state = self._state()
+        cutoff = self.generation(ancestor, state)
+        stack = [descendant]
+        seen = set(stack)
+        while stack:
+            current = stack.pop()
+            for parent in self.parents(current, state):
+                if parent == ancestor:
+                    return True
+                if parent in seen or self.generation(
+                        parent, state) <= cutoff:
+                    # commits at or below the generation of ancestor
+                    # other than itself can't lead to it.
+                    continue
+                seen.add(parent)
+                stack.append(parent)
+        return False
+
+    def _paint(self, a, b, until_common=False):
+        # Walk down from a and b in generation order, marking commits
+        # with the ones they are reachable from, so that every commit
+        # is complete when it is reached.  Yields (commit, flags).
+        state = self._state()
+        flags = {a: 1}
+        flags[b] = flags.get(b, 0) | 2
+        heap = []
+        for c in flags:
+            heappush(heap, (-self.generation(c, state), c))
+        uncommon = set(c for c in flags if flags[c] != 3)
+        while heap:
+            if not uncommon and not until_common:
+                # everything else is reachable from both.
+                return
+            current = heappop(heap)[1]
+            uncommon.discard(current)
+            f = flags[current]
+            yield current, f
+            for parent in self.parents(current, state):
+                old = flags.get(parent, 0)
+                new = old | f
+                if new == old:
+                    continue
+                flags[parent] = new
+                if not old:
+                    heappush(heap, (-self.generation(parent, state), parent))
+                if new == 3:
+                    uncommon.discard(parent)
+                else:
+                    uncommon.add(parent)
+
+    def merge_base(self, a, b):
+        """
+        Return a best common ancestor of a and b, or None.
+        """
+
+        for current, flags in self._paint(a, b, until_common=True):
+            if flags == 3:
+                return current
+        return None
+
+    def ahead_behind(self, a, b):
+        """
+        Return the number of commits reachable from a but not from b,
+        and the number reachable from b but not from a.
+        """
+
+        ahead = behind = 0
+        for current, flags in self._paint(a, b):
+            if flags == 1:
+                ahead += 1
+            elif flags == 2:
+                behind += 1
+        return ahead, behind
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import re
+from heapq import heappop
+from heapq import heappush
+from itertools import count
+
+_cursor_re = re.compile(
+    '^([0-9a-f]{40}(?:\\.[0-9a-f]{40})*)'
+    '(?:~(-?[0-9]+)((?:\\.[0-9a-f]{40})+))?$')
+
+
+class HistoryWalker(object):
+    """
+    Walk the history from a set of heads, newest commit first, in the
+    same fashion as GIT_SORT_TIME.  Commits with the same time are
+    produced in the order they were reached, and a commit dated after
+    the one it was reached from is taken as having its time, so it is
+    not produced before it.
+
+    Unlike the libgit2 walker, the pending commits are accessible, so
+    a walk can be suspended into a cursor and be resumed from it later
+    without having to walk over the commits produced before.  Only the
+    commits produced at the time of the last one may be reached again
+    from the pending ones, so the cursor lists these to be skipped.
+    """
+
+    def __init__(self, repo, heads, stop_time=None, stop=()):
+        self.repo = repo
+        self._heap = []
+        self._seen = set()
+        self._counter = count()
+        # the commits produced before the cursor, to be skipped, and
+        # the ones produced at the time of the last one.
+        self._skip = set(stop)
+        self._time = stop_time
+        self._tied = set(stop)
+        for head in heads:
+            self._push(head, stop_time)
+
+    @classmethod
+    def from_cursor(cls, repo, cursor):
+        match = _cursor_re.match(cursor)
+        if not match:
+            raise ValueError('invalid cursor')
+        heads, stop_time, stop = match.groups()
+        if stop_time is None:
+            return cls(repo, heads.split('.'))
+        return cls(repo, heads.split('.'), int(stop_time), stop[1:].split('.'))
+
+    def _push(self, oid, limit):
+        key = getattr(oid, 'hex', oid)
+        if key in self._seen:
+            return
+        self._seen.add(key)
+        try:
+            commit = self.repo[oid]
+        except (KeyError, ValueError):
+            # not available locally, i.e. beyond a shallow boundary.
+            return
+        time = commit.commit_time
+        if limit is not None:
+            time = min(time, limit)
+        if key in self._skip:
+            # produced before the cursor, but its parents may not be.
+            for parent_id in commit.parent_ids:
+                self._push(parent_id, time)
+            return
+        heappush(self._heap, (-time, next(self._counter), commit))
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if not self._heap:
+            raise StopIteration
+        time, _, commit = heappop(self._heap)
+        time = -time
+        for parent_id in commit.parent_ids:
+            self._push(parent_id, time)
+        if time != self._time:
+            self._time = time
+            self._tied = set()
+        self._tied.add(commit.hex)
+        return commit
+
+    __next__ = next
+
+    def cursor(self):
+        """
+        Return the cursor for resuming this walk, or None if the walk
+        is completed.
+        """
+
+        if not self._heap:
+            return None
+        heads = '.'.join(item[2].hex for item in sorted(self._heap))
+        if self._time is None:
+            return heads
+        return '%s~%d.%s' % (heads, self._time, '.'.join(sorted(self._tied)))
@@ -6,3 +6,16 @@ from zope.publisher.interfaces.browser import IDefaultBrowserLayer
 
 class IRepodonoBackendGitLayer(IDefaultBrowserLayer):
     """Marker interface that defines a browser layer."""
+
+
+class FetchError(ValueError):
+    """
+    Failure to fetch from a remote, with the remote_id and the error
+    that caused it, if any, as cause.
+    """
+
+    def __init__(self, remote_id, cause=None):
+        super(FetchError, self).__init__(
+            'error fetching from remote: %s' % remote_id)
+        self.remote_id = remote_id
+        self.cause = cause
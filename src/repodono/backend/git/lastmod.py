@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""
+Index of the last commit that modified each path.
+
+For every indexed commit the paths it changed compared to its first
+parent (directories included, with the empty string being the root) are
+recorded as a delta, within a single append-only file::
+
+    header   'RDLD', version (<4sI)
+    records  raw id, raw id of the first parent (zeros for none), time,
+             offset, distance, size of data (<20s20sqiII), then the data
+             being the paths prefixed by '+' if changed or by '-' if
+             deleted, each followed by a NUL byte
+
+The last commit that modified a path is found by going back along the
+first parents until a delta has the path.  To bound that walk, the
+whole mapping is written as a checkpoint at the root commits (and the
+ones at a shallow boundary) and then every CHECKPOINT_INTERVAL commits
+along the first parents, distance being the number of commits since the
+last checkpoint.  A checkpoint is a sorted table in a file of its own::
+
+    header   'RDLC', version, number of commits, count, size of the
+             path table (<4sIIII)
+    commits  raw id, time, offset (<20sqi) of every commit referred to
+    records  count * (path offset, path length, commit index) (<III)
+    paths    all the paths, concatenated
+
+So a new commit only costs a delta of the paths it changed, plus a
+checkpoint once in a while.
+"""
+
+import mmap
+import os
+import struct
+from binascii import hexlify
+from binascii import unhexlify
+from os.path import exists
+from os.path import join
+from shutil import rmtree
+
+from .cache import LRUCache
+from .disk import RecordFile
+from .disk import atomic_write
+from .disk import data_path
+from .shallow import available_parents
+from .walk import as_bytes
+from .walk import changed_paths
+from .walk import walk_tree
+
+MAGIC = b'RDLD'
+VERSION = 1
+RECORD = struct.Struct('<20s20sqiII')
+CHECKPOINT_MAGIC = b'RDLC'
+CHECKPOINT_VERSION = 1
+CHECKPOINT_HEADER = struct.Struct('<4sIIII')
+CHECKPOINT_COMMIT = struct.Struct('<20sqi')
+CHECKPOINT_RECORD = struct.Struct('<III')
+
+CHECKPOINT_INTERVAL = 1024
+NO_PARENT = b'\0' * 20
+
+# open (memory mapped) checkpoints, keyed by their file path.
+checkpoint_cache = LRUCache(16)
+
+
+def _parents(path):
+    # yields the path and all its parent directories, up to the root.
+    while path:
+        yield path
+        path = path.rpartition(b'/')[0]
+    yield b''
+
+
+def _parse(data, pos):
+    if pos + RECORD.size > len(data):
+        return None
+    raw, parent, time, offset, distance, size = RECORD.unpack_from(
+        data, pos)
+    start = pos + RECORD.size
+    if start + size > len(data):
+        return None
+    parent = None if parent == NO_PARENT else hexlify(parent)
+    # with a leading NUL, so every entry is found as NUL, flag, path, NUL.
+    return hexlify(raw), (
+        parent, time, offset, distance, b'\0' + data[start:start + size],
+    ), start + size
+
+
+def _pack(commit_hex, parent_hex, time, offset, distance, data):
+    parent = unhexlify(parent_hex) if parent_hex else NO_PARENT
+    return [
+        RECORD.pack(
+            unhexlify(commit_hex), parent, time, offset, distance,
+            len(data)),
+        data,
+    ]
+
+
+def _apply(mapping, entries, value):
+    for entry in entries:
+        if entry[:1] == b'-':
+            mapping.pop(entry[1:], None)
+        else:
+            mapping[entry[1:]] = value
+
+
+class Checkpoint(object):
+    """
+    Read-only view of a checkpoint file.
+    """
+
+    def __init__(self, buf):
+        magic, version, ncommits, count, pathsize = (
+            CHECKPOINT_HEADER.unpack_from(buf, 0))
+        if magic != CHECKPOINT_MAGIC or version != CHECKPOINT_VERSION:
+            raise ValueError('not a last modified checkpoint')
+        self.buf = buf
+        self.count = count
+        self._commits_offset = CHECKPOINT_HEADER.size
+        self._records_offset = (
+            self._commits_offset + CHECKPOINT_COMMIT.size * ncommits)
+        self._paths_offset = (
+            self._records_offset + CHECKPOINT_RECORD.size * count)
+
+    @classmethod
+    def open(cls, filename):
+        with open(filename, 'rb') as fd:
+            buf = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buf)
+
+    def _record(self, i):
+        return CHECKPOINT_RECORD.unpack_from(
+            self.buf, self._records_offset + CHECKPOINT_RECORD.size * i)
+
+    def path(self, i):
+        offset, length = self._record(i)[:2]
+        start = self._paths_offset + offset
+        return self.buf[start:start + length]
+
+    def commit(self, i):
+        raw, time, offset = CHECKPOINT_COMMIT.unpack_from(
+            self.buf, self._commits_offset + CHECKPOINT_COMMIT.size * i)
+        return hexlify(raw), time, offset
+
+    def find(self, path):
+        """
+        Return the (id, time, offset) for path, or None.
+        """
+
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.path(mid) < path:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self.path(lo) == path:
+            return self.commit(self._record(lo)[2])
+        return None
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.path(i), self.commit(self._record(i)[2])
+
+
+class LastModifiedIndex(object):
+    """
+    The last modified index of a repository, stored within the git
+    directory of the repository.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.root = data_path(repo, 'lastmod')
+        self.records = RecordFile(
+            join(self.root, 'deltas'), MAGIC, VERSION, _parse)
+
+    def filename(self, commit_hex):
+        return join(self.root, commit_hex)
+
+    def checkpoint(self, commit_hex):
+        filename = self.filename(commit_hex)
+        checkpoint = checkpoint_cache.get(filename)
+        if checkpoint is None:
+            checkpoint = Checkpoint.open(filename)
+            checkpoint_cache.put(filename, checkpoint)
+        return checkpoint
+
+    def indexed(self, commit_hex):
+        return commit_hex in self.records.load()
+
+    def _remove_checkpoint(self, commit_hex):
+        filename = self.filename(commit_hex)
+        checkpoint_cache.pop(filename)
+        if exists(filename):
+            os.unlink(filename)
+
+    def reset(self):
+        """
+        Remove the whole index, as needed once the shallow boundary
+        moved.
+        """
+
+        self.records.remove()
+        for key, value in checkpoint_cache.items():
+            if key.startswith(self.root):
+                checkpoint_cache.pop(key)
+        if exists(self.root):
+            rmtree(self.root)
+
+    def _extend(self, commit_hex, records):
+        # index commit from its nearest indexed first parent ancestor,
+        # e.g. for the commits that arrived through a push, returning
+        # whether there was one.
+        try:
+            commit = self.repo[commit_hex]
+        except (KeyError, ValueError):
+            return False
+        current = commit
+        while current.hex not in records:
+            parents = available_parents(self.repo, current)
+            if not parents:
+                return False
+            current = parents[0]
+        self.update(commit)
+        return True
+
+    def lookup(self, commit_hex, paths):
+        """
+        Return a dict of path to (id, time, offset) of the last commit
+        that modified it, for the paths known to the index of commit.
+        A commit not indexed yet gets indexed first if any of its first
+        parent ancestors is.
+        """
+
+        records = self.records.load()
+        if commit_hex not in records:
+            if not self._extend(commit_hex, records):
+                return {}
+            records = self.records.load()
+        remaining = dict((as_bytes(path), path) for path in paths)
+        results = {}
+        current = commit_hex
+        while remaining and current in records:
+            parent, time, offset, distance, data = records[current]
+            if not distance:
+                checkpoint = self.checkpoint(current)
+                for key, path in remaining.items():
+                    value = checkpoint.find(key)
+                    if value is not None:
+                        results[path] = value
+                break
+            for key, path in list(remaining.items()):
+                if (b'\0-' + key + b'\0') in data:
+                    # deleted, so not there from here on.
+                    del remaining[key]
+                elif (b'\0+' + key + b'\0') in data:
+                    results[path] = (current, time, offset)
+                    del remaining[key]
+            current = parent
+        return results
+
+    def mapping(self, commit_hex):
+        """
+        Return the whole index of an indexed commit as a dict of path
+        to (id, time, offset), from its checkpoint and the deltas since.
+        """
+
+        records = self.records.load()
+        chain = []
+        current = commit_hex
+        while records[current][3]:
+            chain.append(current)
+            current = records[current][0]
+        mapping = dict(self.checkpoint(current))
+        for c in reversed(chain):
+            parent, time, offset, distance, data = records[c]
+            _apply(mapping, data[1:].split(b'\0')[:-1], (c, time, offset))
+        return mapping
+
+    def _write_checkpoint(self, commit_hex, mapping):
+        commits = {}
+        table = []
+        paths = []
+        offset = 0
+        for path, value in sorted(mapping.items()):
+            index = commits.setdefault(value, len(commits))
+            table.append(CHECKPOINT_RECORD.pack(offset, len(path), index))
+            paths.append(path)
+            offset += len(path)
+        ordered = sorted(commits, key=commits.get)
+        with atomic_write(self.filename(commit_hex)) as f:
+            f.write(CHECKPOINT_HEADER.pack(
+                CHECKPOINT_MAGIC, CHECKPOINT_VERSION, len(ordered),
+                len(table), offset))
+            f.write(b''.join(
+                CHECKPOINT_COMMIT.pack(unhexlify(c), time, tz)
+                for c, time, tz in ordered))
+            f.write(b''.join(table))
+            f.write(b''.join(paths))
+
+    def _entries(self, parent, commit):
+        # the changed paths with their parents, and the deleted ones,
+        # which come last as they take precedence.
+        entries = set()
+        for path in changed_paths(parent.tree, commit.tree):
+            path = as_bytes(path)
+            for parent_path in _parents(path):
+                entries.add(b'+' + parent_path)
+            try:
+                commit.tree[path]
+            except KeyError:
+                entries.add(b'-' + path)
+        return sorted(entries, key=lambda e: (e[:1] == b'-', e))
+
+    def update(self, commit):
+        """
+        Index commit and its first parent ancestors not indexed yet.
+        Returns the number of commits indexed.
+        """
+
+        records = self.records.load()
+        pending = []
+        base = None
+        current = commit
+        while current.hex not in records:
+            pending.append(current)
+            parents = available_parents(self.repo, current)
+            if not parents:
+                break
+            current = parents[0]
+        else:
+            base = current.hex
+        if not pending:
+            return 0
+
+        distance = records[base][3] if base else 0
+        mapping = None
+        if base and distance + len(pending) >= CHECKPOINT_INTERVAL:
+            # a checkpoint will be due along the way.
+            mapping = self.mapping(base)
+
+        chunks = []
+        parent_hex = base
+        for c in reversed(pending):
+            value = (c.hex, c.committer.time, c.committer.offset)
+            parents = available_parents(self.repo, c)
+            if parents:
+                entries = self._entries(parents[0], c)
+                distance += 1
+                if mapping is not None:
+                    _apply(mapping, entries, value)
+            else:
+                # root commits, and the ones at a shallow boundary, are
+                # taken as having added everything.
+                parent_hex = None
+                mapping = {}
+                for path, entry in walk_tree(self.repo, c.tree):
+                    for parent_path in _parents(as_bytes(path)):
+                        mapping[parent_path] = value
+                mapping.setdefault(b'', value)
+                distance = CHECKPOINT_INTERVAL
+
+            if distance >= CHECKPOINT_INTERVAL:
+                self._write_checkpoint(c.hex, mapping)
+                distance = 0
+                data = b''
+            else:
+                data = b''.join(entry + b'\0' for entry in entries)
+            chunks.extend(_pack(
+                c.hex, parent_hex, value[1], value[2], distance, data))
+            parent_hex = c.hex
+
+        self.records.append(chunks)
+        return len(pending)
+
+    def gc(self, heads):
+        """
+        Drop the deltas and checkpoints of the indexed commits that are
+        not along the first parents of heads, e.g. the ones of branches
+        that got rewritten or removed.  Returns the number dropped.
+        """
+
+        # a copy, as concurrent loads add to the shared records.
+        records = dict(self.records.load())
+        live = set()
+        for head in heads:
+            current = head
+            while current in records and current not in live:
+                live.add(current)
+                current = records[current][0]
+        dropped = [c for c in records if c not in live]
+        if not dropped:
+            return 0
+
+        chunks = []
+        for c in live:
+            parent, time, offset, distance, data = records[c]
+            chunks.extend(_pack(c, parent, time, offset, distance, data[1:]))
+        self.records.rewrite(chunks)
+        for c in dropped:
+            if not records[c][3]:
+                self._remove_checkpoint(c)
+        return len(dropped)
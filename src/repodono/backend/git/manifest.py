@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent file manifests for root trees.
+
+A manifest is a sorted array of every non-tree entry within a root tree,
+stored in a single file next to the repository as::
+
+    header   'RDMF', version, count, size of the path table (<4sIII)
+    records  count * (path offset, path length, raw id, size, mode)
+    paths    all the paths, concatenated
+
+Paths are sorted bytewise, which for full paths is the same ordering as
+a depth-first walk of the tree in git tree order.
+"""
+
+import mmap
+import os
+import struct
+from binascii import hexlify
+from binascii import unhexlify
+from os.path import exists
+from os.path import join
+
+from pygit2 import GIT_FILEMODE_COMMIT
+
+from .blobio import ObjectSizes
+from .cache import LRUCache
+from .disk import atomic_write
+from .disk import data_path
+from .shallow import available_parents
+from .walk import as_bytes
+from .walk import diff_deltas
+from .walk import walk_tree
+
+MAGIC = b'RDMF'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')
+RECORD = struct.Struct('<II20sQI')
+
+# open (memory mapped) manifests, keyed by their file path.
+manifest_cache = LRUCache(16)
+
+
+class Manifest(object):
+    """
+    Read-only view of a manifest file.
+    """
+
+    def __init__(self, buf):
+        magic, version, count, pathsize = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a manifest')
+        self.buf = buf
+        self.count = count
+        self._paths_offset = HEADER.size + RECORD.size * count
+
+    @classmethod
+    def open(cls, filename):
+        with open(filename, 'rb') as fd:
+            buf = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buf)
+
+    def __len__(self):
+        return self.count
+
+    def _record(self, i):
+        return RECORD.unpack_from(self.buf, HEADER.size + RECORD.size * i)
+
+    def path(self, i):
+        offset, length = self._record(i)[:2]
+        start = self._paths_offset + offset
+        return self.buf[start:start + length]
+
+    def record(self, i):
+        """
+        Return (path, hex, size, filemode) for the i-th entry.
+        """
+
+        offset, length, raw, size, mode = self._record(i)
+        start = self._paths_offset + offset
+        return self.buf[start:start + length], hexlify(raw), size, mode
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.record(i)
+
+    def bisect(self, path):
+        path = as_bytes(path)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.path(mid) < path:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, path):
+        """
+        Return the record for path, or None if not an entry.
+        """
+
+        i = self.bisect(path)
+        if i < self.count and self.path(i) == as_bytes(path):
+            return self.record(i)
+        return None
+
+    def prefix_range(self, path):
+        """
+        Return the (start, end) range of the entries located under the
+        directory path.
+        """
+
+        if not path:
+            return 0, self.count
+        prefix = as_bytes(path) + b'/'
+        # '0' sorts right after '/'.
+        return self.bisect(prefix), self.bisect(prefix[:-1] + b'0')
+
+    def listdir(self, path):
+        """
+        Return the names of the entries of the directory at path, in
+        tree order, or None if there is no such directory.
+        """
+
+        start, end = self.prefix_range(path)
+        if start == end:
+            return None
+        skip = path and len(as_bytes(path)) + 1 or 0
+        results = []
+        i = start
+        while i < end:
+            name = self.path(i)[skip:]
+            if '/' in name:
+                # jump over the rest of this subdirectory.
+                name = name.split('/', 1)[0]
+                i = self.bisect(
+                    self.path(i)[:skip] + name + b'0')
+            else:
+                i += 1
+            results.append(name)
+        return results
+
+
+class ManifestStore(object):
+    """
+    Manifests for the root trees of a repository, stored within the git
+    directory of the repository.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.root = data_path(repo, 'manifests')
+
+    def filename(self, tree_hex):
+        return join(self.root, tree_hex)
+
+    def get(self, tree_hex):
+        """
+        Return the manifest for the root tree, or None if not built.
+        """
+
+        filename = self.filename(tree_hex)
+        manifest = manifest_cache.get(filename)
+        if manifest is None:
+            if not exists(filename):
+                return None
+            manifest = Manifest.open(filename)
+            manifest_cache.put(filename, manifest)
+        return manifest
+
+    def _size(self, entry, sizes):
+        if entry.filemode == GIT_FILEMODE_COMMIT:
+            # submodules have nothing in this repository.
+            return 0
+        return sizes(entry.hex)
+
+    def _full_records(self, tree, sizes):
+        return [
+            (as_bytes(path), entry.hex, self._size(entry, sizes),
+             entry.filemode)
+            for path, entry in walk_tree(self.repo, tree)
+        ]
+
+    def _diff_records(self, base, base_tree, tree, sizes):
+        # Start from the base manifest and apply the changes between
+        # the two trees.
+        records = dict((r[0], r[1:]) for r in base)
+        for delta in diff_deltas(base_tree.diff_to_tree(tree)):
+            records.pop(as_bytes(delta.old_file.path), None)
+            path = as_bytes(delta.new_file.path)
+            records.pop(path, None)
+            try:
+                entry = tree[path]
+            except KeyError:
+                # deleted.
+                continue
+            records[path] = (
+                entry.hex, self._size(entry, sizes), entry.filemode)
+        return [(k,) + v for k, v in records.items()]
+
+    def build(self, commit, bases=()):
+        """
+        Build the manifest for the tree of commit, incrementally from
+        the manifest of its first parent, or otherwise of the first of
+        the commits of bases (e.g. the previous target of a reference)
+        that has one.  The sizes of the blobs come from the headers of
+        their objects, so they do not have to be loaded.
+        """
+
+        tree = commit.tree
+        manifest = self.get(tree.hex)
+        if manifest is not None:
+            return manifest
+
+        base = base_tree = None
+        candidates = available_parents(self.repo, commit)[:1] + list(bases)
+        for candidate in candidates:
+            base = self.get(candidate.tree.hex)
+            if base is not None:
+                base_tree = candidate.tree
+                break
+
+        with ObjectSizes(self.repo) as sizes:
+            if base is None:
+                records = self._full_records(tree, sizes)
+            else:
+                records = self._diff_records(base, base_tree, tree, sizes)
+
+        self._write(tree.hex, sorted(records))
+        return self.get(tree.hex)
+
+    def gc(self, heads):
+        """
+        Remove the manifests of the trees other than the ones of the
+        commits of heads.  Returns the number removed.
+        """
+
+        live = set()
+        for head in heads:
+            try:
+                live.add(self.repo[head].tree.hex)
+            except (KeyError, AttributeError):
+                # gone, or not a commit.
+                continue
+        names = os.listdir(self.root) if exists(self.root) else []
+        removed = 0
+        for name in names:
+            if name in live or name.startswith('tmp'):
+                # in use, or still being written.
+                continue
+            filename = self.filename(name)
+            manifest_cache.pop(filename)
+            try:
+                os.unlink(filename)
+            except OSError:
+                # removed by someone else in the mean time.
+                continue
+            removed += 1
+        return removed
+
+    def _write(self, tree_hex, records):
+        paths = []
+        table = []
+        offset = 0
+        for path, hexsha, size, mode in records:
+            table.append(RECORD.pack(
+                offset, len(path), unhexlify(hexsha), size, mode))
+            paths.append(path)
+            offset += len(path)
+
+        with atomic_write(self.filename(tree_hex)) as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(records), offset))
+            f.write(b''.join(table))
+            f.write(b''.join(paths))
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import os
+from os.path import join
+from os.path import realpath
+from threading import Lock
+
+from pygit2 import Repository
+from pygit2 import discover_repository
+
+from .cache import LRUCache
+
+DEFAULT_POOL_SIZE = 64
+
+
+def _identity(gitdir):
+    # A repository that got removed and then initialized again at the
+    # same location will not have the same inodes for its directories,
+    # which is what is used to detect stale handles.
+    try:
+        st = os.stat(gitdir)
+        objects_st = os.stat(join(gitdir, 'objects'))
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, objects_st.st_ino)
+
+
+class RepositoryPool(object):
+    """
+    A process-wide pool of open pygit2 Repository handles, keyed by the
+    resolved path that was used to discover the repository.
+
+    Handles are shared between all callers (and threads) asking for the
+    same path, so the libgit2 object and pack index caches associated
+    with them are reused rather than rebuilt.
+    """
+
+    def __init__(self, maxsize=DEFAULT_POOL_SIZE):
+        self._handles = LRUCache(maxsize)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        """
+        Return the Repository for the repository discovered at path.
+        Raises KeyError if no repository can be found.
+        """
+
+        key = realpath(path)
+        entry = self._handles.get(key)
+        if entry is not None:
+            gitdir, ident, repo = entry
+            if ident is not None and _identity(gitdir) == ident:
+                with self._lock:
+                    self.hits += 1
+                return repo
+            # the repository got removed or replaced from under us.
+            self._handles.pop(key)
+
+        with self._lock:
+            self.misses += 1
+
+        gitdir = discover_repository(path)
+        if gitdir is None:
+            # older versions of pygit2 raise KeyError on their own.
+            raise KeyError(path)
+        repo = Repository(gitdir)
+        self._handles.put(key, (gitdir, _identity(gitdir), repo))
+        return repo
+
+    def invalidate(self, path):
+        """
+        Drop all handles located at or under path, or which the
+        repository at path was discovered from.
+        """
+
+        target = realpath(path)
+        prefix = join(target, '')
+        for key, entry in self._handles.items():
+            gitdir = realpath(entry[0])
+            if (key == target or key.startswith(prefix) or
+                    gitdir == target or gitdir.startswith(prefix)):
+                self._handles.pop(key)
+
+    def clear(self):
+        self._handles.clear()
+
+    def stats(self):
+        stats = self._handles.stats()
+        # the hit/miss counters of the underlying cache also count the
+        # stale entries, so report the ones kept here instead.
+        stats['hits'] = self.hits
+        stats['misses'] = self.misses
+        return stats
+
+
+pool = RepositoryPool()
+
+
+def get_repository(path):
+    return pool.get(path)
+
+
+def invalidate_repository(path):
+    pool.invalidate(path)
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+Caching the resolution of revisions and the listing of references.
+
+Symbolic revisions (HEAD, branches, tags and expressions built on top
+of them) are left to libgit2, which resolves them about as fast as any
+cache could be checked.  Only full hex object ids get cached, as those
+always resolve to themselves once known to exist, along with the commit
+they peel to so that a hit does not need to read any object.
+
+The references themselves are read into snapshots, with the packed-refs
+file parsed in one go (along with the peeled targets of annotated tags
+recorded within it) and the loose references read from their files.  A
+snapshot is kept along with the stat of HEAD, of the packed-refs file
+and of the directories it found the loose references within (those get
+replaced through a rename, which touches their directory), and read
+again once any of these change, or once invalidated by the backend
+after it moved references itself.  Like git does for its index, a
+snapshot taken within RACY_WINDOW seconds of the last change to any of
+these is not kept, as a change within the same tick of the clock of the
+filesystem would go unnoticed.
+"""
+
+import os
+import re
+import time
+from bisect import bisect_left
+from os.path import join
+from threading import Lock
+
+from pygit2 import Commit
+from pygit2 import Tag
+
+from .cache import LRUCache
+from .graph import peel_commit
+
+DEFAULT_CACHE_SIZE = 4096
+SNAPSHOT_CACHE_SIZE = 64
+RACY_WINDOW = 2
+FULL_HEX = re.compile('^[0-9a-f]{40}$')
+SORT_KEYS = ('name', 'date')
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+
+def refs_signature(gitdir, dirs=()):
+    """
+    Return the stat of HEAD, of the packed-refs file and of dirs within
+    gitdir, which changes whenever the references found within those
+    do.
+    """
+
+    return (
+        _stat(join(gitdir, 'HEAD')),
+        _stat(join(gitdir, 'packed-refs')),
+    ) + tuple(_stat(path) for path in dirs)
+
+
+class RevisionCache(object):
+    """
+    A process-wide cache of the full hex object ids known to exist,
+    keyed by the git directory of the repository and the id, along with
+    the id of the commit each one peels to (None if not a commit).
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self._entries = LRUCache(maxsize)
+
+    @property
+    def hits(self):
+        return self._entries.hits
+
+    def resolve(self, repo, rev):
+        """
+        Return the hex id of the object that rev resolves to within
+        repo.  Raises KeyError if it cannot be resolved.
+        """
+
+        if not FULL_HEX.match(rev):
+            return repo.revparse_single(rev).hex
+        self._lookup(repo, rev)
+        return rev
+
+    def resolve_commit(self, repo, rev):
+        """
+        Return the hex id of the commit that rev resolves to within
+        repo, peeling annotated tags.  Raises KeyError if it cannot be
+        resolved or is not a commit.
+        """
+
+        if not FULL_HEX.match(rev):
+            return peel_commit(repo, repo.revparse_single(rev)).hex
+        commit_hex = self._lookup(repo, rev)
+        if commit_hex is None:
+            raise KeyError('not a commit')
+        return commit_hex
+
+    def _lookup(self, repo, rev):
+        # the (cached) id of the commit the full hex rev peels to.
+        key = (repo.path, rev)
+        entry = self._entries.get(key)
+        if entry is None:
+            # raises KeyError for objects not found.
+            obj = repo.revparse_single(rev)
+            try:
+                entry = (peel_commit(repo, obj).hex,)
+            except KeyError:
+                entry = (None,)
+            self._entries.put(key, entry)
+        return entry[0]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return self._entries.stats()
+
+
+revision_cache = RevisionCache()
+
+
+def resolve(repo, rev):
+    """
+    Return the object that rev resolves to within repo, through the
+    revision cache.  Raises KeyError if it cannot be resolved.
+    """
+
+    return repo[revision_cache.resolve(repo, rev)]
+
+
+def resolve_commit(repo, rev):
+    """
+    Return the commit that rev resolves to within repo, through the
+    revision cache.  Raises KeyError if it cannot be resolved or is not
+    a commit.
+    """
+
+    return repo[revision_cache.resolve_commit(repo, rev)]
+
+
+def read_packed_refs(path):
+    """
+    Return a dict mapping the names of the references within the
+    packed-refs file at path to a list of their target and peeled
+    target, the latter being None where not recorded.
+    """
+
+    results = {}
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except IOError:
+        return results
+
+    fully_peeled = False
+    current = None
+    for line in data.splitlines():
+        if line.startswith(b'#'):
+            traits = line.partition(b':')[2].split()
+            fully_peeled = b'fully-peeled' in traits
+            continue
+        if line.startswith(b'^'):
+            if current is not None:
+                current[1] = line[1:].strip()
+            continue
+        target, _, name = line.partition(b' ')
+        if not name:
+            continue
+        # with fully-peeled, references without a peeled line are not
+        # annotated tags.
+        current = [target, target if fully_peeled else None]
+        results[name] = current
+    return results
+
+
+def read_loose_refs(gitdir, found_dirs=None):
+    """
+    Return a dict mapping the names of the loose references under refs
+    to a list of their target and None, skipping symbolic ones.  The
+    directories walked are appended to found_dirs, if given.
+    """
+
+    results = {}
+    root = join(gitdir, 'refs')
+    for base, dirs, files in os.walk(root):
+        if found_dirs is not None:
+            found_dirs.append(base)
+        for filename in files:
+            if filename.endswith('.lock'):
+                continue
+            path = join(base, filename)
+            try:
+                with open(path, 'rb') as f:
+                    target = f.read(41).strip()
+            except IOError:
+                # removed in the mean time.
+                continue
+            if not FULL_HEX.match(target):
+                continue
+            name = 'refs' + path[len(root):].replace(os.sep, '/')
+            results[name] = [target, None]
+    return results
+
+
+class RefSnapshot(object):
+    """
+    The references of a repository at one point in time, with their
+    peeled targets and the commit times of those resolved on demand.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.dirs = []
+        taken = time.time()
+        self._refs = read_packed_refs(join(repo.path, 'packed-refs'))
+        self._refs.update(read_loose_refs(repo.path, self.dirs))
+        self.names = sorted(self._refs)
+        # taken after reading, so anything changed in the mean time is
+        # either seen as changed or racy.
+        self.signature = refs_signature(repo.path, self.dirs)
+        self.racy = any(
+            st is not None and st[2] > taken - RACY_WINDOW
+            for st in self.signature
+        )
+        self._times = {}
+        self._lock = Lock()
+
+    def target(self, name):
+        return self._refs[name][0]
+
+    def peeled(self, name):
+        """
+        Return the id of the object the reference ultimately points to,
+        through any annotated tags.
+        """
+
+        ref = self._refs[name]
+        if ref[1] is None:
+            obj = self.repo.get(ref[0])
+            while isinstance(obj, Tag):
+                obj = self.repo.get(obj.target)
+            ref[1] = obj.hex if obj is not None else ref[0]
+        return ref[1]
+
+    def time(self, name):
+        """
+        Return the commit time of the peeled target of the reference,
+        or None if that is not a commit.
+        """
+
+        peeled = self.peeled(name)
+        with self._lock:
+            if peeled not in self._times:
+                obj = self.repo.get(peeled)
+                self._times[peeled] = (
+                    obj.commit_time if isinstance(obj, Commit) else None)
+            return self._times[peeled]
+
+    def list(self, prefix='refs/', sort='name', reverse=False, offset=0,
+             limit=None):
+        """
+        Return the names of the references starting with prefix, sorted
+        by name or by the date of their commits (references not pointing
+        to commits going first), from offset and up to limit of them.
+        """
+
+        if sort not in SORT_KEYS:
+            raise ValueError('unsupported sort key: %s' % sort)
+
+        start = bisect_left(self.names, prefix)
+        end = start
+        while end < len(self.names) and self.names[end].startswith(prefix):
+            end += 1
+        names = self.names[start:end]
+
+        if sort == 'date':
+            names.sort(key=lambda name: (self.time(name) or 0, name))
+        if reverse:
+            names.reverse()
+        if limit is None:
+            return names[offset:]
+        return names[offset:offset + limit]
+
+
+snapshot_cache = LRUCache(SNAPSHOT_CACHE_SIZE)
+_generations = {}
+_generations_lock = Lock()
+
+
+def invalidate_refs(repo):
+    """
+    Drop the snapshot of the references of repo, for use once they got
+    moved.
+    """
+
+    with _generations_lock:
+        _generations[repo.path] = _generations.get(repo.path, 0) + 1
+    snapshot_cache.pop(repo.path)
+
+
+def ref_snapshot(repo):
+    """
+    Return the RefSnapshot of repo, read again only once its references
+    have changed.
+    """
+
+    generation = _generations.get(repo.path, 0)
+    entry = snapshot_cache.get(repo.path)
+    if entry is not None and entry[0] == generation and (
+            refs_signature(repo.path, entry[1].dirs) == entry[1].signature):
+        return entry[1]
+    snapshot = RefSnapshot(repo)
+    if not snapshot.racy:
+        snapshot_cache.put(repo.path, (generation, snapshot))
+    return snapshot
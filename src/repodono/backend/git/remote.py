@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Selection of the remote references to fetch.
+
+The references advertised by a remote are filtered through include and
+exclude patterns (fnmatch style, e.g. 'refs/heads/*'), and the filtered
+set is recorded per remote once fetched.  When the remote advertises
+the very same set again nothing is wanted, so the fetch ends right after
+the advertisement without negotiating a pack.
+"""
+
+import json
+from fnmatch import fnmatchcase
+from hashlib import sha1
+from os.path import exists
+
+from .disk import atomic_write
+from .disk import data_path
+
+ANNOTATED_TAG_SUFFIX = '^{}'
+ZERO_SHA = '0' * 40
+
+
+def match_ref(ref, include=None, exclude=None):
+    """
+    Return True if ref matches any of the include patterns (or if there
+    are none) and none of the exclude patterns.
+    """
+
+    if include and not any(fnmatchcase(ref, p) for p in include):
+        return False
+    if exclude and any(fnmatchcase(ref, p) for p in exclude):
+        return False
+    return True
+
+
+def filter_refs(refs, include=None, exclude=None):
+    """
+    Return the refs (a dict of name to sha) selected by the patterns.
+    The peeled entry of an annotated tag follows the tag itself.
+    """
+
+    return dict(
+        (ref, sha) for ref, sha in refs.items()
+        if match_ref(ref[:-len(ANNOTATED_TAG_SUFFIX)]
+                     if ref.endswith(ANNOTATED_TAG_SUFFIX) else ref,
+                     include, exclude)
+    )
+
+
+class RemoteState(object):
+    """
+    The references of a remote as of the last successful fetch.
+    """
+
+    def __init__(self, repo, remote_id):
+        self.filename = data_path(
+            repo, 'remotes', sha1(remote_id).hexdigest())
+
+    def get(self):
+        if not exists(self.filename):
+            return None
+        with open(self.filename, 'rb') as f:
+            return json.load(f)
+
+    def put(self, refs):
+        with atomic_write(self.filename) as f:
+            json.dump(refs, f, sort_keys=True, separators=(',', ':'))
+
+
+class RefWants(object):
+    """
+    A determine_wants callable for the fetch methods of dulwich, which
+    asks only for the objects of the selected references not already
+    in object_store.  When deepening a shallow history all of them are
+    asked for, as the server computes the new boundary from those.
+    """
+
+    deepen = False
+
+    def __init__(self, object_store, state=None, include=None, exclude=None):
+        self.object_store = object_store
+        self.state = state
+        self.include = include
+        self.exclude = exclude
+        self.refs = None
+        self.unchanged = False
+
+    def __call__(self, refs):
+        self.refs = filter_refs(refs, self.include, self.exclude)
+        if self.deepen:
+            return sorted(set(
+                sha for ref, sha in self.refs.items()
+                if not ref.endswith(ANNOTATED_TAG_SUFFIX) and
+                sha != ZERO_SHA
+            ))
+        if self.state is not None and self.state.get() == self.refs:
+            # the remote has not changed since the last fetch.
+            self.unchanged = True
+            return []
+        return [
+            sha for ref, sha in self.refs.items()
+            if not ref.endswith(ANNOTATED_TAG_SUFFIX) and
+            sha != ZERO_SHA and sha not in self.object_store
+        ]
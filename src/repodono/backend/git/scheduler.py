@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Scheduler for syncing many repositories with their remotes at once.
+
+Sync requests are kept in a priority queue and are run by a pool of
+worker threads, with the number of syncs against any given remote host
+capped and at most one sync running for any local repository.  Asking
+for a sync of a repository that is still waiting in the queue returns
+the request already queued.
+"""
+
+import heapq
+from collections import deque
+from itertools import count
+from logging import getLogger
+from os.path import realpath
+from threading import Condition
+from threading import Event
+from threading import Thread
+from timeit import default_timer as timer
+from time import time
+from urlparse import urlparse
+
+from .utility import GitStorageBackend
+
+logger = getLogger(__name__)
+
+LOCAL_HOST = ''
+# the number of finished jobs kept for results.
+MAX_RESULTS = 1024
+
+
+def remote_host(remote_id):
+    """
+    Return the host (with port) of the remote, or the empty string for
+    remotes that are local paths.
+    """
+
+    return urlparse(remote_id).netloc or LOCAL_HOST
+
+
+class SyncJob(object):
+    """
+    A sync of the repository at local_path from remote_id.
+    """
+
+    def __init__(self, local_path, remote_id, priority=0, due=None):
+        self.local_path = local_path
+        self.remote_id = remote_id
+        self.host = remote_host(remote_id)
+        self.priority = priority
+        self.due = due or 0
+        self.requests = 1
+        self.result = None
+        self.error = None
+        self.submitted = time()
+        self.started = None
+        self.duration = None
+        self._done = Event()
+
+    @property
+    def key(self):
+        return (realpath(self.local_path), self.remote_id)
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the sync to finish and return its results, raising the
+        error it failed with, if any.  Returns None on timeout.
+        """
+
+        self._done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SyncScheduler(object):
+    """
+    Run the syncs submitted to it using a pool of worker threads.
+
+    Jobs with the lower priority value and the earlier due time go
+    first; those against a host already having per_host syncs running,
+    or for a repository that is being synced, wait for their turn.  The
+    last max_results finished jobs are kept for results.
+    """
+
+    def __init__(self, backend=None, workers=4, per_host=2,
+                 max_results=MAX_RESULTS):
+        self.backend = backend or GitStorageBackend()
+        self.workers = workers
+        self.per_host = per_host
+
+        self._cond = Condition()
+        self._queue = []
+        self._pending = {}
+        self._counter = count()
+        self._hosts = {}
+        self._paths = set()
+        self._threads = []
+        self._running = False
+        self._results = deque(maxlen=max_results)
+        self._metrics = {
+            'submitted': 0,
+            'coalesced': 0,
+            'completed': 0,
+            'failed': 0,
+            'sync_time': 0.0,
+            'wait_time': 0.0,
+        }
+
+    def submit(self, local_path, remote_id, priority=0, due=None):
+        """
+        Queue a sync of local_path from remote_id, to be started no
+        earlier than the due timestamp.  Returns the SyncJob, which is
+        the one already waiting if the same sync has been queued.
+        """
+
+        job = SyncJob(local_path, remote_id, priority, due)
+        with self._cond:
+            self._metrics['submitted'] += 1
+            queued = self._pending.get(job.key)
+            if queued is not None:
+                # coalesce into the queued job, taking on the more
+                # urgent of the two.
+                self._metrics['coalesced'] += 1
+                queued.requests += 1
+                if (job.priority, job.due) < (queued.priority, queued.due):
+                    queued.priority = job.priority
+                    queued.due = job.due
+                    self._reorder()
+                return queued
+            self._pending[job.key] = job
+            heapq.heappush(self._queue, self._entry(job))
+            self._cond.notify_all()
+        return job
+
+    def _entry(self, job):
+        return (job.priority, job.due, next(self._counter), job)
+
+    def _reorder(self):
+        self._queue = [self._entry(item[-1]) for item in self._queue]
+        heapq.heapify(self._queue)
+
+    def _next_job(self, now):
+        # Return the most urgent job that can be run now and the time
+        # at which to check again if there is none.  Only the entries
+        # more urgent than it get popped, and then pushed back.
+        wake = None
+        skipped = []
+        job = None
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            candidate = entry[-1]
+            if candidate.due > now:
+                wake = candidate.due if wake is None else min(
+                    wake, candidate.due)
+            elif (self._hosts.get(candidate.host, 0) >= self.per_host or
+                    candidate.key[0] in self._paths):
+                pass
+            else:
+                job = candidate
+                break
+            skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+        if job is None:
+            return None, wake
+        del self._pending[job.key]
+        return job, None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._running:
+                        return
+                    now = time()
+                    job, wake = self._next_job(now)
+                    if job is not None:
+                        break
+                    self._cond.wait(None if wake is None else wake - now)
+                self._hosts[job.host] = self._hosts.get(job.host, 0) + 1
+                self._paths.add(job.key[0])
+            self._run(job)
+
+    def _run(self, job):
+        job.started = time()
+        started = timer()
+        try:
+            job.result = self.backend._sync_identifier(
+                job.local_path, job.remote_id)
+        except Exception as e:  # XXX blind
+            logger.warning(
+                'failed to sync %s from %s: %s',
+                job.local_path, job.remote_id, e)
+            job.error = e
+        job.duration = timer() - started
+
+        with self._cond:
+            self._hosts[job.host] -= 1
+            self._paths.discard(job.key[0])
+            self._results.append(job)
+            self._metrics['failed' if job.error else 'completed'] += 1
+            self._metrics['sync_time'] += job.duration
+            self._metrics['wait_time'] += max(
+                0.0, job.started - max(job.submitted, job.due))
+            self._cond.notify_all()
+        job._done.set()
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._threads = [
+                Thread(target=self._worker) for i in range(self.workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self, wait=True):
+        """
+        Stop the workers once their current syncs are done; the jobs
+        still queued remain so for the next start.
+        """
+
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def join(self, timeout=None):
+        """
+        Wait until every job queued is done.  Returns False on timeout.
+        """
+
+        deadline = None if timeout is None else time() + timeout
+        with self._cond:
+            while self._queue or self._paths:
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def results(self, clear=False):
+        """
+        Return the finished jobs kept, in the order they finished.
+        """
+
+        with self._cond:
+            results = list(self._results)
+            if clear:
+                self._results.clear()
+        return results
+
+    def metrics(self):
+        with self._cond:
+            metrics = dict(self._metrics)
+            metrics['pending'] = len(self._queue)
+            metrics['running'] = len(self._paths)
+            metrics['hosts'] = dict(
+                (host, n) for host, n in self._hosts.items() if n)
+        return metrics
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Searching the contents of the files of a tree, with a trigram index.
+
+For every indexed blob the set of distinct trigrams (runs of three
+bytes) within its contents is recorded, so that only the blobs having
+all the trigrams of the literal parts of a pattern need to be read and
+scanned.  Blobs are immutable and shared between revisions, so a new
+revision only costs its new blobs.  Trees get a record of their own
+once all of their blobs are indexed.  The records are kept in a single
+append-only file within the git directory::
+
+    header   'RDTG', version (<4sI)
+    records  raw object id, kind, size of data (<20sBI), then the data
+             being the sorted trigrams of text blobs
+
+Trees not indexed are searched by scanning all of their blobs.
+"""
+
+import re
+import sre_constants
+import sre_parse
+import struct
+from binascii import hexlify
+from binascii import unhexlify
+from bisect import bisect_left
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+
+from pygit2 import GIT_FILEMODE_BLOB
+from pygit2 import GIT_FILEMODE_BLOB_EXECUTABLE
+
+from .blobio import ObjectSizes
+from .disk import RecordFile
+from .disk import data_path
+from .walk import as_bytes
+from .walk import walk_tree
+
+MAGIC = b'RDTG'
+VERSION = 1
+RECORD = struct.Struct('<20sBI')
+
+KIND_TEXT = 0
+# blobs too large to index, which always have to be scanned.
+KIND_LARGE = 1
+# blobs with binary contents, which are never searched.
+KIND_BINARY = 2
+KIND_TREE = 3
+
+MAX_INDEXED_SIZE = 1 << 20
+# like git, files with a NUL byte within the start are binary.
+BINARY_CHECK_SIZE = 8000
+SEARCH_WORKERS = 4
+
+TEXT_FILEMODES = (
+    GIT_FILEMODE_BLOB,
+    GIT_FILEMODE_BLOB_EXECUTABLE,
+)
+
+# the pools of scanning threads shared by all searches, by their size.
+_pools = {}
+_pools_lock = Lock()
+
+
+def shared_pool(workers):
+    """
+    Return the thread pool of workers threads shared by the searches,
+    creating it if needed.
+    """
+
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ThreadPool(workers)
+        return _pools[workers]
+
+
+def is_binary(data):
+    return b'\0' in data[:BINARY_CHECK_SIZE]
+
+
+def trigrams(data):
+    """
+    Return the sorted distinct trigrams of data, joined together.
+    """
+
+    return b''.join(sorted(set(
+        data[i:i + 3] for i in range(len(data) - 2))))
+
+
+def has_trigram(packed, trigram):
+    # binary search through the fixed width entries of packed.
+    count = len(packed) // 3
+    lo = bisect_left(_Trigrams(packed), trigram, 0, count)
+    return lo < count and packed[lo * 3:lo * 3 + 3] == trigram
+
+
+class _Trigrams(object):
+    # A sequence view of the trigrams of packed, for bisect.
+
+    def __init__(self, packed):
+        self.packed = packed
+
+    def __getitem__(self, i):
+        return self.packed[i * 3:i * 3 + 3]
+
+
+def literals(pattern, regex=False):
+    """
+    Return the literal strings that any match of pattern must contain.
+    For regular expressions, only the literals at the top level of the
+    expression are returned, with nothing returned for ones ignoring
+    case.
+    """
+
+    pattern = as_bytes(pattern)
+    if not regex:
+        return [pattern]
+
+    try:
+        parsed = sre_parse.parse(pattern)
+    except sre_constants.error:
+        return []
+    if parsed.pattern.flags & sre_constants.SRE_FLAG_IGNORECASE:
+        return []
+
+    results = []
+    current = []
+    for op, av in parsed:
+        if op == sre_constants.LITERAL:
+            current.append(chr(av))
+            continue
+        if current:
+            results.append(b''.join(current))
+            current = []
+    if current:
+        results.append(b''.join(current))
+    return results
+
+
+def required_trigrams(pattern, regex=False):
+    """
+    Return the trigrams that the contents of a file must have for the
+    pattern to match within it.
+    """
+
+    results = set()
+    for literal in literals(pattern, regex):
+        results.update(literal[i:i + 3] for i in range(len(literal) - 2))
+    return sorted(results)
+
+
+def compile_pattern(pattern, regex=False):
+    """
+    Return the compiled expression for pattern, which is escaped unless
+    regex is set.  Raises ValueError for invalid expressions.
+    """
+
+    pattern = as_bytes(pattern)
+    if not pattern:
+        raise ValueError('empty pattern')
+    if not regex:
+        pattern = re.escape(pattern)
+    try:
+        return re.compile(pattern, re.MULTILINE)
+    except re.error as e:
+        raise ValueError('invalid pattern: %s' % e)
+
+
+def scan_blob(repo, path, blob_id, expr):
+    """
+    Return the matches of expr within the blob, as a list of dicts
+    with the path, the number of the line (counting from 1) and its
+    text.  Binary blobs never match.
+    """
+
+    data = repo[blob_id].data
+    if is_binary(data):
+        return []
+
+    results = []
+    lineno = 1
+    pos = 0
+    last = None
+    for match in expr.finditer(data):
+        start = data.rfind(b'\n', 0, match.start()) + 1
+        if start == last:
+            # only one result per line.
+            continue
+        lineno += data.count(b'\n', pos, start)
+        pos = last = start
+        end = data.find(b'\n', match.start())
+        if end < 0:
+            end = len(data)
+        results.append({
+            'path': path,
+            'line': lineno,
+            'text': data[start:end],
+        })
+    return results
+
+
+def _parse(data, pos):
+    if pos + RECORD.size > len(data):
+        return None
+    raw, kind, size = RECORD.unpack_from(data, pos)
+    start = pos + RECORD.size
+    if start + size > len(data):
+        return None
+    return hexlify(raw), (kind, data[start:start + size]), start + size
+
+
+class TrigramIndex(object):
+    """
+    The trigrams of the blobs of a repository.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.filename = data_path(repo, 'trigrams')
+        self.records = RecordFile(self.filename, MAGIC, VERSION, _parse)
+
+    def load(self):
+        """
+        Return the dict of the (kind, data) records by object id, for the
+        lookups of a query to be made without reading the file again.
+        """
+
+        return self.records.load()
+
+    def indexed(self, tree):
+        """
+        Return whether all the blobs of tree are indexed.
+        """
+
+        return tree.hex in self.load()
+
+    def update(self, tree):
+        """
+        Index the blobs of tree that have not been indexed yet.  Returns
+        the number of blobs indexed.
+        """
+
+        records = self.load()
+        if tree.hex in records:
+            return 0
+
+        pending = []
+        seen = set()
+        with ObjectSizes(self.repo) as sizes:
+            for path, entry in walk_tree(self.repo, tree):
+                if entry.filemode not in TEXT_FILEMODES:
+                    continue
+                if entry.hex in records or entry.hex in seen:
+                    continue
+                seen.add(entry.hex)
+                # from the header, so large blobs are never inflated.
+                if sizes(entry.hex) > MAX_INDEXED_SIZE:
+                    kind, packed = KIND_LARGE, b''
+                else:
+                    data = self.repo[entry.id].data
+                    if is_binary(data):
+                        kind, packed = KIND_BINARY, b''
+                    else:
+                        kind, packed = KIND_TEXT, trigrams(data)
+                pending.append(
+                    RECORD.pack(unhexlify(entry.hex), kind, len(packed)))
+                pending.append(packed)
+        count = len(pending) // 2
+        pending.append(RECORD.pack(unhexlify(tree.hex), KIND_TREE, 0))
+
+        self.records.append(pending)
+        return count
+
+    def candidate(self, blob_hex, required, records=None):
+        """
+        Return False if the blob definitely does not have all of the
+        required trigrams, True if it may have, or None if the blob is
+        not indexed.  records may be the ones already loaded.
+        """
+
+        if records is None:
+            records = self.load()
+        record = records.get(blob_hex)
+        if record is None:
+            return None
+        kind, packed = record
+        if kind == KIND_BINARY:
+            return False
+        if kind == KIND_LARGE:
+            return True
+        return all(has_trigram(packed, t) for t in required)
+
+
+def search(repo, entries, pattern, regex=False, index=None,
+           workers=SEARCH_WORKERS):
+    """
+    Yield the matches of pattern within the files among entries, being
+    tuples of (path, entry), in that order.  The files are scanned by
+    the shared pool of workers threads, skipping the ones that the
+    index shows to not have the trigrams needed for a match.
+    """
+
+    expr = compile_pattern(pattern, regex)
+    required = required_trigrams(pattern, regex) if index else []
+    # loaded once, rather than for every blob.
+    records = index.load() if required else None
+
+    def candidates():
+        for path, entry in entries:
+            if entry.filemode not in TEXT_FILEMODES:
+                continue
+            if required and index.candidate(
+                    entry.hex, required, records) is False:
+                continue
+            yield path, entry.id
+
+    def scan(item):
+        return scan_blob(repo, item[0], item[1], expr)
+
+    # at most window blobs are scanned ahead of the results taken, so
+    # nothing more gets read once the caller stops asking for them.
+    window = workers * 2
+    pending = deque()
+    pool = shared_pool(workers)
+    for item in candidates():
+        pending.append(pool.apply_async(scan, (item,)))
+        if len(pending) < window:
+            continue
+        for result in pending.popleft().get():
+            yield result
+    while pending:
+        for result in pending.popleft().get():
+            yield result
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Shallow mirroring of repositories.
+
+A repository may be configured to be fetched with a limited history,
+either to a depth from the tips of the fetched references or to the
+commits more recent than a given time.  The commits at the boundary
+are listed in the shallow file within the git directory, as done by
+git itself, and are treated as if they have no parents.  Readers that
+run into the boundary may ask for the history to be deepened, which
+the next sync does.
+"""
+
+import json
+import re
+from os.path import exists
+from os.path import join
+
+from .disk import atomic_write
+from .disk import data_path
+
+# the number of commits to deepen by when asked to.
+DEEPEN_STEP = 50
+# the depth git uses to fetch the complete history of a shallow repo.
+UNSHALLOW_DEPTH = 0x7fffffff
+# a full or abbreviated hex object id.
+HEX_REV = re.compile('^[0-9a-f]{4,40}$')
+
+
+def boundary(repo):
+    """
+    Return the set of ids of the commits at the shallow boundary of
+    repo, which is empty for a complete repository.
+    """
+
+    filename = join(repo.path, 'shallow')
+    if not exists(filename):
+        return set()
+    with open(filename, 'rb') as f:
+        return set(line.strip() for line in f if line.strip())
+
+
+def maybe_beyond(rev):
+    """
+    Return whether a revision that cannot be resolved may be a commit
+    beyond the shallow boundary, which only an object id can name, as
+    the references are always fetched.
+    """
+
+    return bool(HEX_REV.match(rev))
+
+
+def available_parents(repo, commit):
+    """
+    Return the parents of commit that are available, i.e. not beyond a
+    shallow boundary.
+    """
+
+    results = []
+    for parent_id in commit.parent_ids:
+        try:
+            results.append(repo[parent_id])
+        except KeyError:
+            continue
+    return results
+
+
+def deepened(repo, previous):
+    """
+    Return the set of ids of the commits of the previous boundary that
+    gained any of their parents since, i.e. the ones the history got
+    deepened from.
+    """
+
+    return set(
+        c for c in previous if c in repo and available_parents(repo, repo[c]))
+
+
+class ShallowConfig(object):
+    """
+    The shallow mirroring configuration of a repository, as a dict of
+    depth, since (a timestamp) and deepen (the additional depth asked
+    for), or None for a complete mirror.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.filename = data_path(repo, 'shallow.json')
+
+    def get(self):
+        if not exists(self.filename):
+            return None
+        with open(self.filename, 'rb') as f:
+            return json.load(f)
+
+    def set(self, depth=None, since=None):
+        """
+        Limit the history to depth commits, or the ones more recent
+        than the since timestamp.  Clears the limit if neither is given.
+        """
+
+        if depth is None and since is None:
+            self.put(None)
+            return
+        if depth is not None and depth < 1:
+            raise ValueError('depth must be a positive integer')
+        self.put({'depth': depth or 1, 'since': since, 'deepen': 0})
+
+    def put(self, config):
+        with atomic_write(self.filename) as f:
+            json.dump(config, f)
+
+    def request_deepen(self, step=DEEPEN_STEP):
+        """
+        Ask for the next sync to deepen the history by step commits.
+        Returns False if the repository is not shallow.
+        """
+
+        config = self.get()
+        if config is None or not boundary(self.repo):
+            return False
+        if config.get('deepen', 0) < step:
+            config['deepen'] = step
+            self.put(config)
+        return True
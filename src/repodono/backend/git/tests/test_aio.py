@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import unittest
+import tempfile
+import shutil
+from os.path import join
+from threading import Event
+
+import zope.component
+
+from zope.component.tests import clearZCML
+
+from repodono.storage.exceptions import PathNotFoundError
+from repodono.storage.exceptions import RevisionNotFoundError
+
+from repodono.backend.git import aio
+from repodono.backend.git.utility import GitStorageBackend
+
+from repodono.backend.git.testing import util
+from repodono.backend.git.tests.test_utility import DemoStorageTestCase
+from repodono.backend.git.tests.test_utility import DummyItem
+from repodono.backend.git.tests.test_utility import DummyStorageInfo
+
+
+@unittest.skipUnless(aio.available(), 'asyncio (or trollius) not available')
+class AsyncGitStorageTestCase(DemoStorageTestCase):
+
+    def setUp(self):
+        super(AsyncGitStorageTestCase, self).setUp()
+        self.loop = aio.asyncio.new_event_loop()
+        self.executor = aio.ThreadPoolExecutor(2)
+        self.storage = self.wait(aio.AsyncGitStorage.from_context(
+            DummyItem(self.testdir), self.executor, self.loop))
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.loop.close()
+        super(AsyncGitStorageTestCase, self).tearDown()
+
+    def wait(self, future):
+        return self.loop.run_until_complete(future)
+
+    def collect(self, iterator):
+        results = []
+        while True:
+            try:
+                results.append(self.wait(iterator.__anext__()))
+            except aio.StopAsyncIteration:
+                return results
+
+    def test_blocking(self):
+        storage = self.storage
+        self.assertEqual(self.wait(storage.file('file1')),
+                         b'This is a test file.\nWith a new line.\n')
+        self.assertEqual(self.wait(storage.files()), self.fulllist)
+        self.assertEqual(self.wait(storage.listdir('')), [
+            'file1', 'file2', 'file3', 'nested'])
+        self.wait(storage.checkout(self.revs[0]))
+        self.assertEqual(self.wait(storage.files()), ['file1', 'file2'])
+
+        with self.assertRaises(PathNotFoundError):
+            self.wait(storage.file('nosuchfile'))
+        with self.assertRaises(RevisionNotFoundError):
+            self.wait(storage.checkout('nosuchrev'))
+
+    def test_streaming(self):
+        storage = self.storage
+        self.assertEqual(self.collect(storage.iterfiles()), self.fulllist)
+        log = self.collect(storage.iterlog(shortlog=True))
+        self.assertEqual(
+            [entry['node'] for entry in log], list(reversed(self.revs)))
+        self.assertEqual(
+            b''.join(self.collect(storage.open('file1', chunk_size=4))),
+            b'This is a test file.\nWith a new line.\n')
+
+        iterator = storage.iterfiles()
+        self.assertEqual(self.wait(iterator.__anext__()), 'file1')
+        self.wait(iterator.aclose())
+        with self.assertRaises(aio.StopAsyncIteration):
+            self.wait(iterator.__anext__())
+
+        with self.assertRaises(RevisionNotFoundError):
+            self.wait(storage.iterlog('nosuchrev').__anext__())
+
+    def test_cancel(self):
+        # hold the only worker of a single worker pool.
+        executor = aio.ThreadPoolExecutor(1)
+        started = Event()
+        release = Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        storage = aio.AsyncGitStorage(
+            self.storage.storage, executor, self.loop)
+        blocking = self.loop.run_in_executor(executor, block)
+        started.wait()
+        calls = []
+        future = storage._call(calls.append, 'called')
+        future.cancel()
+        # lets the loop pass the cancellation on to the executor.
+        with self.assertRaises(aio.asyncio.CancelledError):
+            self.wait(future)
+        release.set()
+        self.wait(blocking)
+        executor.shutdown()
+        self.assertTrue(future.cancelled())
+        self.assertEqual(calls, [])
+
+    def test_serialized(self):
+        storage = self.storage
+        other = self.wait(aio.AsyncGitStorage.from_context(
+            DummyItem(self.testdir), self.executor, self.loop))
+        self.assertIsNot(storage.lock, other.lock)
+
+        # calls waiting for their turn do not hold a worker.
+        self.wait(storage.lock.acquire())
+        calls = []
+        futures = [storage._call(calls.append, i) for i in range(3)]
+        self.assertEqual(self.wait(other.file('file1')),
+                         b'This is a test file.\nWith a new line.\n')
+        self.assertEqual(calls, [])
+        storage.lock.release()
+        self.wait(aio.asyncio.gather(*futures, loop=self.loop))
+        self.assertEqual(calls, [0, 1, 2])
+        self.assertFalse(storage.lock.locked())
+
+        # the revision checked out is the one seen by the calls after.
+        futures = [
+            storage.checkout(self.revs[0]), storage.files(),
+            storage.checkout(self.revs[3]), storage.files(),
+        ]
+        results = self.wait(aio.asyncio.gather(*futures, loop=self.loop))
+        self.assertEqual(results[1], ['file1', 'file2'])
+        self.assertEqual(results[3], self.fulllist)
+
+    def test_cancel_running(self):
+        storage = self.storage
+        started = Event()
+        release = Event()
+        log = []
+
+        def slow():
+            started.set()
+            release.wait()
+            log.append('slow done')
+
+        future = storage._call(slow)
+        self.loop.run_until_complete(
+            self.loop.run_in_executor(None, started.wait))
+        future.cancel()
+        other = storage._call(log.append, 'other ran')
+        try:
+            # the cancelled call still holds the lock while it runs.
+            self.loop.run_until_complete(
+                aio.asyncio.sleep(0.05, loop=self.loop))
+            self.assertTrue(storage.lock.locked())
+            self.assertEqual(log, [])
+        finally:
+            release.set()
+        self.wait(other)
+        self.assertEqual(log, ['slow done', 'other ran'])
+        self.assertTrue(future.cancelled())
+        self.assertFalse(storage.lock.locked())
+
+    def test_snapshot(self):
+        snapshot = aio.AsyncGitStorage(
+            self.storage.storage.at(self.revs[0]), self.executor, self.loop)
+        self.assertIsNone(snapshot.lock)
+        results = self.wait(aio.asyncio.gather(
+            snapshot.files(), snapshot.files(), loop=self.loop))
+        self.assertEqual(results, [['file1', 'file2']] * 2)
+        self.assertEqual(
+            self.collect(snapshot.iterfiles()), ['file1', 'file2'])
+
+
+@unittest.skipUnless(aio.available(), 'asyncio (or trollius) not available')
+class AsyncGitStorageBackendTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        zope.component.provideAdapter(DummyStorageInfo, (DummyItem,))
+        util.extract_archive(self.testdir)
+        self.loop = aio.asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        shutil.rmtree(self.testdir)
+        clearZCML()
+
+    def test_sync_identifier(self):
+        backend = aio.AsyncGitStorageBackend(
+            GitStorageBackend(), loop=self.loop)
+        results = self.loop.run_until_complete(backend.sync_identifier(
+            join(self.testdir, 'simple2'), join(self.testdir, 'simple1')))
+        self.assertEqual(results, [
+            ('refs/heads/master',
+                (True, 'Fast-forwarded branch: refs/heads/master')),
+        ])
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import tarfile
+import zipfile
+import os
+from io import BytesIO
+from os import listdir
+from os.path import basename
+from os.path import exists
+from time import time
+
+from pygit2 import Signature
+from pygit2 import GIT_FILEMODE_BLOB_EXECUTABLE
+from pygit2 import GIT_FILEMODE_LINK
+
+from repodono.storage.exceptions import PathNotFoundError
+from repodono.storage.exceptions import RevisionNotFoundError
+
+from repodono.backend.git.archive import ArchiveCache
+from repodono.backend.git.disk import data_path
+from repodono.backend.git.utility import GitStorage
+
+from repodono.backend.git.tests.test_utility import DemoStorageTestCase
+from repodono.backend.git.tests.test_utility import DummyItem
+
+
+class ArchiveTestCase(DemoStorageTestCase):
+
+    def setUp(self):
+        super(ArchiveTestCase, self).setUp()
+
+        # add an executable, a symlink and a large file.
+        repo = self.repo
+        head = repo[self.revs[-1]]
+        tbder = repo.TreeBuilder(head.tree)
+        tbder.insert('run', repo.create_blob(b'#!/bin/sh\n'),
+                     GIT_FILEMODE_BLOB_EXECUTABLE)
+        tbder.insert('link', repo.create_blob(b'file1'), GIT_FILEMODE_LINK)
+        self.large = b''.join(b'%d\n' % i for i in range(100000))
+        tbder.insert('large', repo.create_blob(self.large), 0o100644)
+        sig = Signature('user1', '1@example.com', 1400000000, 0)
+        self.rev = repo.create_commit(
+            'refs/heads/master', sig, sig, 'more', tbder.write(),
+            [head.id]).hex
+        self.storage = GitStorage(DummyItem(self.testdir))
+
+    def check_tar(self, data, mode, prefix=''):
+        tf = tarfile.open(fileobj=BytesIO(data), mode=mode)
+        names = tf.getnames()
+        self.assertIn(prefix + 'nested/deep/dir', names)
+        self.assertEqual(
+            tf.extractfile(prefix + 'nested/deep/dir/file').read(),
+            b'This is\n\na deeply nested file\n')
+        self.assertEqual(tf.extractfile(prefix + 'large').read(), self.large)
+        self.assertEqual(tf.getmember(prefix + 'run').mode, 0o755)
+        self.assertEqual(tf.getmember(prefix + 'file1').mode, 0o644)
+        self.assertEqual(tf.getmember(prefix + 'file1').mtime, 1400000000)
+        link = tf.getmember(prefix + 'link')
+        self.assertTrue(link.issym())
+        self.assertEqual(link.linkname, 'file1')
+        return names
+
+    def test_tar(self):
+        chunks = list(self.storage.archive(format='tar', cache=False))
+        self.assertTrue(len(chunks) > 1)
+        data = b''.join(chunks)
+        self.assertEqual(len(data) % tarfile.RECORDSIZE, 0)
+        names = self.check_tar(data, 'r:')
+        self.assertEqual(
+            sorted(n for n in names if not n.startswith('nested')),
+            ['file1', 'file2', 'file3', 'large', 'link', 'run'])
+
+    def test_tar_gz_prefix(self):
+        data = b''.join(self.storage.archive(
+            self.rev, format='tar.gz', prefix='/demo/', cache=False))
+        names = self.check_tar(data, 'r:gz', 'demo/')
+        self.assertEqual(names[0], 'demo')
+
+    def test_zip(self):
+        data = b''.join(self.storage.archive(format='zip', prefix='demo'))
+        zf = zipfile.ZipFile(BytesIO(data))
+        self.assertIsNone(zf.testzip())
+        self.assertIn('demo/nested/deep/', zf.namelist())
+        self.assertEqual(zf.read('demo/large'), self.large)
+        self.assertEqual(zf.read('demo/link'), b'file1')
+        info = zf.getinfo('demo/run')
+        self.assertEqual(info.external_attr >> 16, 0o100755)
+        self.assertEqual(info.date_time, (2014, 5, 13, 16, 53, 20))
+
+    def test_paths(self):
+        data = b''.join(self.storage.archive(
+            format='tar', paths=['nested/deep/', 'file2', 'nested']))
+        tf = tarfile.open(fileobj=BytesIO(data))
+        self.assertEqual(tf.getnames(), [
+            'file2', 'nested', 'nested/deep', 'nested/deep/dir',
+            'nested/deep/dir/file'])
+
+        with self.assertRaises(PathNotFoundError):
+            self.storage.archive(paths=['nosuchpath'])
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            self.storage.archive(format='rar')
+        with self.assertRaises(RevisionNotFoundError):
+            self.storage.archive('nosuchrev')
+
+    def test_cache(self):
+        root = data_path(self.storage.repo, 'archives')
+        # not cached by default.
+        b''.join(self.storage.archive(self.revs[0], format='tar.gz'))
+        self.assertFalse(exists(root))
+
+        chunks = self.storage.archive(
+            self.revs[0], format='tar.gz', cache=True)
+        # an archive not read completely is not cached.
+        next(chunks)
+        chunks.close()
+        self.assertEqual(listdir(root), [])
+
+        data = b''.join(self.storage.archive(
+            self.revs[0], format='tar.gz', cache=True))
+        self.assertEqual(len(listdir(root)), 1)
+        self.assertEqual(
+            b''.join(self.storage.archive(
+                self.revs[0], format='tar.gz', cache=True)),
+            data)
+        self.assertEqual(
+            b''.join(self.storage.archive(self.revs[0], format='tar.gz')),
+            data)
+        tf = tarfile.open(fileobj=BytesIO(data), mode='r:gz')
+        self.assertEqual(tf.getnames(), ['file1', 'file2'])
+
+    def test_cache_evict(self):
+        repo = self.storage.repo
+        tree = repo[self.revs[0]].tree
+        cache = ArchiveCache(repo)
+        tar = b''.join(cache.stream(tree, 'tar'))
+        tgz = cache.stream(tree, 'tar.gz')
+        tgz_name = cache.filename(tree.hex, 'tar.gz', 0)
+        tar_name = cache.filename(tree.hex, 'tar', 0)
+        b''.join(tgz)
+        self.assertEqual(sorted(listdir(cache.root)), sorted([
+            basename(tar_name), basename(tgz_name)]))
+
+        # the tar archive is the least recently used, until read again.
+        old = time() - 60
+        os.utime(tar_name, (old, old))
+        os.utime(tgz_name, (old + 1, old + 1))
+        self.assertEqual(b''.join(cache.stream(tree, 'tar')), tar)
+        cache.max_size = len(tar) + 1
+        self.assertEqual(cache.evict(), 1)
+        self.assertEqual(listdir(cache.root), [basename(tar_name)])
+
+        # the archive just written is kept, even if too large.
+        cache.max_size = 1
+        b''.join(cache.stream(tree, 'zip'))
+        self.assertEqual(listdir(cache.root), [
+            basename(cache.filename(tree.hex, 'zip', 0))])
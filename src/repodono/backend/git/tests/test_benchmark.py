@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import unittest
+import tempfile
+import shutil
+import json
+from os import listdir
+from os.path import join
+
+from pygit2 import Repository
+
+import zope.component
+
+from zope.component.tests import clearZCML
+
+from repodono.backend.git.benchmark.generator import create_large_repo
+from repodono.backend.git.benchmark.runner import compare
+from repodono.backend.git.benchmark.runner import main
+from repodono.backend.git.benchmark.runner import run
+from repodono.backend.git.benchmark.runner import time_scenario
+from repodono.backend.git.benchmark.scenarios import Scenario
+from repodono.backend.git.utility import GitStorage
+
+from repodono.backend.git.tests.test_utility import DummyItem
+from repodono.backend.git.tests.test_utility import DummyStorageInfo
+
+SMALL = {
+    'commits': 5,
+    'files': 20,
+    'depth': 2,
+    'fanout': 2,
+    'lines': 5,
+    'changes': 3,
+    'branches': 2,
+    'tags': 3,
+    'large_blobs': 1,
+    'large_size': 1000,
+    'submodules': 1,
+}
+
+
+class GeneratorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        zope.component.provideAdapter(DummyStorageInfo, (DummyItem,))
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+        clearZCML()
+
+    def test_create_large_repo(self):
+        info = create_large_repo(join(self.testdir, 'a'), **SMALL)
+        self.assertEqual(len(info['revs']), 5)
+        self.assertEqual(info['tags'], ['v0.0', 'v0.1', 'v0.2'])
+
+        # no loose objects are left.
+        objects = join(self.testdir, 'a', '.git', 'objects')
+        self.assertEqual([
+            name for name in listdir(objects) if len(name) == 2 and
+            listdir(join(objects, name))], [])
+        self.assertTrue(listdir(join(objects, 'pack')))
+
+        storage = GitStorage(DummyItem(join(self.testdir, 'a')))
+        self.assertEqual(storage.rev, info['revs'][-1])
+        self.assertEqual(
+            sorted(storage.files()),
+            sorted(info['paths'] + info['large'] + ['.gitmodules']))
+        self.assertEqual(len(storage.file(info['large'][0])), 1000)
+        self.assertEqual(
+            storage.pathinfo(info['submodules'][0])['type'], 'subrepo')
+        self.assertEqual(
+            [b[0] for b in storage.branches()],
+            ['branch000', 'branch001', 'master'])
+        # the annotated tag is only found within packed-refs.
+        self.assertEqual(len(storage.tags(peeled=True)[1]), 3)
+        self.assertEqual(len(storage.log(None, 10)), 5)
+
+        # the same parameters give the same repository.
+        again = create_large_repo(join(self.testdir, 'b'), **SMALL)
+        self.assertEqual(again['revs'], info['revs'])
+        repo = Repository(join(self.testdir, 'b', '.git'))
+        self.assertEqual(repo.lookup_reference('refs/tags/v0.1').target.hex,
+                         storage.tags()[1][1])
+
+        with self.assertRaises(TypeError):
+            create_large_repo(join(self.testdir, 'c'), nosuchparam=1)
+
+
+class RunnerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+        clearZCML()
+
+    def test_run(self):
+        results = run(self.testdir, repeat=2, sync=False, **SMALL)
+        self.assertEqual(results['meta']['params']['commits'], 5)
+        self.assertIn('libgit2', results['meta'])
+        for name in ('files', '_get_obj', 'log', 'search_indexed',
+                     'blame_large', 'pathinfo_submodule'):
+            self.assertEqual(results['results'][name]['repeat'], 2)
+        self.assertEqual(results['results']['build_manifest']['repeat'], 1)
+        self.assertNotIn('sync_local', results['results'])
+        self.assertFalse(
+            [n for n, r in results['results'].items() if 'error' in r])
+
+    def test_time_scenario_teardown(self):
+        torn = []
+
+        def fail(arg):
+            raise ValueError('failed')
+
+        result = time_scenario(Scenario(
+            'fail', fail, setup=lambda: 'arg', teardown=torn.append))
+        self.assertEqual(result, {'error': 'ValueError: failed'})
+        self.assertEqual(torn, ['arg'])
+
+    def test_run_sync(self):
+        results = run(
+            self.testdir, repeat=1, patterns=['sync_local*', 'sync_git'],
+            **SMALL)
+        self.assertEqual(sorted(results['results']), [
+            'sync_git', 'sync_local', 'sync_local_noop'])
+        self.assertFalse(
+            [n for n, r in results['results'].items() if 'error' in r])
+
+    def test_compare(self):
+        base = {'results': {
+            'a': {'median': 1.0},
+            'b': {'median': 1.0},
+            'c': {'median': 1.0},
+            'd': {'error': 'ValueError'},
+            'e': {'median': 1.0},
+        }}
+        current = {'results': {
+            'a': {'median': 1.5},
+            'b': {'median': 0.5},
+            'c': {'median': 1.05},
+            'd': {'median': 1.0},
+        }}
+        self.assertEqual(
+            [(r['name'], r['status']) for r in compare(base, current)],
+            [('a', 'slower'), ('b', 'faster'), ('c', 'same'), ('d', 'error')])
+
+    def test_main(self):
+        output = join(self.testdir, 'results.json')
+        workdir = join(self.testdir, 'work')
+        argv = ['--commits', '2', '--files', '5', '--tags', '0',
+                '--large-blobs', '0', '--submodules', '0', '--repeat', '1',
+                '--no-sync', '--scenario', 'files', '--workdir', workdir,
+                '--output', output]
+        self.assertEqual(main(argv), 0)
+        with open(output) as f:
+            results = json.load(f)
+        self.assertEqual(list(results['results']), ['files'])
+
+        # comparing against itself never finds a regression; the
+        # second run needs a workdir of its own.
+        argv[argv.index(workdir)] = join(self.testdir, 'work2')
+        self.assertEqual(main(argv + [
+            '--compare', output, '--fail-on-regression',
+            '--threshold', '1000']), 0)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+from os import listdir
+
+from pygit2 import Signature
+
+from repodono.storage.exceptions import PathNotFileError
+from repodono.storage.exceptions import PathNotFoundError
+from repodono.storage.exceptions import RevisionNotFoundError
+
+from repodono.backend.git.blame import BlameIndex
+from repodono.backend.git.blame import blame_cache
+from repodono.backend.git.blame import map_lines
+from repodono.backend.git.blame import origin_cache
+from repodono.backend.git.disk import data_path
+from repodono.backend.git.utility import GitStorage
+
+from repodono.backend.git.tests.test_utility import DemoStorageTestCase
+from repodono.backend.git.tests.test_utility import DummyItem
+
+
+class BlameTestCase(DemoStorageTestCase):
+
+    def setUp(self):
+        super(BlameTestCase, self).setUp()
+        blame_cache.clear()
+
+    def commit(self, contents, message, parents=None, time=1400000000):
+        # commit contents as the file named text on top of master.
+        repo = self.repo
+        if parents is None:
+            parents = [repo.head.target]
+        tbder = repo.TreeBuilder(repo[parents[0]].tree)
+        tbder.insert('text', repo.create_blob(contents), 0o100644)
+        sig = Signature('user1', '1@example.com', time, 0)
+        return repo.create_commit(
+            None, sig, sig, message, tbder.write(), parents)
+
+    def summary(self, results):
+        return [(r['rev'], r['start'], r['lines']) for r in results]
+
+    def full(self, commit_id):
+        return [
+            (h.final_commit_id.hex, h.final_start_line_number,
+             h.lines_in_hunk)
+            for h in self.repo.blame('text', newest_commit=commit_id)
+        ]
+
+    def test_map_lines(self):
+        old = self.repo[self.repo.create_blob(b'a\nb\nc\nd\ne\n')]
+        new = self.repo[self.repo.create_blob(b'a\nB\nc\ne\nf\ng')]
+        self.assertEqual(map_lines(old, new), [0, None, 2, 4, None, None])
+        empty = self.repo[self.repo.create_blob(b'')]
+        self.assertEqual(map_lines(empty, new), [None] * 6)
+        self.assertEqual(map_lines(new, empty), [])
+
+    def test_blame_demo(self):
+        storage = GitStorage(DummyItem(self.testdir))
+        results = storage.blame('file1')
+        self.assertEqual(self.summary(results), [
+            (self.revs[0], 1, 1),
+            (self.revs[1], 2, 1),
+        ])
+        self.assertEqual(results[0]['author'], 'user1')
+        self.assertEqual(results[0]['email'], '1@example.com')
+        self.assertIn('date', results[0])
+
+        self.assertEqual(self.summary(storage.blame('file1', self.revs[0])), [
+            (self.revs[0], 1, 1),
+        ])
+        self.assertEqual(self.summary(
+            storage.blame('/nested/deep/dir/file', line_range=(2, 9))), [
+            (self.revs[3], 2, 2),
+        ])
+        self.assertEqual(storage.blame('file1', line_range=(5, 9)), [])
+
+        with self.assertRaises(PathNotFoundError):
+            storage.blame('file3', self.revs[0])
+        with self.assertRaises(PathNotFileError):
+            storage.blame('nested/deep')
+        with self.assertRaises(RevisionNotFoundError):
+            storage.blame('file1', 'nosuchrev')
+
+    def test_blame_incremental(self):
+        c1 = self.commit(b'one\ntwo\nthree\nfour\n', 'c1')
+        c2 = self.commit(b'one\n2\nthree\nfour\nfive\n', 'c2', [c1])
+        c3 = self.commit(b'zero\none\n2\nthree\nfour\nfive\n', 'c3', [c2])
+        # a side branch from c1, merged into c3 with both changes.
+        d2 = self.commit(b'one\ntwo\nthree\nFOUR\n', 'd2', [c1])
+        m = self.commit(b'zero\none\n2\nthree\nFOUR\nfive\n', 'm', [c3, d2])
+        self.repo.create_reference('refs/heads/master', m, force=True)
+        storage = GitStorage(DummyItem(self.testdir))
+
+        index = BlameIndex(self.repo)
+        for commit_id in (c1, c2, c3, d2):
+            index.blame(self.repo[commit_id], 'text')
+        self.assertEqual(len(listdir(data_path(self.repo, 'blame'))), 4)
+
+        # the merge is computed from the blames of both parents.
+        results = storage.blame('text', m.hex)
+        self.assertEqual(self.summary(results), [
+            (c3.hex, 1, 1),
+            (c1.hex, 2, 1),
+            (c2.hex, 3, 1),
+            (c1.hex, 4, 1),
+            (d2.hex, 5, 1),
+            (c2.hex, 6, 1),
+        ])
+        self.assertEqual(self.summary(results), self.full(m))
+
+        hits = blame_cache.hits
+        self.assertEqual(storage.blame('text', m.hex), results)
+        self.assertEqual(blame_cache.hits, hits + 1)
+
+    def test_gc(self):
+        c1 = self.commit(b'one\ntwo\n', 'c1')
+        c2 = self.commit(b'one\n2\n', 'c2', [c1])
+        index = BlameIndex(self.repo)
+        self.assertEqual(index.gc([c2.hex]), 0)
+        index.blame(self.repo[c1], 'text')
+        index.blame(self.repo[c2], 'text')
+        index.blame(self.repo[c2], 'file1')
+        root = data_path(self.repo, 'blame')
+        self.assertEqual(len(listdir(root)), 3)
+
+        # only the blames of the files of c2 are kept.
+        self.assertEqual(index.gc([c2.hex, '0' * 40]), 1)
+        self.assertEqual(sorted(listdir(root)), sorted([
+            '%s-%s' % (self.repo[c2].tree['text'].hex, c2.hex),
+            '%s-%s' % (self.repo[c2].tree['file1'].hex, self.revs[1]),
+        ]))
+        self.assertEqual(index.gc([]), 2)
+        self.assertEqual(listdir(root), [])
+
+    def test_blame_same_blob(self):
+        c1 = self.commit(b'one\ntwo\n', 'c1')
+        c2 = self.commit(b'one\ntwo\n', 'c2', [c1])
+        storage = GitStorage(DummyItem(self.testdir))
+        self.assertEqual(self.summary(storage.blame('text', c2.hex)), [
+            (c1.hex, 1, 2),
+        ])
+        # recorded once, against the commit introducing the blob.
+        self.assertEqual(listdir(data_path(self.repo, 'blame')), [
+            '%s-%s' % (self.repo[c2].tree['text'].id.hex, c1.hex)])
+
+    def test_blame_origin_cached(self):
+        c1 = self.commit(b'one\ntwo\n', 'c1')
+        commits = [c1]
+        for i in range(20):
+            commits.append(self.commit(b'one\ntwo\n', 'c', [commits[-1]]))
+        index = BlameIndex(self.repo)
+        head = self.repo[commits[-1]]
+        blob_id = head.tree['text'].id
+        key = (self.repo.path, head.hex, 'text')
+        self.assertEqual(index.origin(head, 'text', blob_id).hex, c1.hex)
+        self.assertEqual(origin_cache.get(key), c1.hex)
+
+        hits = origin_cache.hits
+        self.assertEqual(index.origin(head, 'text', blob_id).hex, c1.hex)
+        self.assertEqual(origin_cache.hits, hits + 1)
+
+        # as if found at a shallow boundary since deepened; the walk
+        # resumes from there.
+        origin_cache.put(key, commits[10].hex)
+        self.assertEqual(index.origin(head, 'text', blob_id).hex, c1.hex)
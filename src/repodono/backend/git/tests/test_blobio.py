@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+from os.path import exists
+from os.path import join
+
+from repodono.storage.exceptions import PathNotFileError
+
+from repodono.backend.git.blobio import BlobReader
+from repodono.backend.git.blobio import ObjectSizes
+
+from repodono.backend.git.tests.test_utility import DemoStorageTestCase
+
+
+class BlobIOTestCase(DemoStorageTestCase):
+
+    def test_file_range(self):
+        storage = self.storage
+        data = 'This is a test file.\nWith a new line.\n'
+        self.assertEqual(storage.file('file1'), data)
+        self.assertEqual(storage.file('file1', 5), data[5:])
+        self.assertEqual(storage.file('file1', 5, 4), data[5:9])
+        self.assertEqual(storage.file('file1', length=4), data[:4])
+        self.assertEqual(storage.file('file1', 100, 4), '')
+
+        with self.assertRaises(ValueError):
+            storage.file('file1', -1)
+
+        with self.assertRaises(PathNotFileError):
+            storage.file('nested', 0, 1)
+
+    def test_open(self):
+        storage = self.storage
+        data = 'This is a test file.\nWith a new line.\n'
+        with storage.open('file1', chunk_size=16) as f:
+            self.assertTrue(isinstance(f, BlobReader))
+            self.assertEqual(f.size, len(data))
+            self.assertEqual(list(f), [data[:16], data[16:32], data[32:]])
+            self.assertEqual(f.read(), '')
+            f.seek(-6, 2)
+            self.assertEqual(f.tell(), len(data) - 6)
+            self.assertEqual(f.read(3), 'lin')
+            f.seek(0)
+            self.assertEqual(f.read(), data)
+        self.assertTrue(f.closed)
+
+        with self.assertRaises(ValueError):
+            f.read()
+
+        with self.assertRaises(PathNotFileError):
+            storage.open('nested')
+
+    def test_object_sizes(self):
+        repo = self.storage.repo
+        blobs = [
+            repo.create_blob(''.join(
+                'line %d\n' % i for i in range(n * 1000)))
+            for n in range(1, 6)
+        ] + [repo.create_blob(b'')]
+        # reachable, to be packed.
+        tbder = repo.TreeBuilder()
+        for i, oid in enumerate(blobs):
+            tbder.insert('blob%d' % i, oid, 0o100644)
+        head = repo[repo.head.target]
+        repo.create_commit(
+            'refs/heads/sizes', head.author, head.author, 'sizes',
+            tbder.write(), [])
+
+        def check():
+            with ObjectSizes(repo) as sizes:
+                for oid in blobs + [repo.head.target]:
+                    self.assertEqual(
+                        sizes(oid.hex), len(repo.read(oid)[1]))
+
+        check()
+        try:
+            subprocess.check_call(
+                ['git', 'repack', '-a', '-d', '-f', '-q'], cwd=repo.path,
+                stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT,
+            )
+            subprocess.check_call(
+                ['git', 'prune-packed'], cwd=repo.path,
+                stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT,
+            )
+        except (OSError, subprocess.CalledProcessError):
+            self.skipTest('git repack not available')
+        # from the pack, with the larger blobs stored as deltas.
+        self.assertFalse(exists(join(
+            repo.path, 'objects', blobs[0].hex[:2], blobs[0].hex[2:])))
+        check()
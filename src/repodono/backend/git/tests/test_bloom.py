@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import unittest
+from os.path import join
+
+from pygit2 import GIT_SORT_TOPOLOGICAL
+from pygit2 import Repository
+
+from repodono.backend.git.bloom import ChangedPathIndex
+from repodono.backend.git.bloom import filter_contains
+from repodono.backend.git.bloom import make_filter
+from repodono.backend.git.bloom import path_history
+from repodono.backend.git.utility import GitStorage
+
+from repodono.backend.git.tests.test_utility import DemoStorageTestCase
+from repodono.backend.git.tests.test_utility import DummyItem
+
+
+class BloomFilterTestCase(unittest.TestCase):
+
+    def test_filter(self):
+        bloom = make_filter(['a/b/c', 'd'])
+        for path in ('a', 'a/b', 'a/b/c', 'd'):
+            self.assertTrue(filter_contains(bloom, path))
+        misses = [
+            path for path in ('e%d' % i for i in range(100))
+            if not filter_contains(bloom, path)
+        ]
+        self.assertTrue(len(misses) > 90)
+
+    def test_filter_too_many(self):
+        bloom = make_filter(['%d' % i for i in range(1000)])
+        self.assertEqual(bloom, b'')
+        self.assertTrue(filter_contains(bloom, 'anything'))
+
+
+class ChangedPathIndexTestCase(DemoStorageTestCase):
+
+    def test_update(self):
+        revs = self.revs
+        repo = Repository(join(self.testdir, '.git'))
+        index = ChangedPathIndex(repo)
+        self.assertIsNone(index.maybe_changed(revs[3], 'nested'))
+        self.assertEqual(index.update([revs[1]]), 2)
+        self.assertEqual(index.update([revs[3]]), 2)
+        self.assertEqual(index.update([revs[3]]), 0)
+
+        self.assertTrue(index.maybe_changed(revs[3], 'nested/deep'))
+        self.assertTrue(index.maybe_changed(revs[1], 'file1'))
+        # root commits are always checked.
+        self.assertTrue(index.maybe_changed(revs[0], 'nested'))
+
+        # a fresh instance reads the same index.
+        self.assertEqual(
+            ChangedPathIndex(repo).get(revs[2]), index.get(revs[2]))
+
+    def test_storage_log_path(self):
+        revs = self.revs
+        storage = GitStorage(DummyItem(self.testdir))
+
+        def check():
+            self.assertEqual(
+                [log['rev'] for log in storage.log(None, 10, path='file1')],
+                [revs[1], revs[0]])
+            self.assertEqual(
+                [log['rev'] for log in storage.log(None, 10, path='file3')],
+                [revs[2]])
+            self.assertEqual(
+                [log['rev'] for log in storage.log(
+                    None, 10, path='nested/deep/')],
+                [revs[3]])
+            self.assertEqual(storage.log(None, 10, path='nosuchpath'), [])
+
+            logs, cursor = storage.log_page(None, 1, path='file2')
+            self.assertEqual([log['rev'] for log in logs], [revs[2]])
+            logs, cursor = storage.log_page(
+                None, 1, cursor=cursor, path='file2')
+            self.assertEqual([log['rev'] for log in logs], [revs[0]])
+
+        check()
+        storage.changed_paths.update([revs[3]])
+        check()
+
+    def test_path_history_loads_once(self):
+        revs = self.revs
+        repo = Repository(join(self.testdir, '.git'))
+        index = ChangedPathIndex(repo)
+        index.update([revs[3]])
+        loads = []
+        load = index.load
+        index.load = lambda: loads.append(1) or load()
+        self.assertEqual(
+            [c.hex for c in path_history(
+                repo, repo.walk(revs[3], GIT_SORT_TOPOLOGICAL), 'file1',
+                index)],
+            [revs[1], revs[0]])
+        self.assertEqual(len(loads), 1)
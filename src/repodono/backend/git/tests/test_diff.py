@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from repodono.storage.exceptions import RevisionNotFoundError
+
+from repodono.backend.git.diff import stats_cache
+
+from repodono.backend.git.tests.test_utility import DemoStorageTestCase
+
+
+class DiffTestCase(DemoStorageTestCase):
+
+    def setUp(self):
+        super(DiffTestCase, self).setUp()
+        stats_cache.clear()
+
+    def summary(self, results):
+        return [
+            (r['status'], r['new_path'], r['additions'], r['deletions'])
+            for r in results
+        ]
+
+    def test_diff(self):
+        revs = self.revs
+        results = self.storage.diff(revs[0], revs[3])
+        self.assertFalse(isinstance(results, list))
+        results = list(results)
+        self.assertEqual(self.summary(results), [
+            ('modified', 'file1', 1, 0),
+            ('modified', 'file2', 1, 0),
+            ('added', 'file3', 1, 0),
+            ('added', 'nested/deep/dir/file', 3, 0),
+        ])
+        self.assertIn('+With a new line.', results[0]['patch'])
+        self.assertEqual(results[2]['old_id'], '0' * 40)
+
+        # the reverse, against the current revision.
+        self.assertEqual(self.summary(self.storage.diff(revs[3], revs[0])), [
+            ('modified', 'file1', 0, 1),
+            ('modified', 'file2', 0, 1),
+            ('deleted', 'file3', 0, 1),
+            ('deleted', 'nested/deep/dir/file', 0, 3),
+        ])
+        self.assertEqual(list(self.storage.diff(revs[3])), [])
+
+        with self.assertRaises(RevisionNotFoundError):
+            self.storage.diff('nosuchrev')
+
+    def test_diff_paths(self):
+        revs = self.revs
+        self.assertEqual(self.summary(self.storage.diff(
+            revs[0], revs[3], paths=['nested/deep', 'file3', 'nested'])), [
+            ('added', 'file3', 1, 0),
+            ('added', 'nested/deep/dir/file', 3, 0),
+        ])
+        self.assertEqual(self.summary(self.storage.diff(
+            revs[0], revs[3], paths=['nested/deep/dir/file'])), [
+            ('added', 'nested/deep/dir/file', 3, 0),
+        ])
+        self.assertEqual(self.summary(self.storage.diff(
+            revs[3], revs[0], paths=['nested/deep/'])), [
+            ('deleted', 'nested/deep/dir/file', 0, 3),
+        ])
+        self.assertEqual(list(self.storage.diff(
+            revs[0], revs[3], paths=['nosuchpath'])), [])
+
+    def test_diff_stats(self):
+        revs = self.revs
+        results = list(self.storage.diff(revs[0], revs[2], stats_only=True))
+        self.assertNotIn('patch', results[0])
+        self.assertEqual(self.summary(results), [
+            ('modified', 'file1', 1, 0),
+            ('modified', 'file2', 1, 0),
+            ('added', 'file3', 1, 0),
+        ])
+
+        # now served from the cache.
+        hits = stats_cache.hits
+        self.assertEqual(
+            list(self.storage.diff(revs[0], revs[2], stats_only=True)),
+            results)
+        self.assertEqual(stats_cache.hits, hits + 1)
+
+        stats = self.storage.diff_stats(revs[0], revs[2])
+        self.assertEqual(stats['files_changed'], 3)
+        self.assertEqual(stats['additions'], 3)
+        self.assertEqual(stats['deletions'], 0)
+        self.assertEqual(stats_cache.hits, hits + 2)
@@ -57,3 +57,22 @@ class ParseGitModuleTestCase(unittest.TestCase):
             'foo': 'http://example.com/foo/.git',
             'baz=baz': 'http://example.com/baz/.git',
         })
+
+
+class GitModulesTestCase(unittest.TestCase):
+
+    def test_lookup(self):
+        modules = ext.GitModules({
+            'ext/import1': 'http://example.com/import1',
+            'ext/import1/nested': 'http://example.com/nested',
+            'top': 'http://example.com/top',
+        })
+        self.assertEqual(modules.depths, [1, 2, 3])
+        self.assertEqual(modules.lookup('top'), (
+            'top', 'http://example.com/top', ''))
+        self.assertEqual(modules.lookup('ext/import1/a/b'), (
+            'ext/import1', 'http://example.com/import1', 'a/b'))
+        self.assertIsNone(modules.lookup('ext'))
+        self.assertIsNone(modules.lookup('ext/import2/a'))
+        self.assertIsNone(modules.lookup('topmost/a'))
+        self.assertIsNone(ext.GitModules().lookup('a/b'))
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import unittest
+import tempfile
+import shutil
+import subprocess
+import threading
+import time
+from os.path import exists
+from os.path import join
+
+from pygit2 import init_repository
+from pygit2 import Repository
+from pygit2 import Signature
+from pygit2 import GIT_FILEMODE_BLOB
+
+import zope.component
+
+from zope.component.tests import clearZCML
+
+from repodono.backend.git import graph as graph_module
+from repodono.backend.git.disk import RecordFile
+from repodono.backend.git.disk import ensure_dir
+from repodono.backend.git.graph import CommitGraph
+from repodono.backend.git.utility import GitStorage
+
+from repodono.backend.git.tests.test_utility import DummyItem
+from repodono.backend.git.tests.test_utility import DummyStorageInfo
+
+
+def create_graph_repo(repodir):
+    """
+    Create the following history, with m being the merge of c2 and d3
+    on master and d3 being on branch:
+
+        c0 - c1 - c2 ---- m
+               \\        /
+                d2 - d3
+    """
+
+    repo = init_repository(join(repodir, '.git'), bare=True)
+    revs = {}
+
+    def commit(name, parents, ref=None, t=[1400000000]):
+        t[0] += 1
+        tbder = repo.TreeBuilder()
+        tbder.insert(name, repo.create_blob(name), GIT_FILEMODE_BLOB)
+        sig = Signature('user1', '1@example.com', t[0], 0)
+        revs[name] = repo.create_commit(
+            ref, sig, sig, name, tbder.write(),
+            [revs[p] for p in parents],
+        ).hex
+
+    commit('c0', [])
+    commit('c1', ['c0'])
+    commit('c2', ['c1'])
+    commit('d2', ['c1'])
+    commit('d3', ['d2'], 'refs/heads/branch')
+    commit('m', ['c2', 'd3'], 'refs/heads/master')
+    return revs
+
+
+class CommitGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        zope.component.provideAdapter(DummyStorageInfo, (DummyItem,))
+        self.revs = create_graph_repo(self.testdir)
+        self.repo = Repository(join(self.testdir, '.git'))
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+        clearZCML()
+
+    def check_graph(self, graph):
+        revs = self.revs
+        self.assertEqual(graph.generation(revs['c0']), 1)
+        self.assertEqual(graph.generation(revs['c2']), 3)
+        self.assertEqual(graph.generation(revs['d3']), 4)
+        self.assertEqual(graph.generation(revs['m']), 5)
+        self.assertEqual(
+            graph.parents(revs['m']), (revs['c2'], revs['d3']))
+
+        self.assertTrue(graph.is_ancestor(revs['c0'], revs['m']))
+        self.assertTrue(graph.is_ancestor(revs['d2'], revs['m']))
+        self.assertTrue(graph.is_ancestor(revs['m'], revs['m']))
+        self.assertFalse(graph.is_ancestor(revs['m'], revs['c2']))
+        self.assertFalse(graph.is_ancestor(revs['c2'], revs['d3']))
+        self.assertFalse(graph.is_ancestor(revs['d2'], revs['c2']))
+
+        self.assertEqual(graph.merge_base(revs['c2'], revs['d3']), revs['c1'])
+        self.assertEqual(graph.merge_base(revs['m'], revs['d2']), revs['d2'])
+
+        self.assertEqual(graph.ahead_behind(revs['c2'], revs['d3']), (1, 2))
+        self.assertEqual(graph.ahead_behind(revs['m'], revs['c0']), (5, 0))
+        self.assertEqual(graph.ahead_behind(revs['c0'], revs['m']), (0, 5))
+        self.assertEqual(graph.ahead_behind(revs['m'], revs['m']), (0, 0))
+
+    def test_inflated(self):
+        graph = CommitGraph(self.repo)
+        self.check_graph(graph)
+        self.assertTrue(exists(graph.filename))
+        # a fresh instance, without anything loaded, reads the file.
+        RecordFile._loaded.clear()
+        self.check_graph(CommitGraph(self.repo))
+
+    def test_git_commit_graph(self):
+        try:
+            subprocess.check_call(
+                ['git', 'commit-graph', 'write', '--reachable'],
+                cwd=self.repo.path,
+                stdout=open('/dev/null', 'w'), stderr=subprocess.STDOUT,
+            )
+        except (OSError, subprocess.CalledProcessError):
+            self.skipTest('git commit-graph not available')
+
+        graph = CommitGraph(self.repo)
+        graph_file = graph._git_file()
+        if graph_file is None:
+            self.skipTest('unsupported commit-graph file')
+        self.assertEqual(graph_file.count, 6)
+        node = graph_file.lookup(self.revs['m'])
+        if node is None:
+            self.skipTest('commit-graph without generation numbers')
+        self.assertEqual(node[0], 5)
+        self.check_graph(graph)
+        # nothing needed to be inflated.
+        self.assertFalse(exists(graph.filename))
+
+    def test_git_commit_graph_loaded_once(self):
+        graph = CommitGraph(self.repo)
+        ensure_dir(join(self.repo.path, 'objects', 'info'))
+        open(graph.git_filename, 'wb').close()
+        loaded = []
+
+        def load(filename):
+            loaded.append(filename)
+            time.sleep(0.05)
+            return filename
+
+        original = graph_module.GitCommitGraphFile
+        graph_module.GitCommitGraphFile = load
+        try:
+            threads = [
+                threading.Thread(target=graph._git_file) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            graph_module.GitCommitGraphFile = original
+            CommitGraph._git_files.pop(graph.git_filename, None)
+        self.assertEqual(loaded, [graph.git_filename])
+
+    def test_storage_ahead_behind(self):
+        revs = self.revs
+        storage = GitStorage(DummyItem(self.testdir))
+        self.assertEqual(storage.ahead_behind('branch', 'master'), (0, 2))
+        self.assertEqual(storage.ahead_behind(revs['c2'], 'branch'), (1, 2))
+
+    def test_loads_once_per_query(self):
+        revs = self.revs
+        graph = CommitGraph(self.repo)
+        loads = []
+        state = graph._state
+        graph._state = lambda: loads.append(1) or state()
+        self.assertEqual(graph.ahead_behind(revs['m'], revs['c0']), (5, 0))
+        self.assertTrue(graph.is_ancestor(revs['c0'], revs['m']))
+        self.assertEqual(len(loads), 2)
+        # the inflated commits were recorded all the same.
+        RecordFile._loaded.clear()
+        self.assertEqual(len(graph.records.load()), 6)
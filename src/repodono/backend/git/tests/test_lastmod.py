@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+import unittest
+import tempfile
+import shutil
+from os import listdir
+from os.path import join
+
+from pygit2 import Signature
+
+import zope.component
+
+from zope.component.tests import clearZCML
+
+from repodono.backend.git import lastmod as lastmod_module
+from repodono.backend.git.disk import RecordFile
+from repodono.backend.git.lastmod import LastModifiedIndex
+from repodono.backend.git.utility import GitStorage
+
+from repodono.backend.git.testing import util
+from repodono.backend.git.tests.test_utility import DemoStorageTestCase
+from repodono.backend.git.tests.test_utility import DummyItem
+from repodono.backend.git.tests.test_utility import DummyStorageInfo
+
+PATHS = [
+    '', 'file1', 'file2', 'file3', 'nested', 'nested/deep',
+    'nested/deep/dir', 'nested/deep/dir/file',
+]
+
+
+class LastModifiedIndexTestCase(DemoStorageTestCase):
+
+    def assertIndex(self, index):
+        revs = self.revs
+        result = dict((k, v[0]) for k, v in index.items())
+        self.assertEqual(result, {
+            '': revs[3],
+            'file1': revs[1],
+            'file2': revs[2],
+            'file3': revs[2],
+            'nested': revs[3],
+            'nested/deep': revs[3],
+            'nested/deep/dir': revs[3],
+            'nested/deep/dir/file': revs[3],
+        })
+
+    def test_full(self):
+        lastmod = LastModifiedIndex(self.repo)
+        self.assertFalse(lastmod.indexed(self.revs[3]))
+        self.assertEqual(lastmod.update(self.repo[self.revs[3]]), 4)
+        self.assertEqual(lastmod.update(self.repo[self.revs[3]]), 0)
+        self.assertIndex(lastmod.mapping(self.revs[3]))
+        # freshly loaded.
+        RecordFile._loaded.clear()
+        lastmod = LastModifiedIndex(self.repo)
+        self.assertIndex(lastmod.mapping(self.revs[3]))
+        self.assertIndex(lastmod.lookup(self.revs[3], PATHS))
+        # only the root commit got a checkpoint.
+        self.assertEqual(sorted(listdir(lastmod.root)), sorted([
+            'deltas', self.revs[0]]))
+
+    def test_incremental(self):
+        lastmod = LastModifiedIndex(self.repo)
+        self.assertEqual(lastmod.update(self.repo[self.revs[1]]), 2)
+        index = lastmod.lookup(self.revs[1], PATHS)
+        self.assertEqual(index['file2'][0], self.revs[0])
+        self.assertNotIn('file3', index)
+        self.assertEqual(lastmod.update(self.repo[self.revs[3]]), 2)
+        self.assertIndex(lastmod.lookup(self.revs[3], PATHS))
+
+    def test_checkpoints(self):
+        repo = self.repo
+        revs = self.revs
+        lastmod = LastModifiedIndex(repo)
+        head = repo[revs[3]]
+        sig = Signature('user1', '1@example.com', 1400000000, 0)
+        tree = head.tree
+        commits = []
+        parent = head.id
+        # file3 gets deleted, then added back.
+        for i in range(12):
+            tbder = repo.TreeBuilder(tree)
+            tbder.insert('counter', repo.create_blob(str(i)), 0o100644)
+            if i == 3:
+                tbder.remove('file3')
+            elif i == 8:
+                tbder.insert('file3', repo.create_blob('back'), 0o100644)
+            tree = repo[tbder.write()]
+            parent = repo.create_commit(
+                None, sig, sig, 'c%d' % i, tree.id, [parent])
+            commits.append(parent.hex)
+
+        original = lastmod_module.CHECKPOINT_INTERVAL
+        lastmod_module.CHECKPOINT_INTERVAL = 5
+        try:
+            lastmod.update(repo[commits[6]])
+            lastmod.update(repo[commits[11]])
+        finally:
+            lastmod_module.CHECKPOINT_INTERVAL = original
+
+        # the root, then every 5 commits.
+        self.assertEqual(sorted(listdir(lastmod.root)), sorted([
+            'deltas', revs[0], commits[1], commits[6], commits[11]]))
+
+        for i, commit_hex in enumerate(commits):
+            found = lastmod.lookup(commit_hex, PATHS + ['counter'])
+            self.assertEqual(found['counter'][0], commit_hex)
+            self.assertEqual(found['file1'][0], revs[1])
+            if 3 <= i < 8:
+                self.assertNotIn('file3', found)
+            elif i < 3:
+                self.assertEqual(found['file3'][0], revs[2])
+            else:
+                self.assertEqual(found['file3'][0], commits[8])
+            self.assertEqual(
+                dict((k, v) for k, v in lastmod.mapping(commit_hex).items()
+                     if k in found), found)
+
+    def test_gc(self):
+        lastmod = LastModifiedIndex(self.repo)
+        lastmod.update(self.repo[self.revs[3]])
+        self.assertEqual(lastmod.gc([self.revs[3]]), 0)
+        # as if master got reset to its first commit.
+        self.assertEqual(lastmod.gc([self.revs[0]]), 3)
+        self.assertTrue(lastmod.indexed(self.revs[0]))
+        self.assertFalse(lastmod.indexed(self.revs[1]))
+        self.assertEqual(lastmod.lookup(self.revs[0], ['file1'])['file1'][0],
+                         self.revs[0])
+        self.assertEqual(lastmod.gc([]), 1)
+        self.assertEqual(listdir(lastmod.root), ['deltas'])
+
+    def test_lookup(self):
+        lastmod = LastModifiedIndex(self.repo)
+        lastmod.update(self.repo[self.revs[3]])
+        commit = self.repo[self.revs[1]]
+        self.assertEqual(
+            lastmod.lookup(self.revs[3], ['file1', 'nosuchpath']), {
+                'file1': (
+                    self.revs[1], commit.committer.time,
+                    commit.committer.offset),
+            })
+        self.assertEqual(lastmod.lookup('0' * 40, ['file1']), {})
+
+    def test_lookup_extends(self):
+        lastmod = LastModifiedIndex(self.repo)
+        # nothing indexed along the way, so left to be built.
+        self.assertEqual(lastmod.lookup(self.revs[1], ['file1']), {})
+        self.assertFalse(lastmod.indexed(self.revs[1]))
+
+        # as if revs[2] and revs[3] arrived through a push.
+        lastmod.update(self.repo[self.revs[1]])
+        self.assertIndex(lastmod.lookup(self.revs[3], PATHS))
+        self.assertTrue(lastmod.indexed(self.revs[2]))
+        self.assertTrue(lastmod.indexed(self.revs[3]))
+
+
+class LastModifiedStorageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        zope.component.provideAdapter(DummyStorageInfo, (DummyItem,))
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+        clearZCML()
+
+    def test_storage_dates(self):
+        util.extract_archive(self.testdir)
+        storage = GitStorage(DummyItem(join(self.testdir, 'repodata')))
+        self.assertEqual(storage.pathinfo('1')['date'], '')
+        self.assertEqual(storage.last_modified(['1']), {})
+
+        storage.build_last_modified()
+        rev = storage.last_modified(['1'])['1']['rev']
+        date = storage.pathinfo('1')['date']
+        self.assertNotEqual(date, '')
+        storage.checkout(rev)
+        self.assertEqual(date, storage.pathinfo('1/f1')['date'])
+
+        storage.checkout()
+        infos = storage.listdir_info('')
+        dates = storage.last_modified([i['basename'] for i in infos])
+        for info in infos:
+            self.assertEqual(info['date'], dates[info['basename']]['date'])
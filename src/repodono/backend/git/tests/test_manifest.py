@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import unittest
+import tempfile
+import shutil
+from os import listdir
+from os.path import exists
+from os.path import join
+
+from pygit2 import Repository
+
+import zope.component
+
+from zope.component.tests import clearZCML
+
+from repodono.storage.exceptions import PathNotDirError
+from repodono.storage.exceptions import PathNotFoundError
+
+from repodono.backend.git.blobio import ObjectSizes
+from repodono.backend.git.manifest import ManifestStore
+from repodono.backend.git.utility import GitStorage
+
+from repodono.backend.git.testing import util
+from repodono.backend.git.tests.test_utility import DummyItem
+from repodono.backend.git.tests.test_utility import DummyStorageInfo
+
+
+class ManifestStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_build_full(self):
+        revs, fulllist = util.create_demo_git_repo(self.testdir)
+        repo = Repository(join(self.testdir, '.git'))
+        store = ManifestStore(repo)
+        commit = repo[revs[-1]]
+        self.assertIsNone(store.get(commit.tree.hex))
+
+        manifest = store.build(commit)
+        self.assertTrue(exists(store.filename(commit.tree.hex)))
+        self.assertEqual([r[0] for r in manifest], fulllist)
+        self.assertEqual(manifest.find('file1')[2], 38)
+        self.assertEqual(manifest.find('nested/deep/dir/file')[1],
+                         repo[commit.tree['nested/deep/dir/file'].id].hex)
+        self.assertIsNone(manifest.find('nested'))
+
+        self.assertEqual(
+            manifest.listdir(''), ['file1', 'file2', 'file3', 'nested'])
+        self.assertEqual(manifest.listdir('nested/deep'), ['dir'])
+        self.assertIsNone(manifest.listdir('file1'))
+        self.assertIsNone(manifest.listdir('nosuchpath'))
+
+    def test_build_incremental(self):
+        revs, fulllist = util.create_demo_git_repo(self.testdir)
+        repo = Repository(join(self.testdir, '.git'))
+        store = ManifestStore(repo)
+        for rev in revs:
+            manifest = store.build(repo[rev])
+            # verify that the result is identical to a full build.
+            with ObjectSizes(repo) as sizes:
+                self.assertEqual(
+                    list(manifest),
+                    store._full_records(repo[rev].tree, sizes))
+        self.assertEqual([r[0] for r in manifest], fulllist)
+
+    def test_build_from_base(self):
+        revs, fulllist = util.create_demo_git_repo(self.testdir)
+        repo = Repository(join(self.testdir, '.git'))
+        store = ManifestStore(repo)
+        store.build(repo[revs[0]])
+        with ObjectSizes(repo) as sizes:
+            expected = store._full_records(repo[revs[-1]].tree, sizes)
+
+        def full_records(tree, sizes):
+            raise AssertionError('full build not expected')
+
+        # e.g. after a fast-forward of more than one commit.
+        store._full_records = full_records
+        manifest = store.build(repo[revs[-1]], [repo[revs[0]]])
+        self.assertEqual(list(manifest), expected)
+
+    def test_gc(self):
+        revs, fulllist = util.create_demo_git_repo(self.testdir)
+        repo = Repository(join(self.testdir, '.git'))
+        store = ManifestStore(repo)
+        for rev in revs:
+            store.build(repo[rev])
+        self.assertEqual(store.gc(revs), 0)
+        self.assertEqual(store.gc([revs[0], revs[-1], 'f' * 40]), 2)
+        self.assertEqual(sorted(listdir(store.root)), sorted([
+            repo[revs[0]].tree.hex, repo[revs[-1]].tree.hex]))
+        self.assertIsNone(store.get(repo[revs[1]].tree.hex))
+
+
+class ManifestStorageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        zope.component.provideAdapter(DummyStorageInfo, (DummyItem,))
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+        clearZCML()
+
+    def test_storage_manifest(self):
+        util.extract_archive(self.testdir)
+        storage = GitStorage(DummyItem(join(self.testdir, 'repodata')))
+        files = storage.files()
+        listing = storage.listdir('')
+        ext = storage.listdir('ext')
+        info = storage.pathinfo('1/f1')
+        folder = storage.pathinfo('1')
+        subrepo = storage.pathinfo('ext/import1')
+
+        self.assertIsNone(storage._manifest())
+        storage.build_manifest()
+        self.assertIsNotNone(storage._manifest())
+
+        self.assertEqual(storage.files(), files)
+        self.assertEqual(storage.listdir(''), listing)
+        self.assertEqual(storage.listdir('ext'), ext)
+        self.assertEqual(storage.pathinfo('1/f1'), info)
+        self.assertEqual(storage.pathinfo('1'), folder)
+        self.assertEqual(storage.pathinfo('ext/import1'), subrepo)
+
+        with self.assertRaises(PathNotDirError):
+            storage.listdir('ext/import1')
+
+        with self.assertRaises(PathNotFoundError):
+            storage.listdir('nosuchpath')
+
+        with self.assertRaises(PathNotFoundError):
+            storage.pathinfo('nosuchpath')
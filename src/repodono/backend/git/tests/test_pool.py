@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import unittest
+import tempfile
+import shutil
+from os.path import join
+
+from pygit2 import init_repository
+
+from repodono.backend.git.cache import LRUCache
+from repodono.backend.git.pool import RepositoryPool
+
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        # b was the least recently used.
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(), {
+            'hits': 3,
+            'misses': 1,
+            'evictions': 1,
+            'size': 2,
+            'maxsize': 2,
+        })
+
+    def test_pop_clear(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertEqual(cache.pop('a'), None)
+        cache.put('b', 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class RepositoryPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.pool = RepositoryPool(2)
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_missing(self):
+        with self.assertRaises(KeyError):
+            self.pool.get(self.testdir)
+
+    def test_reuse(self):
+        init_repository(join(self.testdir, '.git'), bare=True)
+        repo = self.pool.get(self.testdir)
+        self.assertIs(self.pool.get(self.testdir), repo)
+        stats = self.pool.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_eviction(self):
+        paths = [join(self.testdir, str(i)) for i in range(3)]
+        for path in paths:
+            init_repository(join(path, '.git'), bare=True)
+        repo = self.pool.get(paths[0])
+        self.pool.get(paths[1])
+        self.pool.get(paths[2])
+        self.assertIsNot(self.pool.get(paths[0]), repo)
+        self.assertEqual(self.pool.stats()['evictions'], 2)
+
+    def test_invalidate(self):
+        init_repository(join(self.testdir, '.git'), bare=True)
+        repo = self.pool.get(self.testdir)
+        self.pool.invalidate(self.testdir)
+        self.assertIsNot(self.pool.get(self.testdir), repo)
+
+    def test_reinitialized(self):
+        path = join(self.testdir, 'repo')
+        init_repository(join(path, '.git'), bare=True)
+        repo = self.pool.get(path)
+        shutil.rmtree(path)
+        with self.assertRaises(KeyError):
+            self.pool.get(path)
+
+        init_repository(join(path, '.git'), bare=True)
+        self.assertIsNot(self.pool.get(path), repo)
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import os
+from os.path import exists
+from os.path import join
+from time import time
+
+from pygit2 import GIT_OBJ_COMMIT
+from pygit2 import Signature
+
+from repodono.storage.exceptions import RevisionNotFoundError
+
+from repodono.backend.git.refs import RefSnapshot
+from repodono.backend.git.refs import RevisionCache
+from repodono.backend.git.refs import invalidate_refs
+from repodono.backend.git.refs import read_packed_refs
+from repodono.backend.git.refs import ref_snapshot
+from repodono.backend.git.refs import revision_cache
+from repodono.backend.git.utility import GitStorage
+
+from repodono.backend.git.tests.test_utility import DemoStorageTestCase
+from repodono.backend.git.tests.test_utility import DummyItem
+
+
+class RevisionCacheTestCase(DemoStorageTestCase):
+
+    def test_resolve(self):
+        cache = RevisionCache()
+        revs = self.revs
+        self.assertEqual(cache.resolve(self.repo, 'HEAD'), revs[3])
+        self.assertEqual(cache.resolve(self.repo, 'HEAD'), revs[3])
+        # symbolic revisions are left to libgit2.
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(cache.resolve(self.repo, 'master~2'), revs[1])
+        self.assertEqual(cache.resolve(self.repo, revs[0]), revs[0])
+        self.assertEqual(cache.resolve(self.repo, revs[0]), revs[0])
+        self.assertEqual(cache.hits, 1)
+
+        with self.assertRaises(KeyError):
+            cache.resolve(self.repo, 'nosuchrev')
+        with self.assertRaises(KeyError):
+            cache.resolve(self.repo, 'f' * 40)
+
+    def test_resolve_commit(self):
+        cache = RevisionCache()
+        revs = self.revs
+        sig = Signature('user1', '1@example.com', 1400000000, 0)
+        tag = self.repo.create_tag(
+            'annotated', revs[1], GIT_OBJ_COMMIT, sig, 'annotated').hex
+        self.assertEqual(cache.resolve_commit(self.repo, 'annotated'), revs[1])
+        self.assertEqual(cache.resolve_commit(self.repo, tag), revs[1])
+        self.assertEqual(cache.resolve(self.repo, tag), tag)
+
+        class Unreadable(object):
+            # nothing but the path, so a hit must not look anything up.
+            path = self.repo.path
+
+        hits = cache.hits
+        self.assertEqual(cache.resolve_commit(Unreadable(), tag), revs[1])
+        self.assertEqual(cache.hits, hits + 1)
+
+        tree = self.repo[revs[0]].tree.hex
+        with self.assertRaises(KeyError):
+            cache.resolve_commit(self.repo, tree)
+        with self.assertRaises(KeyError):
+            cache.resolve_commit(self.repo, tree)
+        self.assertEqual(cache.resolve(self.repo, tree), tree)
+
+    def test_ref_changes(self):
+        cache = RevisionCache()
+        revs = self.revs
+        self.assertEqual(cache.resolve(self.repo, 'master'), revs[3])
+
+        # a loose reference being moved.
+        self.repo.lookup_reference('refs/heads/master').set_target(revs[1])
+        self.assertEqual(cache.resolve(self.repo, 'master'), revs[1])
+        self.assertEqual(cache.resolve(self.repo, 'HEAD'), revs[1])
+
+        # a new reference within a new directory.
+        self.repo.create_reference('refs/heads/feature/a', revs[0])
+        self.assertEqual(cache.resolve(self.repo, 'feature/a'), revs[0])
+        self.repo.lookup_reference('refs/heads/feature/a').set_target(revs[2])
+        self.assertEqual(cache.resolve(self.repo, 'feature/a'), revs[2])
+
+        # a packed reference.
+        with open(join(self.repo.path, 'packed-refs'), 'w') as f:
+            f.write('%s refs/tags/packed\n' % revs[0])
+        self.assertEqual(cache.resolve(self.repo, 'packed'), revs[0])
+        with open(join(self.repo.path, 'packed-refs'), 'w') as f:
+            f.write('%s refs/tags/packed\n%s refs/tags/other\n' % (
+                revs[2], revs[0]))
+        self.assertEqual(cache.resolve(self.repo, 'packed'), revs[2])
+
+    def test_storage(self):
+        revision_cache.clear()
+        storage = GitStorage(DummyItem(self.testdir))
+        self.assertEqual(storage.rev, self.revs[3])
+        storage.checkout(self.revs[1])
+        hits = revision_cache.hits
+        storage = GitStorage(DummyItem(self.testdir))
+        storage.checkout(self.revs[1])
+        storage.log(self.revs[1], 2)
+        self.assertEqual(revision_cache.hits, hits + 2)
+
+        self.repo.lookup_reference('refs/heads/master').set_target(
+            self.revs[1])
+        self.assertEqual(GitStorage(DummyItem(self.testdir)).rev, self.revs[1])
+        with self.assertRaises(RevisionNotFoundError):
+            storage.checkout('nosuchrev')
+
+
+class RefSnapshotTestCase(DemoStorageTestCase):
+
+    def setUp(self):
+        super(RefSnapshotTestCase, self).setUp()
+        repo = self.repo
+        revs = self.revs
+        # commits with known times, older than the demo ones.
+        head = repo[revs[3]]
+        self.c = {}
+        for t in (1, 2, 3):
+            sig = Signature('User', 'user@example.com', 1400000000 + t, 0)
+            self.c[t] = repo.create_commit(
+                None, sig, sig, 'c%d' % t, head.tree.id, [head.id]).hex
+        sig = Signature('User', 'user@example.com', 0, 0)
+        self.tag = repo.create_tag(
+            'annotated', self.c[2], GIT_OBJ_COMMIT, sig, 'annotated').hex
+        repo.create_reference('refs/heads/b0', self.c[3])
+        repo.create_reference('refs/heads/b2', self.c[1])
+        # a packed tag and branch, the latter overridden by a loose one.
+        with open(join(repo.path, 'packed-refs'), 'w') as f:
+            f.write(
+                '# pack-refs with: peeled fully-peeled \n'
+                '%s refs/heads/b0\n'
+                '%s refs/tags/packed\n'
+                '%s refs/tags/v0.1\n'
+                '^%s\n' % (revs[1], revs[3], self.tag, self.c[2]))
+
+    def test_read_packed_refs(self):
+        refs = read_packed_refs(join(self.repo.path, 'packed-refs'))
+        self.assertEqual(refs, {
+            'refs/heads/b0': [self.revs[1], self.revs[1]],
+            'refs/tags/packed': [self.revs[3], self.revs[3]],
+            'refs/tags/v0.1': [self.tag, self.c[2]],
+        })
+        self.assertEqual(read_packed_refs(join(self.testdir, 'none')), {})
+
+    def test_snapshot(self):
+        c = self.c
+        snapshot = RefSnapshot(self.repo)
+        self.assertEqual(snapshot.names, [
+            'refs/heads/b0', 'refs/heads/b2', 'refs/heads/master',
+            'refs/tags/annotated', 'refs/tags/packed', 'refs/tags/v0.1',
+        ])
+        self.assertEqual(snapshot.target('refs/heads/b0'), c[3])
+        self.assertEqual(snapshot.target('refs/tags/annotated'), self.tag)
+        self.assertEqual(snapshot.peeled('refs/tags/annotated'), c[2])
+        self.assertEqual(snapshot.peeled('refs/heads/b2'), c[1])
+        self.assertEqual(snapshot.time('refs/heads/b2'), 1400000001)
+
+        self.assertEqual(snapshot.list('refs/tags/'), [
+            'refs/tags/annotated', 'refs/tags/packed', 'refs/tags/v0.1'])
+        self.assertEqual(snapshot.list('refs/heads/b'), [
+            'refs/heads/b0', 'refs/heads/b2'])
+        self.assertEqual(snapshot.list('refs/heads/', sort='date'), [
+            'refs/heads/b2', 'refs/heads/b0', 'refs/heads/master'])
+        self.assertEqual(snapshot.list(
+            'refs/heads/', sort='date', reverse=True, offset=1, limit=1), [
+            'refs/heads/b0'])
+        self.assertEqual(snapshot.list('refs/nothing/'), [])
+        with self.assertRaises(ValueError):
+            snapshot.list(sort='size')
+
+    def _backdate(self):
+        # as if the references were last changed a while ago.
+        old = time() - 60
+        paths = [join(self.repo.path, name) for name in ('HEAD', 'packed-refs')
+                 if exists(join(self.repo.path, name))]
+        for path in paths + [
+                base for base, dirs, files in os.walk(
+                    join(self.repo.path, 'refs'))]:
+            os.utime(path, (old, old))
+
+    def test_ref_snapshot(self):
+        # just changed, so not kept.
+        snapshot = ref_snapshot(self.repo)
+        self.assertTrue(snapshot.racy)
+        self.assertIsNot(ref_snapshot(self.repo), snapshot)
+
+        self._backdate()
+        snapshot = ref_snapshot(self.repo)
+        self.assertFalse(snapshot.racy)
+        self.assertIs(ref_snapshot(self.repo), snapshot)
+
+        self.repo.create_reference('refs/tags/new', self.revs[0])
+        updated = ref_snapshot(self.repo)
+        self.assertIsNot(updated, snapshot)
+        self.assertIn('refs/tags/new', updated.names)
+
+        # a new directory touches its parent.
+        self._backdate()
+        snapshot = ref_snapshot(self.repo)
+        self.repo.create_reference('refs/heads/feature/a', self.revs[0])
+        self.assertIn('refs/heads/feature/a', ref_snapshot(self.repo).names)
+
+        # and the packed-refs file.
+        self._backdate()
+        snapshot = ref_snapshot(self.repo)
+        with open(join(self.repo.path, 'packed-refs'), 'a') as f:
+            f.write('%s refs/tags/packed2\n' % self.revs[0])
+        self.assertIn('refs/tags/packed2', ref_snapshot(self.repo).names)
+
+    def test_invalidate_refs(self):
+        self._backdate()
+        snapshot = ref_snapshot(self.repo)
+        self.assertIs(ref_snapshot(self.repo), snapshot)
+        invalidate_refs(self.repo)
+        self.assertIsNot(ref_snapshot(self.repo), snapshot)
+
+    def test_storage(self):
+        c = self.c
+        revs = self.revs
+        storage = GitStorage(DummyItem(self.testdir))
+        self.assertEqual(storage.branches(), (
+            ('b0', c[3]), ('b2', c[1]), ('master', revs[3])))
+        self.assertEqual(storage.tags(prefix='v', peeled=True), (
+            ('v0.1', self.tag, c[2]),))
+        self.assertEqual(storage.tags(sort='date', reverse=True, limit=2), (
+            ('packed', revs[3]), ('v0.1', self.tag)))
+        self.assertEqual(storage.tags(offset=2), (('v0.1', self.tag),))
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import unittest
+import tempfile
+import shutil
+from os.path import join
+
+from pygit2 import Repository
+
+import zope.component
+
+from zope.component.tests import clearZCML
+
+from repodono.storage.interfaces import IStorageBackendFSAdapter
+
+from repodono.backend.git.remote import RefWants
+from repodono.backend.git.remote import RemoteState
+from repodono.backend.git.remote import filter_refs
+from repodono.backend.git.remote import match_ref
+from repodono.backend.git.utility import GitStorageBackend
+
+from repodono.backend.git.testing import util
+from repodono.backend.git.tests.test_utility import DummyFSBackendAdapter
+from repodono.backend.git.tests.test_utility import DummyItem
+from repodono.backend.git.tests.test_utility import DummyStorageInfo
+
+
+class DictState(object):
+
+    def __init__(self, refs=None):
+        self.refs = refs
+
+    def get(self):
+        return self.refs
+
+
+class RefFilterTestCase(unittest.TestCase):
+
+    def test_match_ref(self):
+        self.assertTrue(match_ref('refs/heads/master'))
+        self.assertTrue(match_ref('refs/heads/master', ['refs/heads/*']))
+        self.assertFalse(match_ref('refs/tags/v1', ['refs/heads/*']))
+        self.assertFalse(match_ref(
+            'refs/heads/wip/1', ['refs/heads/*'], ['refs/heads/wip/*']))
+
+    def test_filter_refs(self):
+        refs = {
+            'HEAD': 'a' * 40,
+            'refs/heads/master': 'a' * 40,
+            'refs/tags/v1': 'b' * 40,
+            'refs/tags/v1^{}': 'c' * 40,
+            'refs/pull/1/head': 'd' * 40,
+        }
+        self.assertEqual(filter_refs(refs), refs)
+        self.assertEqual(
+            sorted(filter_refs(refs, ['refs/*'], ['refs/pull/*'])), [
+                'refs/heads/master', 'refs/tags/v1', 'refs/tags/v1^{}'])
+        self.assertEqual(
+            sorted(filter_refs(refs, exclude=['refs/tags/*'])), [
+                'HEAD', 'refs/heads/master', 'refs/pull/1/head'])
+
+    def test_wants(self):
+        refs = {
+            'refs/heads/master': 'a' * 40,
+            'refs/heads/local': 'b' * 40,
+            'refs/tags/v1': 'c' * 40,
+            'refs/tags/v1^{}': 'd' * 40,
+        }
+        object_store = set(['b' * 40])
+
+        wants = RefWants(object_store, DictState())
+        self.assertEqual(sorted(wants(refs)), ['a' * 40, 'c' * 40])
+        self.assertFalse(wants.unchanged)
+
+        wants = RefWants(object_store, include=['refs/heads/*'])
+        self.assertEqual(wants(refs), ['a' * 40])
+        self.assertEqual(sorted(wants.refs), [
+            'refs/heads/local', 'refs/heads/master'])
+
+        wants = RefWants(object_store, DictState(dict(refs)))
+        self.assertEqual(wants(refs), [])
+        self.assertTrue(wants.unchanged)
+
+
+class RemoteFetchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = GitStorageBackend()
+        self.testdir = tempfile.mkdtemp()
+        zope.component.provideAdapter(DummyStorageInfo, (DummyItem,))
+        zope.component.provideAdapter(
+            DummyFSBackendAdapter,
+            (GitStorageBackend, DummyItem,),
+            IStorageBackendFSAdapter,
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+        clearZCML()
+
+    def test_sync_filtered(self):
+        demo_path = join(self.testdir, 'demo')
+        util.create_demo_git_repo(
+            demo_path, 'refs/heads/alternative', 'refs/heads/new')
+
+        new_path = join(self.testdir, 'new')
+        self.backend.install(DummyItem(new_path))
+        results = self.backend._sync_identifier(
+            new_path, demo_path, exclude=['refs/heads/new'])
+        self.assertEqual(results, [
+            ('refs/heads/alternative',
+                (True, 'Created new branch: refs/heads/alternative')),
+        ])
+        repo = Repository(join(new_path, '.git'))
+        self.assertEqual(repo.listall_references(), ['refs/heads/alternative'])
+        # only the objects reachable from the wanted ref got fetched.
+        new = Repository(join(demo_path, '.git')).lookup_reference(
+            'refs/heads/new').target
+        self.assertFalse(new in repo)
+
+        self.assertEqual(
+            sorted(RemoteState(repo, demo_path).get()),
+            ['refs/heads/alternative'])
+
+    def test_sync_unchanged(self):
+        demo_path = join(self.testdir, 'demo')
+        util.create_demo_git_repo(demo_path)
+        new_path = join(self.testdir, 'new')
+        self.backend.install(DummyItem(new_path))
+        self.backend.fetch_include = ['refs/heads/*']
+
+        self.backend._sync_identifier(new_path, demo_path)
+        repo = Repository(join(new_path, '.git'))
+        state = RemoteState(repo, demo_path)
+        self.assertEqual(sorted(state.get()), ['refs/heads/master'])
+
+        calls = []
+        original = RemoteState.put
+        RemoteState.put = lambda self, refs: calls.append(refs)
+        try:
+            results = self.backend._sync_identifier(new_path, demo_path)
+        finally:
+            RemoteState.put = original
+        self.assertEqual(results, [
+            ('refs/heads/master', (True, 'Source and target are identical.')),
+        ])
+        # the snapshot matched, so nothing got recorded again.
+        self.assertEqual(calls, [])
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+import unittest
+import tempfile
+import shutil
+import threading
+import time
+from os.path import join
+
+from dulwich.repo import Repo
+from dulwich.server import DictBackend
+from dulwich.server import TCPGitServer
+from dulwich.tests.compat.test_client import HTTPGitServer
+
+import zope.component
+
+from zope.component.tests import clearZCML
+
+from repodono.storage.interfaces import IStorageBackendFSAdapter
+
+from repodono.backend.git.scheduler import SyncScheduler
+from repodono.backend.git.scheduler import remote_host
+from repodono.backend.git.utility import GitStorageBackend
+
+from repodono.backend.git.testing import util
+from repodono.backend.git.tests.test_utility import DummyFSBackendAdapter
+from repodono.backend.git.tests.test_utility import DummyItem
+from repodono.backend.git.tests.test_utility import DummyStorageInfo
+
+
+class SlowBackend(object):
+    # records the most syncs seen running at once, per host.
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = {}
+        self.peak = {}
+        self.synced = []
+
+    def _sync_identifier(self, local_path, remote_id):
+        host = remote_host(remote_id)
+        with self.lock:
+            self.running[host] = self.running.get(host, 0) + 1
+            self.peak[host] = max(self.peak.get(host, 0), self.running[host])
+        time.sleep(self.delay)
+        with self.lock:
+            self.running[host] -= 1
+            self.synced.append(local_path)
+        if local_path == 'bad':
+            raise ValueError('error fetching from remote: %s' % remote_id)
+        return []
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def test_remote_host(self):
+        self.assertEqual(remote_host('http://example.com:80/repo'),
+                         'example.com:80')
+        self.assertEqual(remote_host('git://example.com/repo'), 'example.com')
+        self.assertEqual(remote_host('/srv/repo'), '')
+
+    def test_coalesce_and_priority(self):
+        backend = SlowBackend(delay=0)
+        scheduler = SyncScheduler(backend, workers=1)
+        low = scheduler.submit('a', 'git://a.example.com/a', priority=5)
+        high = scheduler.submit('b', 'git://b.example.com/b', priority=1)
+        again = scheduler.submit('a', 'git://a.example.com/a', priority=0)
+        self.assertIs(low, again)
+        self.assertEqual(low.requests, 2)
+
+        scheduler.start()
+        self.assertTrue(scheduler.join(5))
+        scheduler.stop()
+        # the coalesced job took on the more urgent priority.
+        self.assertEqual(backend.synced, ['a', 'b'])
+        self.assertEqual(high.wait(), [])
+
+        metrics = scheduler.metrics()
+        self.assertEqual(metrics['submitted'], 3)
+        self.assertEqual(metrics['coalesced'], 1)
+        self.assertEqual(metrics['completed'], 2)
+        self.assertEqual(metrics['pending'], 0)
+        self.assertEqual(
+            [job.local_path for job in scheduler.results()], ['a', 'b'])
+
+    def test_per_host_cap(self):
+        backend = SlowBackend()
+        scheduler = SyncScheduler(backend, workers=6, per_host=2)
+        for i in range(6):
+            scheduler.submit('a%d' % i, 'git://a.example.com/%d' % i)
+        scheduler.submit('b', 'git://b.example.com/b')
+        scheduler.submit('bad', 'git://b.example.com/bad')
+        scheduler.start()
+        self.assertTrue(scheduler.join(5))
+        scheduler.stop()
+
+        self.assertEqual(backend.peak['a.example.com'], 2)
+        self.assertEqual(len(backend.synced), 8)
+        metrics = scheduler.metrics()
+        self.assertEqual(metrics['completed'], 7)
+        self.assertEqual(metrics['failed'], 1)
+        bad = [job for job in scheduler.results() if job.error]
+        with self.assertRaises(ValueError):
+            bad[0].wait()
+
+    def test_results_kept(self):
+        backend = SlowBackend(delay=0)
+        scheduler = SyncScheduler(backend, workers=1, max_results=2)
+        for name in ('a', 'b', 'c'):
+            scheduler.submit(name, '/' + name)
+        scheduler.start()
+        self.assertTrue(scheduler.join(5))
+        scheduler.stop()
+        self.assertEqual(
+            [job.local_path for job in scheduler.results(clear=True)],
+            ['b', 'c'])
+        self.assertEqual(scheduler.results(), [])
+
+    def test_due(self):
+        backend = SlowBackend(delay=0)
+        scheduler = SyncScheduler(backend, workers=1)
+        scheduler.start()
+        later = scheduler.submit('later', '/later', due=time.time() + 0.2)
+        now = scheduler.submit('now', '/now', priority=1)
+        self.assertEqual(now.wait(5), [])
+        self.assertFalse(later.done())
+        self.assertEqual(later.wait(5), [])
+        scheduler.stop()
+        self.assertEqual(backend.synced, ['now', 'later'])
+
+
+class SchedulerSyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        zope.component.provideAdapter(DummyStorageInfo, (DummyItem,))
+        zope.component.provideAdapter(
+            DummyFSBackendAdapter,
+            (GitStorageBackend, DummyItem,),
+            IStorageBackendFSAdapter,
+        )
+        self.backend = GitStorageBackend()
+        util.extract_archive(self.testdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+        clearZCML()
+
+    def test_sync_servers(self):
+        simple1_path = join(self.testdir, 'simple1')
+
+        dulwich_backend = DictBackend({b'/': Repo(simple1_path)})
+        dulwich_server = TCPGitServer(dulwich_backend, b'localhost', 0)
+        self.addCleanup(dulwich_server.shutdown)
+        self.addCleanup(dulwich_server.server_close)
+        threading.Thread(target=dulwich_server.serve).start()
+        _, port = dulwich_server.socket.getsockname()
+
+        httpd = HTTPGitServer(('localhost', 0), simple1_path)
+        self.addCleanup(httpd.shutdown)
+        threading.Thread(target=httpd.serve_forever).start()
+
+        scheduler = SyncScheduler(self.backend, workers=3)
+        jobs = []
+        for name, remote in (
+                ('git', 'git://localhost:%d' % port),
+                ('http', httpd.get_url()),
+                ('local', simple1_path)):
+            path = join(self.testdir, name)
+            self.backend.install(DummyItem(path))
+            jobs.append(scheduler.submit(path, remote))
+        scheduler.start()
+        self.assertTrue(scheduler.join(30))
+        scheduler.stop()
+
+        for job in jobs:
+            self.assertEqual(job.wait(), [
+                ('refs/heads/master',
+                    (True, 'Created new branch: refs/heads/master')),
+            ])
+            storage = self.backend.acquire(DummyItem(job.local_path))
+            self.assertEqual(storage.files(), [
+                'README', 'test1', 'test2', 'test3'])
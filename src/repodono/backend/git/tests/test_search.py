@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from pygit2 import Signature
+
+from repodono.storage.exceptions import PathNotFoundError
+from repodono.storage.exceptions import RevisionNotFoundError
+
+from repodono.backend.git import search as search_module
+from repodono.backend.git.search import TrigramIndex
+from repodono.backend.git.search import has_trigram
+from repodono.backend.git.search import required_trigrams
+from repodono.backend.git.search import search
+from repodono.backend.git.search import trigrams
+from repodono.backend.git.utility import GitStorage
+
+from repodono.backend.git.tests.test_utility import DemoStorageTestCase
+from repodono.backend.git.tests.test_utility import DummyItem
+
+
+class TrigramTestCase(unittest.TestCase):
+
+    def test_trigrams(self):
+        packed = trigrams(b'abcabcd')
+        self.assertEqual(packed, b'abcbcabcdcab')
+        for t in (b'abc', b'bca', b'bcd', b'cab'):
+            self.assertTrue(has_trigram(packed, t))
+        for t in (b'aaa', b'abd', b'zzz'):
+            self.assertFalse(has_trigram(packed, t))
+        self.assertFalse(has_trigram(b'', b'abc'))
+
+    def test_required_trigrams(self):
+        self.assertEqual(required_trigrams(u'abcd'), [b'abc', b'bcd'])
+        self.assertEqual(required_trigrams('a.c'), [b'a.c'])
+        self.assertEqual(required_trigrams('ab'), [])
+        self.assertEqual(
+            required_trigrams(r'abc\d+xyz?', regex=True), [b'abc'])
+        self.assertEqual(
+            required_trigrams(r'foo.*barz', regex=True),
+            [b'arz', b'bar', b'foo'])
+        self.assertEqual(required_trigrams('foo|bar', regex=True), [])
+        self.assertEqual(required_trigrams('(?i)foobar', regex=True), [])
+
+
+class SearchTestCase(DemoStorageTestCase):
+
+    def setUp(self):
+        super(SearchTestCase, self).setUp()
+
+        # add a binary file, and one to be found by regex only.
+        repo = self.repo
+        head = repo[self.revs[-1]]
+        tbder = repo.TreeBuilder(head.tree)
+        tbder.insert('binary', repo.create_blob(b'\0line\n'), 0o100644)
+        tbder.insert('data', repo.create_blob(
+            b'first line\nsecond\nline 3 line\n'), 0o100644)
+        sig = Signature('user1', '1@example.com', 1400000000, 0)
+        self.rev = repo.create_commit(
+            'refs/heads/master', sig, sig, 'more', tbder.write(),
+            [head.id]).hex
+        self.storage = GitStorage(DummyItem(self.testdir))
+
+    def summary(self, results):
+        return [(r['path'], r['line'], r['text']) for r in results]
+
+    def check_search(self):
+        storage = self.storage
+        results = storage.search('line')
+        self.assertFalse(isinstance(results, list))
+        self.assertEqual(self.summary(results), [
+            ('data', 1, b'first line'),
+            ('data', 3, b'line 3 line'),
+            ('file1', 2, b'With a new line.'),
+            ('file2', 2, b'With a new line.'),
+        ])
+        self.assertEqual(self.summary(storage.search('line', limit=2)), [
+            ('data', 1, b'first line'),
+            ('data', 3, b'line 3 line'),
+        ])
+        self.assertEqual(self.summary(storage.search(
+            r'^[a-z]+ line$', regex=True)), [
+            ('data', 1, b'first line'),
+        ])
+        self.assertEqual(self.summary(storage.search(
+            'deeply', paths=['nested'])), [
+            ('nested/deep/dir/file', 3, b'a deeply nested file'),
+        ])
+        self.assertEqual(list(storage.search('line', self.revs[0])), [])
+        self.assertEqual(list(storage.search('nothing matches this')), [])
+
+    def test_search_brute_force(self):
+        self.assertFalse(TrigramIndex(self.repo).indexed(
+            self.repo[self.rev].tree))
+        self.check_search()
+
+    def test_search_indexed(self):
+        index = TrigramIndex(self.repo)
+        # the blobs of file1 and file2 are the same.
+        self.assertEqual(self.storage.build_search_index(), 5)
+        self.assertTrue(index.indexed(self.repo[self.rev].tree))
+        self.assertEqual(self.storage.build_search_index(), 0)
+
+        data = self.repo[self.rev].tree['data'].hex
+        self.assertTrue(index.candidate(data, [b'sec', b'eco']))
+        self.assertFalse(index.candidate(data, [b'xyz']))
+        binary = self.repo[self.rev].tree['binary'].hex
+        self.assertFalse(index.candidate(binary, [b'lin']))
+        self.check_search()
+
+        # the previous revision shares all the blobs.
+        self.assertEqual(
+            index.update(self.repo[self.revs[-1]].tree), 0)
+        self.assertTrue(index.indexed(self.repo[self.revs[-1]].tree))
+
+    def test_search_large(self):
+        large = search_module.MAX_INDEXED_SIZE + 1
+        repo = self.repo
+        tbder = repo.TreeBuilder(repo[self.rev].tree)
+        tbder.insert('large', repo.create_blob(
+            b'needle\n' + b'x' * large), 0o100644)
+        tree = repo[tbder.write()]
+        index = TrigramIndex(repo)
+        self.assertEqual(index.update(tree), 6)
+        large = tree['large'].hex
+        self.assertEqual(index.load()[large], (search_module.KIND_LARGE, b''))
+        # always scanned.
+        self.assertTrue(index.candidate(large, [b'zzz']))
+
+    def test_search_backpressure(self):
+        tree = self.repo[self.rev].tree
+        consumed = []
+
+        def entries():
+            for i in range(1000):
+                consumed.append(i)
+                yield 'data', tree['data']
+
+        results = search(self.repo, entries(), 'line', workers=2)
+        self.assertEqual(next(results)['path'], 'data')
+        # only a window of blobs got scanned ahead.
+        self.assertTrue(len(consumed) <= 5)
+        results.close()
+
+        # the pool is shared by the searches that follow.
+        pool = search_module.shared_pool(2)
+        results = search(self.repo, entries(), 'line', workers=2)
+        self.assertEqual(next(results)['path'], 'data')
+        results.close()
+        self.assertIs(search_module.shared_pool(2), pool)
+
+    def test_search_errors(self):
+        with self.assertRaises(ValueError):
+            self.storage.search('')
+        with self.assertRaises(ValueError):
+            self.storage.search('(foo', regex=True)
+        with self.assertRaises(RevisionNotFoundError):
+            self.storage.search('line', 'nosuchrev')
+        with self.assertRaises(PathNotFoundError):
+            self.storage.search('line', paths=['nosuchpath'])
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import unittest
+import tempfile
+import shutil
+import threading
+from os.path import exists
+from os.path import join
+
+from pygit2 import Repository
+
+from dulwich.repo import Repo
+from dulwich.server import DictBackend
+from dulwich.server import TCPGitServer
+
+import zope.component
+
+from zope.component.tests import clearZCML
+
+from repodono.storage.interfaces import IStorageBackendFSAdapter
+from repodono.storage.exceptions import RevisionNotFoundError
+
+from repodono.backend.git.disk import data_path
+from repodono.backend.git.shallow import DEEPEN_STEP
+from repodono.backend.git.shallow import ShallowConfig
+from repodono.backend.git.shallow import boundary
+from repodono.backend.git.shallow import deepened
+from repodono.backend.git.utility import GitStorageBackend
+
+from repodono.backend.git.testing import util
+from repodono.backend.git.tests.test_graph import create_graph_repo
+from repodono.backend.git.tests.test_utility import DummyFSBackendAdapter
+from repodono.backend.git.tests.test_utility import DummyItem
+from repodono.backend.git.tests.test_utility import DummyStorageInfo
+
+
+class ShallowTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = GitStorageBackend()
+        self.testdir = tempfile.mkdtemp()
+        zope.component.provideAdapter(DummyStorageInfo, (DummyItem,))
+        zope.component.provideAdapter(
+            DummyFSBackendAdapter,
+            (GitStorageBackend, DummyItem,),
+            IStorageBackendFSAdapter,
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+        clearZCML()
+
+    def serve(self, path):
+        dulwich_backend = DictBackend({b'/': Repo(path)})
+        dulwich_server = TCPGitServer(dulwich_backend, b'localhost', 0)
+        self.addCleanup(dulwich_server.shutdown)
+        self.addCleanup(dulwich_server.server_close)
+        threading.Thread(target=dulwich_server.serve).start()
+        _, port = dulwich_server.socket.getsockname()
+        return 'git://localhost:%d' % port
+
+    def install(self, name):
+        item = DummyItem(join(self.testdir, name))
+        self.backend.install(item)
+        return item
+
+    def test_config(self):
+        item = self.install('new')
+        repo = Repository(join(item.path, '.git'))
+        config = ShallowConfig(repo)
+        self.assertIsNone(config.get())
+        self.backend.shallow(item, depth=2)
+        self.assertEqual(config.get(), {
+            'depth': 2, 'since': None, 'deepen': 0})
+        # not shallow yet, so nothing to deepen.
+        self.assertFalse(config.request_deepen())
+        self.backend.shallow(item)
+        self.assertIsNone(config.get())
+        with self.assertRaises(ValueError):
+            self.backend.shallow(item, depth=0)
+
+    def test_sync_depth_and_deepen(self):
+        demo_path = join(self.testdir, 'demo')
+        revs, fulllist = util.create_demo_git_repo(demo_path)
+        remote = self.serve(demo_path)
+
+        item = self.install('new')
+        self.backend.shallow(item, depth=1)
+        self.backend._sync_identifier(item.path, remote)
+        repo = Repository(join(item.path, '.git'))
+        self.assertEqual(boundary(repo), set([revs[-1]]))
+
+        storage = self.backend.acquire(item)
+        self.assertEqual(storage.files(), fulllist)
+        self.assertEqual(
+            [log['rev'] for log in storage.log(None, 10)], [revs[-1]])
+        with self.assertRaises(RevisionNotFoundError):
+            storage.checkout(revs[0])
+        self.assertEqual(storage.shallow.get()['deepen'], DEEPEN_STEP)
+
+        self.backend._sync_identifier(item.path, remote)
+        self.assertEqual(boundary(repo), set())
+        self.assertEqual(storage.shallow.get(), {
+            'depth': 1 + DEEPEN_STEP, 'since': None, 'deepen': 0})
+        self.assertEqual(
+            [log['rev'] for log in storage.log(None, 10)], revs[::-1])
+
+    def test_deepen_only_past_boundary(self):
+        demo_path = join(self.testdir, 'demo')
+        revs, fulllist = util.create_demo_git_repo(demo_path)
+        remote = self.serve(demo_path)
+
+        item = self.install('new')
+        self.backend.shallow(item, depth=2)
+        self.backend._sync_identifier(item.path, remote)
+        storage = self.backend.acquire(item)
+
+        # names that cannot be beyond the boundary, and walks that stop
+        # short of it, leave the depth alone.
+        with self.assertRaises(RevisionNotFoundError):
+            storage.checkout('no-such-branch')
+        with self.assertRaises(RevisionNotFoundError):
+            storage.log('no-such-branch', 10)
+        self.assertEqual(
+            [log['rev'] for log in storage.log(None, 1)], [revs[-1]])
+        self.assertEqual(storage.shallow.get()['deepen'], 0)
+
+        # while walking up to the boundary commit asks for more.
+        self.assertEqual(
+            [log['rev'] for log in storage.log(None, 2)], revs[:1:-1])
+        self.assertEqual(storage.shallow.get()['deepen'], DEEPEN_STEP)
+
+    def test_sync_boundary_reset(self):
+        demo_path = join(self.testdir, 'demo')
+        revs, fulllist = util.create_demo_git_repo(demo_path)
+        remote = self.serve(demo_path)
+
+        item = self.install('new')
+        self.backend.shallow(item, depth=1)
+        self.backend._sync_identifier(item.path, remote)
+        repo = Repository(join(item.path, '.git'))
+        marker = data_path(repo, 'lastmod', 'marker')
+        open(marker, 'w').close()
+
+        # a new branch only adds to the boundary.
+        demo = Repository(join(demo_path, '.git'))
+        head = demo[revs[1]]
+        other = demo.create_commit(
+            'refs/heads/other', head.author, head.author, 'other',
+            head.tree.id, [head.id]).hex
+        self.backend._sync_identifier(item.path, remote)
+        self.assertEqual(boundary(repo), set([revs[-1], other]))
+        self.assertEqual(deepened(repo, set([revs[-1]])), set())
+        self.assertTrue(exists(marker))
+
+        # while deepening past it invalidates the indexes.
+        ShallowConfig(repo).request_deepen()
+        self.backend._sync_identifier(item.path, remote)
+        self.assertEqual(boundary(repo), set())
+        self.assertEqual(deepened(repo, set([revs[-1], other])), set([
+            revs[-1], other]))
+        self.assertFalse(exists(marker))
+
+    def test_sync_since(self):
+        demo_path = join(self.testdir, 'demo')
+        revs = create_graph_repo(demo_path)
+        remote = self.serve(demo_path)
+        repo = Repository(join(demo_path, '.git'))
+        since = repo[revs['d2']].commit_time
+
+        item = self.install('new')
+        self.backend.shallow(item, since=since)
+        self.backend._sync_identifier(item.path, remote)
+        local = Repository(join(item.path, '.git'))
+        for name in ('m', 'd3', 'd2'):
+            self.assertTrue(revs[name] in local)
+        self.assertFalse(
+            [c for c in boundary(local) if local[c].commit_time >= since])
+
+    def test_unshallow(self):
+        demo_path = join(self.testdir, 'demo')
+        revs, fulllist = util.create_demo_git_repo(demo_path)
+        remote = self.serve(demo_path)
+
+        item = self.install('new')
+        self.backend.shallow(item, depth=2)
+        self.backend._sync_identifier(item.path, remote)
+        repo = Repository(join(item.path, '.git'))
+        self.assertEqual(len(boundary(repo)), 1)
+
+        self.backend.shallow(item)
+        self.backend._sync_identifier(item.path, remote)
+        self.assertEqual(boundary(repo), set())
+        self.assertTrue(revs[0] in repo)
+
+    def test_local_unsupported(self):
+        demo_path = join(self.testdir, 'demo')
+        util.create_demo_git_repo(demo_path)
+        item = self.install('new')
+        self.backend.shallow(item, depth=1)
+        with self.assertRaises(ValueError):
+            self.backend._sync_identifier(item.path, demo_path)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from threading import Thread
+
+from repodono.storage.exceptions import PathNotFoundError
+from repodono.storage.exceptions import RevisionNotFoundError
+
+from repodono.backend.git.utility import GitStorageSnapshot
+
+from repodono.backend.git.tests.test_utility import DemoStorageTestCase
+
+
+class GitStorageSnapshotTestCase(DemoStorageTestCase):
+
+    def test_at(self):
+        storage = self.storage
+        snapshot = storage.at(self.revs[0])
+        self.assertTrue(isinstance(snapshot, GitStorageSnapshot))
+        self.assertIs(snapshot.repo, storage.repo)
+        self.assertEqual(snapshot.rev, self.revs[0])
+        self.assertEqual(snapshot.files(), ['file1', 'file2'])
+        with self.assertRaises(PathNotFoundError):
+            snapshot.file('file3')
+
+        # pinned, regardless of what happens to the storage.
+        current = storage.at()
+        self.assertEqual(current.rev, self.revs[3])
+        storage.checkout(self.revs[1])
+        self.assertEqual(current.rev, self.revs[3])
+        self.assertEqual(storage.rev, self.revs[1])
+        self.assertEqual(snapshot.at(self.revs[2]).rev, self.revs[2])
+
+        with self.assertRaises(TypeError):
+            snapshot.checkout(self.revs[1])
+        with self.assertRaises(RevisionNotFoundError):
+            storage.at('nosuchrev')
+
+    def test_threads(self):
+        storage = self.storage
+        expected = {}
+        for rev in self.revs:
+            storage.checkout(rev)
+            expected[rev] = (storage.files(), storage.file('file1'))
+        storage.checkout()
+
+        errors = []
+
+        def read(rev):
+            snapshot = storage.at(rev)
+            try:
+                for i in range(50):
+                    result = (snapshot.files(), snapshot.file('file1'))
+                    if result != expected[rev]:
+                        errors.append((rev, result))
+            except Exception as e:  # XXX blind, pragma: no cover
+                errors.append((rev, e))
+
+        threads = [Thread(target=read, args=(rev,)) for rev in self.revs * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import unittest
+import tempfile
+import shutil
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from os.path import join
+
+from dulwich.client import HttpGitClient
+from dulwich.errors import NotGitRepository
+from dulwich.repo import Repo
+
+from repodono.backend.git.interfaces import FetchError
+from repodono.backend.git.transport import HttpTransport
+from repodono.backend.git.transport import TimedHttpGitClient
+from repodono.backend.git.transport import supports_depth
+from repodono.backend.git.transport import supports_pool_manager
+from repodono.backend.git.utility import GitStorageBackend
+
+from repodono.backend.git.testing import util
+
+
+class NotFoundHandler(BaseHTTPRequestHandler):
+    # a keep-alive server with no repositories at all.
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'not found'
+        self.send_response(404)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *a):
+        pass
+
+
+class TransportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.httpd = HTTPServer(('localhost', 0), NotFoundHandler)
+        self.addCleanup(self.httpd.server_close)
+        self.addCleanup(self.httpd.shutdown)
+        threading.Thread(target=self.httpd.serve_forever).start()
+        self.url = 'http://localhost:%d' % self.httpd.server_address[1]
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_shared_connections(self):
+        if not supports_pool_manager():
+            self.skipTest('dulwich without pool_manager support')
+
+        util.extract_archive(self.testdir)
+        backend = GitStorageBackend()
+        backend.http_transport = HttpTransport(maxsize=1)
+        target = join(self.testdir, 'simple2')
+
+        for i in range(3):
+            remote_id = '%s/repo%d' % (self.url, i)
+            with self.assertRaises(FetchError) as e:
+                backend._sync_identifier(target, remote_id)
+            self.assertEqual(e.exception.remote_id, remote_id)
+            self.assertTrue(e.exception.args[0].endswith(remote_id))
+            self.assertIsNotNone(e.exception.cause)
+
+        stats = backend.http_transport.stats()
+        host = 'localhost:%d' % self.httpd.server_address[1]
+        self.assertEqual(stats[host]['connections'], 1)
+        self.assertEqual(stats[host]['requests'], 3)
+
+    def test_client_timing(self):
+        util.extract_archive(self.testdir)
+        transport = HttpTransport()
+        client = transport.client(self.url + '/')
+        with self.assertRaises(NotGitRepository):
+            client.fetch('repo', Repo(join(self.testdir, 'simple2')))
+        self.assertTrue(client.timing['refs'] > 0)
+        if supports_pool_manager():
+            self.assertTrue(client.timing['connect'] > 0)
+        transport.clear()
+
+    def test_client_timing_body(self):
+
+        class SlowBody(HttpGitClient):
+            def _http_request(self, url, headers=None, data=None):
+                def read(size=None):
+                    time.sleep(0.05)
+                    return b''
+                return object(), read
+
+        class Client(TimedHttpGitClient, SlowBody):
+            pass
+
+        client = Client(self.url + '/')
+        resp, read = client._http_request(self.url + '/', data=b'want')
+        self.assertTrue(client.timing['pack'] < 0.05)
+        read()
+        self.assertTrue(client.timing['pack'] >= 0.05)
+
+    def test_supports_depth(self):
+
+        class OldClient(object):
+            def fetch(self, path, target, determine_wants=None):
+                pass
+
+        self.assertTrue(supports_depth(HttpTransport().client(self.url)))
+        self.assertFalse(supports_depth(OldClient()))
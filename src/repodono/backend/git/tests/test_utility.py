@@ -6,6 +6,7 @@ from os.path import join
 import threading
 
 from pygit2 import init_repository
+from pygit2 import Repository
 from pygit2 import Signature
 from pygit2 import GIT_OBJ_COMMIT
 from dulwich.repo import Repo
@@ -25,8 +26,12 @@ from repodono.storage.exceptions import PathNotFileError
 from repodono.storage.exceptions import PathNotFoundError
 from repodono.storage.exceptions import RevisionNotFoundError
 
+from repodono.backend.git.disk import RecordFile
+from repodono.backend.git.disk import data_path
+from repodono.backend.git.ext import gitmodules_cache
 from repodono.backend.git.utility import GitStorage
 from repodono.backend.git.utility import GitStorageBackend
+from repodono.backend.git.utility import path_cache
 
 from repodono.backend.git.testing import util
 
@@ -60,6 +65,25 @@ class DummyStorageInfo(object):
         return self.context.path
 
 
+class DemoStorageTestCase(unittest.TestCase):
+    """
+    Base for the test cases of the GitStorage features, with the demo
+    repository created within testdir.  Subclasses adding commits in
+    setUp create the storage again for them to be checked out.
+    """
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        zope.component.provideAdapter(DummyStorageInfo, (DummyItem,))
+        self.revs, self.fulllist = util.create_demo_git_repo(self.testdir)
+        self.repo = Repository(join(self.testdir, '.git'))
+        self.storage = GitStorage(DummyItem(self.testdir))
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+        clearZCML()
+
+
 class StorageTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -144,6 +168,118 @@ class StorageTestCase(unittest.TestCase):
             # should fail.
             storage._get_obj('file1', DummyItem)
 
+    def test_012_storage_path_cache(self):
+        item = DummyItem(self.testdir)
+        revs, fulllist = util.create_demo_git_repo(self.testdir)
+        path_cache.clear()
+
+        storage = GitStorage(item)
+        root = storage._commit.tree.hex
+        self.assertEqual(
+            storage.file('nested/deep/dir/file'),
+            'This is\n\na deeply nested file\n')
+        self.assertEqual(
+            path_cache.get((root, 'nested/deep/dir'))[0], 'tree')
+        self.assertEqual(
+            path_cache.get((root, 'nested/deep/dir/file'))[0], 'blob')
+
+        with self.assertRaises(PathNotFoundError):
+            storage.file('nested/deep/nosuchpath')
+        self.assertEqual(
+            path_cache.get((root, 'nested/deep/nosuchpath'))[0], None)
+
+        with self.assertRaises(PathNotFoundError):
+            storage.file('file1/nosuchpath')
+
+        # entries are shared by other instances of the same repository.
+        other = GitStorage(item)
+        hits = path_cache.hits
+        with self.assertRaises(PathNotDirError):
+            other.listdir('nested/deep/dir/file')
+        self.assertEqual(path_cache.hits, hits + 1)
+
+    def test_013_storage_iterfiles(self):
+        item = DummyItem(self.testdir)
+        revs, fulllist = util.create_demo_git_repo(self.testdir)
+        storage = GitStorage(item)
+
+        result = storage.iterfiles()
+        self.assertFalse(isinstance(result, list))
+        self.assertEqual(list(result), fulllist)
+        self.assertEqual(
+            list(storage.iterfiles(max_depth=1)), ['file1', 'file2', 'file3'])
+        self.assertEqual(
+            list(storage.iterfiles(glob='*2')), ['file2'])
+        self.assertEqual(
+            list(storage.iterfiles(prefix='nested/deep')),
+            ['nested/deep/dir/file'])
+        self.assertEqual(
+            list(storage.iterfiles(prefix='nested/', max_depth=2)), [])
+
+        with self.assertRaises(PathNotDirError):
+            storage.iterfiles(prefix='file1')
+
+        with self.assertRaises(PathNotFoundError):
+            storage.iterfiles(prefix='nosuchpath')
+
+    def test_015_storage_log_page(self):
+        item = DummyItem(self.testdir)
+        revs, fulllist = util.create_demo_git_repo(self.testdir)
+        storage = GitStorage(item)
+
+        logs, cursor = storage.log_page('HEAD', 3)
+        self.assertEqual([log['rev'] for log in logs], revs[:0:-1])
+        self.assertEqual(logs[2]['email'], '2@example.com')
+        self.assertTrue(cursor.startswith(revs[0] + '~'))
+
+        logs, cursor = storage.log_page(None, 3, cursor=cursor)
+        self.assertEqual([log['rev'] for log in logs], revs[:1])
+        self.assertEqual(logs[0]['email'], '1@example.com')
+        self.assertIsNone(cursor)
+
+        logs = list(storage.iterlog(revs[2], shortlog=True))
+        self.assertEqual([log['rev'] for log in logs], revs[2::-1])
+        self.assertEqual(sorted(logs[0].keys()), [
+            'author', 'email', 'node', 'rev'])
+
+        with self.assertRaises(RevisionNotFoundError):
+            storage.log_page(None, 3, cursor='bad')
+
+    def test_015_storage_log_page_shared_parent(self):
+        item = DummyItem(self.testdir)
+        revs, fulllist = util.create_demo_git_repo(self.testdir)
+        repo = Repository(join(self.testdir, '.git'))
+        head = repo[revs[-1]]
+        sig = Signature('user1', '1@example.com', 1500000000, 0)
+
+        def commit(message, parents, sig=sig):
+            return repo.create_commit(
+                None, sig, sig, message, head.tree.id, parents).hex
+
+        # parent (older than the demo commits) is reached through a
+        # before b, both at the same time, so it is produced before b.
+        parent = commit('parent', [head.id])
+        a = commit('a', [parent])
+        b = commit('b', [parent])
+        c = commit('c', [b])
+        merge = commit('merge', [a, c], Signature(
+            'user1', '1@example.com', 1500000001, 0))
+        storage = GitStorage(item)
+
+        expected = [log['rev'] for log in storage.iterlog(merge)]
+        self.assertEqual(len(expected), len(set(expected)))
+        self.assertEqual(expected[:5], [merge, a, c, parent, b])
+        self.assertEqual(expected[5:], revs[::-1])
+        for size in range(1, len(expected) + 1):
+            results = []
+            cursor = None
+            while True:
+                logs, cursor = storage.log_page(merge, size, cursor=cursor)
+                results.extend(log['rev'] for log in logs)
+                if cursor is None:
+                    break
+            self.assertEqual(results, expected)
+
     def test_011_storage_empty_basic(self):
         emptydir = join(self.testdir, 'empty')
 
@@ -251,6 +387,14 @@ class StorageTestCase(unittest.TestCase):
         with self.assertRaises(PathNotDirError):
             storage.listdir('ext/import1')
 
+        # paths within the submodule share the parsed .gitmodules.
+        hits = gitmodules_cache.hits
+        for path in ('ext/import1/a', 'ext/import1/a/b', 'ext/import1/c'):
+            obj = storage.pathinfo(path)['obj']
+            self.assertEqual(obj['path'], path[len('ext/import1/'):])
+            self.assertEqual(obj['rev'], pathinfo['obj']['rev'])
+        self.assertTrue(gitmodules_cache.hits > hits)
+
     def test_110_storage_subrepo_alt_revision(self):
         # a simple test to check that repodata is available.
         util.extract_archive(self.testdir)
@@ -272,6 +416,33 @@ class StorageTestCase(unittest.TestCase):
             },
         })
 
+    def test_120_storage_listdir_info(self):
+        util.extract_archive(self.testdir)
+        repodata = DummyItem(join(self.testdir, 'repodata'))
+        storage = GitStorage(repodata)
+
+        infos = storage.listdir_info('')
+        self.assertEqual(
+            [info['basename'] for info in infos], storage.listdir(''))
+
+        for base in ('', 'ext', '1'):
+            for info in storage.listdir_info(base):
+                path = '/'.join(p for p in (base, info['basename']) if p)
+                expected = storage.pathinfo(path)
+                for key, value in expected.items():
+                    self.assertEqual(info[key], value)
+
+        info = [i for i in storage.listdir_info('1')
+                if i['basename'] == 'f1'][0]
+        self.assertEqual(info['oid'], storage._get_obj('1/f1').hex)
+        self.assertEqual(info['mode'], 0o100644)
+
+        with self.assertRaises(PathNotDirError):
+            storage.listdir_info('1/f1')
+
+        with self.assertRaises(PathNotFoundError):
+            storage.listdir_info('nosuchpath')
+
     def test_900_storage_branches(self):
         # a simple test to check that repodata is available.
         util.extract_archive(self.testdir)
@@ -521,6 +692,65 @@ class StorageBackendTestCase(unittest.TestCase):
         self.assertEqual(storage.listdir(''), [
             'file1', 'file2', 'file3', 'nested'])
 
+    def test_sync_batched_refs(self):
+        demo_path = join(self.testdir, 'demo')
+        revs, fulllist = util.create_demo_git_repo(demo_path)
+        demo = Repository(join(demo_path, '.git'))
+        demo.create_tag(
+            'v1', demo[revs[0]].oid, GIT_OBJ_COMMIT,
+            Signature('user1', '1@example.com'), 'version 1')
+        demo.lookup_reference('refs/heads/master').set_target(revs[1])
+
+        new_path = join(self.testdir, 'new')
+        item = DummyItem(new_path)
+        self.backend.install(item)
+        results = self.backend._sync_identifier(new_path, demo_path)
+        self.assertEqual(results, [
+            ('refs/heads/master',
+                (True, 'Created new branch: refs/heads/master')),
+            ('refs/tags/v1',
+                (True, 'Created new branch: refs/tags/v1')),
+        ])
+        self.assertEqual(
+            sorted(results.timing), ['apply', 'classify', 'fetch', 'index'])
+
+        demo.lookup_reference('refs/heads/master').set_target(revs[-1])
+        results = self.backend._sync_identifier(new_path, demo_path)
+        self.assertEqual(results, [
+            ('refs/heads/master',
+                (True, 'Fast-forwarded branch: refs/heads/master')),
+            ('refs/tags/v1', (True, 'Source and target are identical.')),
+        ])
+        storage = self.backend.acquire(item)
+        self.assertEqual(storage.rev, revs[-1])
+
+    def test_sync_index_errors(self):
+        demo_path = join(self.testdir, 'demo')
+        revs, fulllist = util.create_demo_git_repo(demo_path)
+        demo = Repository(join(demo_path, '.git'))
+        demo.lookup_reference('refs/heads/master').set_target(revs[1])
+
+        new_path = join(self.testdir, 'new')
+        item = DummyItem(new_path)
+        self.backend.install(item)
+        results = self.backend._sync_identifier(new_path, demo_path)
+        self.assertEqual(results.index_errors, {})
+
+        # a damaged index does not fail the sync.
+        repo = Repository(join(new_path, '.git'))
+        with open(data_path(repo, 'bloom'), 'wb') as f:
+            f.write(b'not an index')
+        RecordFile._loaded.clear()
+        demo.lookup_reference('refs/heads/master').set_target(revs[-1])
+        results = self.backend._sync_identifier(new_path, demo_path)
+        self.assertEqual(results, [
+            ('refs/heads/master',
+                (True, 'Fast-forwarded branch: refs/heads/master')),
+        ])
+        self.assertEqual(sorted(results.index_errors), ['bloom'])
+        self.assertIn('index', results.timing)
+        self.assertEqual(self.backend.acquire(item).rev, revs[-1])
+
     def test_sync_same(self):
         util.extract_archive(self.testdir)
         simple1_path = join(self.testdir, 'simple1')
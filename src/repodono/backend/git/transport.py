@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Shared HTTP transport for the fetches done through dulwich.
+
+All the HTTP clients created through a transport share one urllib3 pool
+manager, which keeps up to maxsize connections per host alive between
+requests, so that syncing many repositories from the same host reuses
+a handful of connections rather than opening one (or more) per sync.
+The versions of dulwich that predate the pool_manager argument to
+HttpGitClient get their default clients, without the reuse.
+"""
+
+import inspect
+import threading
+from timeit import default_timer as timer
+
+from dulwich.client import HttpGitClient
+
+try:
+    import urllib3
+    from urllib3.connection import HTTPConnection
+    from urllib3.connection import HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool
+    from urllib3.connectionpool import HTTPSConnectionPool
+except ImportError:  # pragma: no cover
+    urllib3 = None
+
+DEFAULT_MAXSIZE = 4
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 300.0
+
+# the timing of the fetch being done by the current thread, if any.
+_local = threading.local()
+
+
+def _record(phase, elapsed):
+    timing = getattr(_local, 'timing', None)
+    if timing is not None:
+        timing[phase] = timing.get(phase, 0.0) + elapsed
+
+
+def supports_pool_manager():
+    try:
+        args = inspect.getargspec(HttpGitClient.__init__).args
+    except TypeError:  # pragma: no cover
+        return False
+    return urllib3 is not None and 'pool_manager' in args
+
+
+def supports_depth(client):
+    """
+    Return whether the fetch method of client takes a depth, for
+    shallow fetches.
+    """
+
+    try:
+        args = inspect.getargspec(client.fetch).args
+    except TypeError:  # pragma: no cover
+        return False
+    return 'depth' in args
+
+
+if urllib3 is not None:
+
+    class _TimedConnectionMixin(object):
+
+        def connect(self):
+            started = timer()
+            try:
+                return super(_TimedConnectionMixin, self).connect()
+            finally:
+                _record('connect', timer() - started)
+
+    class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+        pass
+
+    class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+        pass
+
+    class TimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = TimedHTTPConnection
+
+    class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHttpGitClient(HttpGitClient):
+    """
+    HttpGitClient recording the time taken by the ref advertisement
+    and the pack transfer in timing, along with the connect time where
+    the connections are made through a transport.
+    """
+
+    def __init__(self, *a, **kw):
+        super(TimedHttpGitClient, self).__init__(*a, **kw)
+        self.timing = {}
+
+    def _http_request(self, url, headers=None, data=None, *a, **kw):
+        phase = 'refs' if data is None else 'pack'
+        _local.timing = self.timing
+        started = timer()
+        try:
+            result = super(TimedHttpGitClient, self)._http_request(
+                url, headers, data, *a, **kw)
+        finally:
+            _record(phase, timer() - started)
+            _local.timing = None
+        # the body may be read as it is being consumed, after returning.
+        if isinstance(result, tuple):
+            resp, read = result
+            return resp, self._timed_read(phase, read)
+        result.read = self._timed_read(phase, result.read)
+        return result
+
+    def _timed_read(self, phase, read):
+        timing = self.timing
+
+        def timed_read(*a, **kw):
+            started = timer()
+            try:
+                return read(*a, **kw)
+            finally:
+                elapsed = timer() - started
+                timing[phase] = timing.get(phase, 0.0) + elapsed
+
+        return timed_read
+
+
+class HttpTransport(object):
+    """
+    Creates the HTTP clients for fetching, all sharing a pool of kept
+    alive connections.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT):
+        self.maxsize = maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._manager = None
+        self._lock = threading.Lock()
+
+    @property
+    def manager(self):
+        """
+        The shared urllib3 pool manager, or None if unsupported.
+        """
+
+        if self._manager is None and supports_pool_manager():
+            with self._lock:
+                if self._manager is None:
+                    self._manager = self._create_manager()
+        return self._manager
+
+    def _create_manager(self):
+        manager = urllib3.PoolManager(
+            maxsize=self.maxsize,
+            # wait for a connection to a host to be free rather than
+            # opening ones that can't be pooled.
+            block=True,
+            timeout=urllib3.Timeout(
+                connect=self.connect_timeout, read=self.read_timeout),
+            headers={'User-Agent': 'repodono.backend.git'},
+        )
+        manager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+        return manager
+
+    def client(self, base_url):
+        """
+        Return a TimedHttpGitClient for the repository at base_url.
+        """
+
+        manager = self.manager
+        if manager is None:
+            return TimedHttpGitClient(base_url)
+        return TimedHttpGitClient(base_url, pool_manager=manager)
+
+    def stats(self):
+        """
+        Return a dict of host to the number of connections opened and
+        the requests made through them.
+        """
+
+        results = {}
+        manager = self._manager
+        if manager is None:
+            return results
+        for key in list(manager.pools.keys()):
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            host = '%s:%s' % (pool.host, pool.port)
+            results[host] = {
+                'connections': pool.num_connections,
+                'requests': pool.num_requests,
+            }
+        return results
+
+    def clear(self):
+        """
+        Close all the pooled connections.
+        """
+
+        with self._lock:
+            if self._manager is not None:
+                self._manager.clear()
+
+
+# the transport used by GitStorageBackend by default.
+transport = HttpTransport()
@@ -1,25 +1,70 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
+from fnmatch import fnmatchcase
+from itertools import islice
 from dateutil.tz import tzoffset
 from logging import getLogger
 from os.path import join
+from threading import RLock
+from timeit import default_timer as timer
 from urlparse import urlparse
 # import mimetypes
 
 from zope.component import getMultiAdapter
 # import zope.interface
 
-from pygit2 import Repository
+from pygit2 import Commit
 from pygit2 import Tree
 from pygit2 import Blob
-from pygit2 import discover_repository, init_repository
-from pygit2 import GIT_SORT_TIME
+from pygit2 import init_repository
+from pygit2 import GIT_FILEMODE_COMMIT
+from pygit2 import GIT_FILEMODE_TREE
 
 from dulwich.repo import Repo
-from dulwich.client import HttpGitClient
 from dulwich.client import TCPGitClient
 
-from .ext import parse_gitmodules
+from .archive import ArchiveCache
+from .archive import archive
+from .archive import iter_entries
+from .blame import BlameIndex
+from .blobio import BlobReader
+from .blobio import DEFAULT_CHUNK_SIZE
+from .blobio import blob_buffer
+from .bloom import ChangedPathIndex
+from .bloom import path_history
+from .diff import cached_iter_diff
+from .diff import diff_stats
+from .cache import LRUCache
+from .ext import GitModules
+from .ext import load_gitmodules
+from .graph import CommitGraph
+from .graph import peel_commit
+from .history import HistoryWalker
+from .interfaces import FetchError
+from .lastmod import LastModifiedIndex
+from .manifest import ManifestStore
+from .pool import get_repository
+from .refs import invalidate_refs
+from .refs import ref_snapshot
+from .refs import resolve
+from .refs import resolve_commit
+from .refs import revision_cache
+from .remote import RefWants
+from .remote import RemoteState
+from .remote import filter_refs
+from .search import TrigramIndex
+from .search import compile_pattern
+from .search import search
+from .shallow import ShallowConfig
+from .shallow import UNSHALLOW_DEPTH
+from .shallow import boundary
+from .shallow import deepened
+from .shallow import maybe_beyond
+from .transport import supports_depth
+from .transport import transport
+from .pool import invalidate_repository
+from .walk import BLOB_FILEMODES
+from .walk import walk_tree
 # from .interfaces import IGitWorkspace
 
 from repodono.storage.base import BaseStorageBackend
@@ -35,10 +80,39 @@ logger = getLogger(__name__)
 
 GIT_MODULE_FILE = '.gitmodules'
 
+# Tree ids are immutable, so the resolution of a path within a given
+# root tree never changes; this is shared by all GitStorage instances.
+PATH_CACHE_SIZE = 65536
+path_cache = LRUCache(PATH_CACHE_SIZE)
+NOT_FOUND = (None, None, None, None)
+
+# default number of results for searches.
+SEARCH_LIMIT = 1000
+
+
+def normpath(path):
+    # no empty string entries, also skips over '//'.
+    return '/'.join(f for f in path.split('/') if f)
+
+
+def timestamp_dt(time, offset):
+    return datetime.fromtimestamp(time, tzoffset(None, offset * 60))
+
 
 def committer_dt(committer):
-    return datetime.fromtimestamp(
-        committer.time, tzoffset(None, committer.offset * 60))
+    return timestamp_dt(committer.time, committer.offset)
+
+
+class SyncResults(list):
+    """
+    The (reference, (success, message)) results of a sync, with the
+    time taken by each of its phases in seconds as timing, and the
+    indexes that could not be brought up to date as index_errors, a
+    dict of their names to the error raised.
+    """
+
+    timing = None
+    index_errors = None
 
 
 class GitStorageBackend(BaseStorageBackend):
@@ -50,6 +124,16 @@ class GitStorageBackend(BaseStorageBackend):
     command = u'git'
     clone_verb = u'clone'
 
+    # the transport creating the clients for http remotes.
+    http_transport = transport
+
+    # fnmatch patterns selecting the remote references to fetch.
+    fetch_include = None
+    fetch_exclude = None
+
+    # serializes the reference writes of the syncs within this process.
+    _ref_lock = RLock()
+
     def __init__(self):
         pass
 
@@ -66,12 +150,31 @@ class GitStorageBackend(BaseStorageBackend):
         # Also tag the object with our custom interface?
         # zope.interface.alsoProvides(context, IGitStorage)
 
+    def shallow(self, context, depth=None, since=None):
+        """
+        Mirror the repository of context with its history limited to
+        depth commits from the fetched references, or to the commits
+        more recent than the since timestamp, from the next sync on.
+        With neither, the next sync fetches the complete history.
+        """
+
+        fshelper = getMultiAdapter((self, context), IStorageBackendFSAdapter)
+        rp = fshelper.acquire()
+        try:
+            repo = get_repository(rp)
+        except KeyError:
+            raise PathNotFoundError('repository does not exist at path')
+        ShallowConfig(repo).set(depth, since)
+
     def _create(self, rp):
+        # Any handle pooled for a repository previously at rp is stale.
+        invalidate_repository(rp)
         repo = init_repository(join(rp, '.git'), bare=True)
         # Allow receivepack by default for git push.
         repo.config.set_multivar('http.receivepack', '', 'true')
 
-    def _sync_identifier(self, local_path, remote_id, branch=None):
+    def _sync_identifier(self, local_path, remote_id, branch=None,
+                         include=None, exclude=None):
         # By default, sync all the identifiers fetched.
         # branch_name = 'master'
         # # XXX when we figure out how to let users pick their primary
@@ -93,41 +196,189 @@ class GitStorageBackend(BaseStorageBackend):
         # 1. Fetch content
         # 2. Acquire merge target pairs.
 
-        remote_refs = self._fetch(local_path, remote_id)
+        started = timer()
+        timing = {}
+        remote_refs = self._fetch(
+            local_path, remote_id, include, exclude, timing)
+        timing['fetch'] = timer() - started
 
-        # Then use pygit2 for each fetched remote branch.
+        # Then use pygit2, with a single handle, to classify every
+        # fetched remote reference before any of them gets written.
         # 1. Create new branch if local doesn't have that
         # 2. If exists, check whether fast-forward can happen
         # 2.1. If merge base between the two have diverted, abort.
         # 2.2. If remote is fresher, fast forward local.
-        results = []
-        for branch, merge_target in remote_refs.items():
-            if not branch.startswith('refs/'):
+        started = timer()
+        repo = get_repository(local_path)
+        graph = CommitGraph(repo)
+        results = SyncResults()
+        updates = []
+        for branch, merge_target in sorted(remote_refs.items()):
+            if not branch.startswith('refs/') or branch.endswith('^{}'):
+                # skip HEAD and the peeled values of annotated tags.
                 continue
-            ff_result = self._fast_forward(local_path, merge_target, branch)
+            update, ff_result = self._classify(
+                repo, graph, merge_target, branch)
+            if update is not None:
+                updates.append(update)
             results.append((branch, ff_result))
+        timing['classify'] = timer() - started
+
+        started = timer()
+        self._apply_updates(repo, updates)
+        timing['apply'] = timer() - started
+
+        # The references have moved by now, so failing to update an
+        # index must not lose the results; the indexes catch up on the
+        # next sync or when next used.
+        started = timer()
+        results.index_errors = self._update_indexes(
+            local_path, results, updates)
+        timing['index'] = timer() - started
+
+        results.timing = timing
         return results
 
-    def _fetch(self, local_path, remote_id):
+    def _update_indexes(self, local_path, results, updates=()):
+        """
+        Bring the indexes kept next to the repository up to date with
+        the references that got synced, as far as possible, starting
+        from the previous targets of the updated ones.  Returns a dict
+        of the names of the indexes that failed to the error.
+        """
+
+        repo = get_repository(local_path)
+        manifests = ManifestStore(repo)
+        lastmod = LastModifiedIndex(repo)
+        errors = {}
+
+        def attempt(name, func, *a):
+            if name in errors:
+                # already failed for another reference.
+                return
+            try:
+                func(*a)
+            except Exception as e:  # XXX blind
+                logger.exception(
+                    'failed to update the %s index of %s', name, local_path)
+                errors[name] = '%s: %s' % (type(e).__name__, e)
+
+        previous = {}
+        for branch, old, new in updates:
+            try:
+                previous[branch] = [peel_commit(repo, repo[old])]
+            except (KeyError, ValueError, TypeError):
+                # created, or not a commit.
+                continue
+
+        heads = []
+        for branch, (success, msg) in results:
+            if not success:
+                continue
+            commit = repo.revparse_single(branch)
+            if not isinstance(commit, Commit):
+                continue
+            attempt('manifest', manifests.build, commit,
+                    previous.get(branch, ()))
+            attempt('lastmod', lastmod.update, commit)
+            heads.append(commit.hex)
+        attempt('bloom', ChangedPathIndex(repo).update, heads)
+
+        # what is no longer reachable from any reference.
+        snapshot = ref_snapshot(repo)
+        live = [snapshot.peeled(name) for name in snapshot.names]
+        attempt('manifest', manifests.gc, live)
+        attempt('lastmod', lastmod.gc, live)
+        attempt('blame', BlameIndex(repo).gc, live)
+        return errors
+
+    def _fetch(self, local_path, remote_id, include=None, exclude=None,
+               timing=None):
         """
         Fetches a remote repository identified by remote_id (usually a
-        url) into the local repo identified by local_path.  Returns all
-        remote references fetched.
+        url) into the local repo identified by local_path.  Returns the
+        remote references fetched, being the ones matching the include
+        and exclude patterns (defaulting to fetch_include and
+        fetch_exclude).  The time taken by the phases of the transport,
+        where known, is added to the timing dict.
         """
 
         # dulwich repo
         local = Repo(local_path)
+        repo = get_repository(local_path)
+        fetch = self._fetcher(local, remote_id)
+        state = RemoteState(repo, remote_id)
+        wants = RefWants(
+            local.object_store, state,
+            self.fetch_include if include is None else include,
+            self.fetch_exclude if exclude is None else exclude,
+        )
+
+        shallow = ShallowConfig(repo)
+        config = shallow.get()
+        initial = boundary(repo)
+        depth = None
+        if config is not None:
+            depth = config['depth'] + config.get('deepen', 0)
+            wants.deepen = bool(config.get('deepen'))
+        elif initial:
+            # no longer limited, so fetch the complete history.
+            depth = UNSHALLOW_DEPTH
+            wants.deepen = True
+
+        remote_refs = fetch(wants, depth)
+
+        if config is not None and config.get('since'):
+            # Keep deepening until the history reaches beyond since,
+            # as dulwich can only fetch to a depth.
+            wants.deepen = True
+            while True:
+                current = boundary(repo)
+                if not any(
+                        c in repo and repo[c].commit_time >= config['since']
+                        for c in current):
+                    break
+                depth *= 2
+                remote_refs = fetch(wants, depth)
+                if boundary(repo) == current:
+                    break
+
+        if timing is not None:
+            timing.update(fetch.timing)
+        if config is not None:
+            config['depth'] = depth
+            config['deepen'] = 0
+            shallow.put(config)
+        if deepened(repo, initial):
+            # commits along the boundary gained their parents, so the
+            # ancestry derived from them is no longer valid; commits
+            # only added to the boundary were not indexed before.
+            CommitGraph(repo).reset()
+            LastModifiedIndex(repo).reset()
+
+        if wants.refs is None:
+            # determine_wants not called, e.g. for an empty remote.
+            wants.refs = filter_refs(
+                getattr(remote_refs, 'refs', remote_refs),
+                wants.include, wants.exclude)
+        if not wants.unchanged:
+            state.put(wants.refs)
+        return wants.refs
+
+    def _fetcher(self, local, remote_id):
+        """
+        Return a callable that fetches from remote_id into the dulwich
+        repo local, taking the determine_wants callable and the depth.
+        """
+
         pr = urlparse(remote_id)
 
         # Determine the fetch strategy based on protocol.
         if pr.scheme == 'http':
             # XXX determine if the following is actually correct.
             root, frag = remote_id.rsplit('/', 1)
-            client = HttpGitClient(root)
-            try:
-                remote_refs = client.fetch(frag, local)
-            except Exception:  # XXX blind
-                raise ValueError('error fetching from remote: %s' % remote_id)
+            client = self.http_transport.client(root)
+            args = (frag, local)
         elif pr.scheme == 'git':
             netloc = pr.netloc.split(':')
             if len(netloc) == 1:
@@ -140,22 +391,45 @@ class GitStorageBackend(BaseStorageBackend):
             path = pr.path or '/'
 
             client = TCPGitClient(host, port)
-            try:
-                remote_refs = client.fetch(path, local)
-            except Exception:  # XXX blind
-                raise ValueError('error fetching from remote: %s' % remote_id)
+            args = (path, local)
         elif remote_id.startswith('/'):
             client = Repo(remote_id)
-            remote_refs = client.fetch(local)
+            args = (local,)
         else:
             raise ValueError('remote not supported: %s' % remote_id)
 
-        return remote_refs
+        depth_supported = supports_depth(client)
 
-    def _fast_forward(self, local_path, merge_target, branch):
-        # fast-forward all the branches.
-        # pygit2 repo
-        repo = Repository(discover_repository(local_path))
+        def fetch(wants, depth):
+            kw = {'determine_wants': wants}
+            if depth is not None:
+                if not depth_supported:
+                    raise ValueError(
+                        'shallow fetch not supported for remote: %s' %
+                        remote_id)
+                kw['depth'] = depth
+            try:
+                return client.fetch(*args, **kw)
+            except NotImplementedError:
+                if depth is None:
+                    raise
+                # refused by the client itself, e.g. a local repository.
+                raise ValueError(
+                    'shallow fetch not supported for remote: %s' % remote_id)
+            except Exception as e:  # XXX blind
+                if not pr.scheme:
+                    raise
+                raise FetchError(remote_id, e)
+
+        fetch.timing = getattr(client, 'timing', {})
+        return fetch
+
+    def _classify(self, repo, graph, merge_target, branch):
+        """
+        Work out what syncing branch to merge_target involves.  Returns
+        the update to apply, if any, as (branch, old target, new target)
+        along with the result for the branch.
+        """
 
         # convert merge_target from hex into oid.
         fetch_head = repo.revparse_single(merge_target)
@@ -165,33 +439,66 @@ class GitStorageBackend(BaseStorageBackend):
             head = repo.revparse_single(branch)
         except KeyError:
             # Doesn't exist.  Create and done.
-            repo.create_reference(branch, fetch_head.oid)
-            return True, 'Created new branch: %s' % branch
+            return (branch, None, fetch_head.oid), (
+                True, 'Created new branch: %s' % branch)
 
         if head.oid == fetch_head.oid:
-            return True, 'Source and target are identical.'
+            return None, (True, 'Source and target are identical.')
 
-        # raises KeyError if no merge bases found.
-        common_oid = repo.merge_base(head.oid, fetch_head.oid)
+        # Answer the ancestry questions using the commit graph, which
+        # avoids inflating the commits already known to it.
+        try:
+            head_hex = peel_commit(repo, head).hex
+            fetch_hex = peel_commit(repo, fetch_head).hex
+        except KeyError:
+            return None, (False, 'Target is not a commit.')
 
         # Three different outcomes between the remaining cases.
-        if common_oid.hex not in (head.oid.hex, fetch_head.oid.hex):
+        if graph.is_ancestor(fetch_hex, head_hex):
+            # Remote is also the common ancestor, so nothing to do.
+            return None, (True, 'No new changes found.')
+        elif not graph.is_ancestor(head_hex, fetch_hex):
             # common ancestor is beyond both of these, not going to
             # attempt a merge here and will assume this:
-            return False, 'Branch will diverge.'
-        elif common_oid.hex == fetch_head.oid.hex:
-            # Remote is also the common ancestor, so nothing to do.
-            return True, 'No new changes found.'
+            return None, (False, 'Branch will diverge.')
 
-        # This case remains: common_oid.hex == head.oid.hex, meaning
+        # This case remains: head is the common ancestor, meaning
         # this local repository is the ancestor of further changes
         # fetched from the remote - remote newer, so fast-forward.
-        ref = repo.lookup_reference(branch)
-        ref.delete()
+        return (branch, head.oid, fetch_head.oid), (
+            True, 'Fast-forwarded branch: %s' % branch)
+
+    def _apply_updates(self, repo, updates):
+        """
+        Write out the updates produced by _classify, as one batch.
+        """
 
-        repo.create_reference(branch, fetch_head.oid)
+        # libgit2 (as of pygit2 0.23) has no reference transactions, so
+        # the best that can be done is to write every reference with a
+        # single locked write once all of them are known to be good,
+        # such that an interrupted sync leaves each reference at either
+        # its old or its new target, never missing.
+        with self._ref_lock:
+            for branch, old, new in updates:
+                if old is None:
+                    repo.create_reference(branch, new, force=True)
+                    continue
+                ref = repo.lookup_reference(branch)
+                if ref.target != old:
+                    # moved by someone else since it got classified.
+                    continue
+                ref.set_target(new)
+            if updates:
+                invalidate_refs(repo)
 
-        return True, 'Fast-forwarded branch: %s' % branch
+    def _fast_forward(self, local_path, merge_target, branch):
+        # fast-forward a single branch.
+        repo = get_repository(local_path)
+        update, result = self._classify(
+            repo, CommitGraph(repo), merge_target, branch)
+        if update is not None:
+            self._apply_updates(repo, [update])
+        return result
 
 
 class GitStorage(BaseStorage):
@@ -203,11 +510,15 @@ class GitStorage(BaseStorage):
         rp = IStorageInfo(context).path
 
         try:
-            self.repo = Repository(discover_repository(rp))
+            self.repo = get_repository(rp)
         except KeyError:
             # discover_repository may have failed.
             raise PathNotFoundError('repository does not exist at path')
 
+        self.manifests = ManifestStore(self.repo)
+        self.lastmod = LastModifiedIndex(self.repo)
+        self.changed_paths = ChangedPathIndex(self.repo)
+        self.shallow = ShallowConfig(self.repo)
         self.checkout()  # defaults to HEAD.
 
     @property
@@ -217,6 +528,98 @@ class GitStorage(BaseStorage):
     def _get_empty_root(self):
         return self.empty_root
 
+    def _gitmodules(self, root):
+        try:
+            entry = root[GIT_MODULE_FILE]
+        except KeyError:
+            return GitModules()
+        return load_gitmodules(self.repo, entry.id)
+
+    def _walk_path(self, root, fragments, offset=0, node=None):
+        # Resolve the fragments from the root tree (or from node, which
+        # is the tree at fragments[:offset]) one level at a time,
+        # classifying entries by their filemode so that only the trees
+        # along the way are loaded.  Intermediate trees are cached.
+        if node is None:
+            node = root
+        for i in range(offset, len(fragments)):
+            if node is None:
+                # previous fragment was not a tree.
+                return NOT_FOUND
+            try:
+                entry = node[fragments[i]]
+            except KeyError:
+                return NOT_FOUND
+
+            current = '/'.join(fragments[:i + 1])
+            if entry.filemode == GIT_FILEMODE_TREE:
+                node = self.repo.get(entry.id)
+                path_cache.put((root.hex, current), (
+                    'tree', entry.hex, entry.filemode, None))
+                continue
+
+            if entry.filemode == GIT_FILEMODE_COMMIT:
+                # Submodules only have entry nodes within the tree, so
+                # resolve the location using the .gitmodules file.
+                submod = self._gitmodules(root).get(current)
+                if not submod:
+                    return NOT_FOUND
+                return ('subrepo', entry.hex, entry.filemode, {
+                    '': '_subrepo',
+                    'location': submod,
+                    'path': '/'.join(fragments[i + 1:]),
+                    'rev': entry.hex,
+                })
+
+            if i + 1 < len(fragments):
+                # can't traverse into a blob.
+                node = None
+                continue
+            return ('blob', entry.hex, entry.filemode, None)
+
+        return ('tree', node.hex, GIT_FILEMODE_TREE, None)
+
+    def _resolve(self, root, path):
+        """
+        Resolve path within the root tree into a tuple of (kind, hex,
+        filemode, extra), where kind is one of 'tree', 'blob', 'subrepo'
+        or None if the path does not exist.
+        """
+
+        # no empty string entries, also skips over '//' and leaves the
+        # final node (if directory) as the tree.
+        key = (root.hex, normpath(path))
+        fragments = key[1].split('/') if key[1] else []
+        result = path_cache.get(key)
+        if result is not None:
+            return result
+
+        if len(fragments) > 1:
+            # paths within a submodule only need the submodule itself
+            # resolved, which is then shared by all of them.
+            submod = self._gitmodules(root).lookup(key[1])
+            if submod is not None and submod[2]:
+                result = self._resolve(root, submod[0])
+                if result[0] == 'subrepo':
+                    extra = dict(result[3])
+                    extra['path'] = submod[2]
+                    result = result[:3] + (extra,)
+                    path_cache.put(key, result)
+                    return result
+
+        offset = 0
+        node = None
+        if len(fragments) > 1:
+            # a previous lookup may have resolved the parent already.
+            parent = path_cache.get((root.hex, '/'.join(fragments[:-1])))
+            if parent is not None and parent[0] == 'tree':
+                offset = len(fragments) - 1
+                node = self.repo.get(parent[1])
+
+        result = self._walk_path(root, fragments, offset, node)
+        path_cache.put(key, result)
+        return result
+
     def _get_obj(self, path, cls=None):
         if path == '' and self._commit is None:
             # special case
@@ -225,46 +628,20 @@ class GitStorage(BaseStorage):
         if self._commit is None:
             raise PathNotFoundError('repository is empty')
 
-        root = self._commit.tree
-        try:
-            breadcrumbs = []
-            fragments = list(reversed(path.split('/')))
-            node = root
-            oid = None
-            while fragments:
-                fragment = fragments.pop()
-                if not fragment == '':
-                    # no empty string entries, also skips over '//' and
-                    # leaves the final node (if directory) as the tree.
-                    oid = node[fragment].oid
-                    node = self.repo.get(oid)
-                breadcrumbs.append(fragment)
-                if node is None:
-                    # strange.  Looks like it's either submodules only
-                    # have entry nodes or pygit2 doesn't fully support
-                    # this.  Try to manually resolve the .gitmodules
-                    # file.
-                    if cls is None:
-                        # Only return this if a specific type was not
-                        # expected.
-                        submods = parse_gitmodules(self.repo.get(
-                            root[GIT_MODULE_FILE].oid).data)
-                        submod = submods.get('/'.join(breadcrumbs))
-                        if submod:
-                            fragments.reverse()
-                            return {
-                                '': '_subrepo',
-                                'location': submod,
-                                'path': '/'.join(fragments),
-                                'rev': oid.hex,
-                            }
-
-            if node and (cls is None or isinstance(node, cls)):
-                return node
-        except KeyError:
-            # can't find what is needed in repo, raised by pygit2
+        kind, hexsha, filemode, extra = self._resolve(self._commit.tree, path)
+        if kind is None:
+            # can't find what is needed in repo.
             raise PathNotFoundError('path not found')
 
+        if kind == 'subrepo':
+            # Only return this if a specific type was not expected.
+            if cls is None:
+                return dict(extra)
+        else:
+            node = self.repo.get(hexsha)
+            if cls is None or isinstance(node, cls):
+                return node
+
         # not what we were looking for.
         if cls == Tree:
             raise PathNotDirError('path not dir')
@@ -278,8 +655,8 @@ class GitStorage(BaseStorage):
 
     @property
     def rev(self):
-        if self.__commit:
-            return self.__commit.hex
+        if self._commit:
+            return self._commit.hex
         return None
 
     @property
@@ -291,46 +668,162 @@ class GitStorage(BaseStorage):
     def basename(self, name):
         return name.split('/')[-1]
 
-    def checkout(self, rev=None):
+    def _checkout_commit(self, rev):
         # None maps to the default revision.
         if rev is None:
             rev = 'HEAD'
 
         try:
-            self.__commit = self.repo.revparse_single(rev)
+            return resolve(self.repo, rev)
         except KeyError:
             if rev == 'HEAD':
                 # probably a new repo.
-                self.__commit = None
-                return
+                return None
+            if maybe_beyond(rev):
+                self.shallow.request_deepen()
             raise RevisionNotFoundError('revision %s not found' % rev)
-            # otherwise a RevisionNotFoundError should be raised.
 
-    def files(self):
-        def _files(tree, current_path=None):
-            results = []
-            for node in tree:
-                if current_path:
-                    name = '/'.join([current_path, node.name])
-                else:
-                    name = node.name
+    def checkout(self, rev=None):
+        self.__commit = self._checkout_commit(rev)
+
+    def at(self, rev=None):
+        """
+        Return a GitStorageSnapshot of rev, or of the current revision by
+        default, which shares the repository and indexes of this storage
+        but is not affected by further checkouts of it.
+        """
+
+        if rev is None:
+            return GitStorageSnapshot(self, self._commit)
+        return GitStorageSnapshot(self, self._checkout_commit(rev))
 
-                obj = self.repo.get(node.oid)
-                if isinstance(obj, Blob):
-                    results.append(name)
-                elif isinstance(obj, Tree):
-                    results.extend(_files(obj, name))
-            return results
+    def iterfiles(self, prefix=None, glob=None, max_depth=None):
+        """
+        Return an iterator of the paths to all the files within the
+        current revision, optionally limited to the ones under the
+        directory at prefix, matching the glob pattern or within
+        max_depth levels of the starting directory.
+        """
 
         if not self._commit:
-            return []
-        results = _files(self._commit.tree)
+            return iter([])
+
+        if prefix:
+            tree = self._get_obj(prefix, Tree)
+            prefix = normpath(prefix)
+        else:
+            tree = self._commit.tree
+
+        def _files():
+            for name, entry in walk_tree(
+                    self.repo, tree, prefix, max_depth):
+                if entry.filemode not in BLOB_FILEMODES:
+                    # submodules.
+                    continue
+                if glob and not fnmatchcase(name, glob):
+                    continue
+                yield name
+
+        return _files()
+
+    def _manifest(self):
+        if self._commit is None:
+            return None
+        return self.manifests.get(self._commit.tree.hex)
+
+    def build_manifest(self):
+        """
+        Build the file manifest for the current revision.
+        """
+
+        if self._commit is None:
+            return None
+        return self.manifests.build(self._commit)
+
+    def build_last_modified(self):
+        """
+        Build the last modified index for the current revision.
+        """
+
+        if self._commit is None:
+            return None
+        return self.lastmod.update(self._commit)
+
+    def build_search_index(self):
+        """
+        Build the trigram index for the files of the current revision.
+        """
+
+        if self._commit is None:
+            return None
+        return TrigramIndex(self.repo).update(self._commit.tree)
+
+    def last_modified(self, paths):
+        """
+        Return a dict mapping each of the paths to the rev and date of
+        the commit that last modified it, for the paths that can be
+        found in the last modified index of the current revision.
+        """
+
+        if self._commit is None:
+            return {}
+        found = self.lastmod.lookup(
+            self._commit.hex, [normpath(path) for path in paths])
+        results = {}
+        for path in paths:
+            value = found.get(normpath(path))
+            if value is None:
+                continue
+            rev, time, offset = value
+            results[path] = {
+                'rev': rev,
+                'date': self.strftime(timestamp_dt(time, offset)),
+            }
         return results
 
-    def file(self, path):
-        return self._get_obj(path, Blob).data
+    def files(self):
+        manifest = self._manifest()
+        if manifest is not None:
+            return [
+                path for path, hexsha, size, mode in manifest
+                if mode in BLOB_FILEMODES
+            ]
+        return list(self.iterfiles())
+
+    def file(self, path, offset=0, length=None):
+        """
+        Return the contents of the file at path, or only up to length
+        bytes of it starting from offset.
+        """
+
+        if offset < 0 or (length is not None and length < 0):
+            raise ValueError('offset and length must not be negative')
+
+        blob = self._get_obj(path, Blob)
+        if offset == 0 and length is None:
+            return blob.data
+
+        # only copy the requested range out of the blob.
+        buf = blob_buffer(blob)
+        end = len(buf) if length is None else offset + length
+        return buf[offset:end].tobytes()
+
+    def open(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Return a read-only file-like object for the file at path, which
+        can also be iterated for its contents in chunks of chunk_size.
+        """
+
+        return BlobReader(self._get_obj(path, Blob), chunk_size)
 
     def listdir(self, path):
+        manifest = self._manifest()
+        if manifest is not None:
+            names = manifest.listdir(normpath(path))
+            if names is not None:
+                return names
+            # let the tree figure out the exact error.
+
         if path:
             tree = self._get_obj(path, Tree)
         else:
@@ -340,46 +833,361 @@ class GitStorage(BaseStorage):
 
         return [entry.name for entry in tree]
 
+    def listdir_info(self, path):
+        """
+        Return the information as reported by pathinfo for all entries
+        within the directory at path, in a single pass over its tree,
+        with the mode and oid of each entry as additional fields.
+        """
+
+        if self._commit is None:
+            if path:
+                # let this raise the appropriate error.
+                self._get_obj(path, Tree)
+            return []
+
+        path = normpath(path)
+        tree = self._get_obj(path, Tree) if path else self._commit.tree
+        manifest = self._manifest()
+        submods = None
+        date = self.strftime(committer_dt(self._commit.committer))
+        children = []
+        results = []
+
+        for entry in tree:
+            child = '/'.join([path, entry.name]) if path else entry.name
+            children.append(child)
+            info = {
+                'basename': entry.name,
+                'mode': entry.filemode,
+                'oid': entry.hex,
+                'size': 0,
+                'date': '',
+            }
+            if entry.filemode == GIT_FILEMODE_TREE:
+                info['type'] = 'folder'
+            elif entry.filemode == GIT_FILEMODE_COMMIT:
+                if submods is None:
+                    submods = self._gitmodules(self._commit.tree)
+                info['type'] = 'subrepo'
+                info['obj'] = {
+                    '': '_subrepo',
+                    'location': submods.get(child),
+                    'path': '',
+                    'rev': entry.hex,
+                }
+            else:
+                record = manifest and manifest.find(child)
+                if record:
+                    info['size'] = record[2]
+                else:
+                    info['size'] = self.repo.get(entry.id).size
+                info['type'] = 'file'
+                info['date'] = date
+            results.append(info)
+
+        dates = self.last_modified(children)
+        for child, info in zip(children, results):
+            if child in dates:
+                info['date'] = dates[child]['date']
+        return [self.format(**info) for info in results]
+
     def format(self, **kw):
         # XXX backwards compatibility??
         return kw
 
-    def log(self, start, count, branch=None, shortlog=False):
+    def _log_entry(self, commit, shortlog=False):
+        entry = {
+            'author': commit.committer.name,
+            'email': commit.committer.email,
+            'node': commit.hex,
+            'rev': commit.hex,
+        }
+        if not shortlog:
+            entry['date'] = self.strftime(committer_dt(commit.committer))
+            entry['desc'] = commit.message
+        return entry
+
+    def _log_walker(self, start, cursor=None):
+        # Returns None for the default start within an empty repo.
+        if cursor is not None:
+            try:
+                return HistoryWalker.from_cursor(self.repo, cursor)
+            except ValueError:
+                raise RevisionNotFoundError('invalid cursor %s' % cursor)
+
+        default = start is None
+        if default:
+            # assumption.
+            start = 'HEAD'
+
+        try:
+            rev = revision_cache.resolve_commit(self.repo, start)
+        except KeyError:
+            if default:
+                return None
+            if maybe_beyond(start):
+                self.shallow.request_deepen()
+            raise RevisionNotFoundError('revision %s not found' % start)
+
+        return HistoryWalker(self.repo, [rev])
+
+    def _log_commits(self, walker, path=None):
+        path = normpath(path or '')
+        edge = boundary(self.repo)
+        if edge:
+            walker = self._boundary_walker(walker, edge)
+        if path:
+            walker = path_history(self.repo, walker, path, self.changed_paths)
+        return walker
+
+    def _boundary_walker(self, walker, edge):
+        # the history got walked up to the shallow boundary, rather than
+        # to the root commits, so ask for more of it.
+        for commit in walker:
+            if commit.hex in edge:
+                edge = ()
+                self.shallow.request_deepen()
+            yield commit
+
+    def iterlog(self, start=None, shortlog=False, cursor=None, path=None):
+        """
+        Return an iterator of the log entries from start, or resuming
+        from the position identified by cursor, optionally limited to
+        the commits that changed path.  With shortlog, the message and
+        date of the commits are not included.
+        """
+
+        walker = self._log_walker(start, cursor)
+        if walker is None:
+            return iter([])
+        return (
+            self._log_entry(commit, shortlog)
+            for commit in self._log_commits(walker, path)
+        )
+
+    def log_page(self, start, count, cursor=None, shortlog=False,
+                 path=None):
+        """
+        Return a tuple of up to count log entries from start (or from
+        cursor) and the cursor for the next page, which is None once the
+        history is exhausted.
+        """
+
+        walker = self._log_walker(start, cursor)
+        if walker is None:
+            return [], None
+        results = [
+            self._log_entry(commit, shortlog)
+            for commit in islice(self._log_commits(walker, path), count)
+        ]
+        return results, walker.cursor()
+
+    def log(self, start, count, branch=None, shortlog=False, path=None):
         """
         start and branch are literally the same thing.
         """
 
-        def _log(iterator):
-            for pos, commit in iterator:
-                if pos == count:
-                    raise StopIteration
-                yield {
-                    'author': commit.committer.name,
-                    'email': self._commit.committer.email,
-                    'date': self.strftime(committer_dt(commit.committer)),
-                    'node': commit.hex,
-                    'rev': commit.hex,
-                    'desc': commit.message
-                }
+        return self.log_page(start, count, shortlog=shortlog, path=path)[0]
 
-        if start is None:
-            # assumption.
-            start = 'HEAD'
+    def _manifest_pathinfo(self, path):
+        manifest = self._manifest()
+        norm = normpath(path)
+        if manifest is None or not norm:
+            return None
+
+        record = manifest.find(norm)
+        if record is not None:
+            if record[3] not in BLOB_FILEMODES:
+                # submodules need the .gitmodules file.
+                return None
+            return self.format(**{
+                'type': 'file',
+                'basename': self.basename(path),
+                'size': record[2],
+                'date': self.strftime(committer_dt(self._commit.committer)),
+            })
+
+        start, end = manifest.prefix_range(norm)
+        if start == end:
+            return None
+        return self.format(**{
+            'basename': self.basename(path),
+            'size': 0,
+            'type': 'folder',
+            'date': '',
+        })
+
+    def archive(self, rev=None, format='tar', prefix=None, paths=None,
+                cache=False, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Return a generator of the chunks of the archive of rev (the
+        current revision by default) in format ('tar', 'tar.gz' or
+        'zip'), with the files placed under the prefix directory and
+        optionally limited to the ones at or under paths.  If cache is
+        set, complete archives are kept in a cache bounded in size (see
+        ArchiveCache).
+        """
+
+        if rev is None:
+            commit = self._commit
+        else:
             try:
-                self.repo.revparse_single(start)
+                commit = resolve_commit(self.repo, rev)
             except KeyError:
-                return []
+                raise RevisionNotFoundError('revision %s not found' % rev)
+        if commit is None:
+            raise RevisionNotFoundError('no revision to archive')
+
+        mtime = commit.committer.time
+        if cache and not paths:
+            return ArchiveCache(self.repo).stream(
+                commit.tree, format, prefix, mtime, chunk_size)
+        try:
+            return archive(
+                self.repo, commit.tree, format, prefix, paths, mtime,
+                chunk_size)
+        except KeyError:
+            raise PathNotFoundError('path not found in revision')
 
+    def _diff_trees(self, rev_a, rev_b):
+        trees = []
+        for rev in (rev_a, rev_b):
+            if rev is None:
+                trees.append(self._commit and self._commit.tree)
+                continue
+            try:
+                trees.append(resolve_commit(self.repo, rev).tree)
+            except KeyError:
+                raise RevisionNotFoundError('revision %s not found' % rev)
+        return trees
+
+    def diff(self, rev_a, rev_b=None, paths=None, stats_only=False):
+        """
+        Return an iterator of the changes from rev_a to rev_b (the
+        current revision by default), one dict per file, optionally
+        limited to the files at or under paths.  With stats_only, only
+        the numbers of lines added and deleted are included rather than
+        the patch.
+        """
+
+        old, new = self._diff_trees(rev_a, rev_b)
+        return cached_iter_diff(self.repo, old, new, paths, stats_only)
+
+    def diff_stats(self, rev_a, rev_b=None):
+        """
+        Return the statistics of the changes from rev_a to rev_b (the
+        current revision by default).
+        """
+
+        old, new = self._diff_trees(rev_a, rev_b)
+        return diff_stats(self.repo, old, new)
+
+    def blame(self, path, rev=None, line_range=None):
+        """
+        Return the blame of the file at path within rev (the current
+        revision by default), as a list of hunks of consecutive lines
+        last changed by the same commit, optionally limited to the
+        lines within line_range, a tuple of the first and the last line
+        (counting from 1).
+        """
+
+        if rev is None:
+            commit = self._commit
+        else:
+            try:
+                commit = resolve_commit(self.repo, rev)
+            except KeyError:
+                raise RevisionNotFoundError('revision %s not found' % rev)
+        if commit is None:
+            raise PathNotFoundError('repository is empty')
+
+        path = normpath(path)
         try:
-            rev = self.repo.revparse_single(start).hex
+            entry = commit.tree[path]
         except KeyError:
-            raise RevisionNotFoundError('revision %s not found' % start)
+            raise PathNotFoundError('path not found')
+        if entry.filemode not in BLOB_FILEMODES:
+            raise PathNotFileError('path not file')
+
+        first, last = line_range or (1, None)
+        results = []
+        start = 1
+        for commit_hex, count in BlameIndex(self.repo).blame(commit, path):
+            end = start + count - 1
+            lo = max(start, first)
+            hi = end if last is None else min(end, last)
+            if lo <= hi:
+                blamed = self.repo[commit_hex]
+                entry = self._log_entry(blamed, shortlog=True)
+                entry['date'] = self.strftime(
+                    committer_dt(blamed.committer))
+                entry['start'] = lo
+                entry['lines'] = hi - lo + 1
+                results.append(entry)
+            start = end + 1
+        return results
 
-        iterator = enumerate(self.repo.walk(rev, GIT_SORT_TIME))
+    def search(self, pattern, rev=None, regex=False, paths=None,
+               limit=SEARCH_LIMIT):
+        """
+        Return an iterator of the lines of the files within rev (the
+        current revision by default) matching pattern, a string or a
+        regular expression if regex is set, optionally limited to the
+        files at or under paths and to limit results.  Every result is
+        a dict with the path, the number of the line and its text.
+        Revisions not yet indexed are searched by scanning every file.
+        """
 
-        return list(_log(iterator))
+        # validate the pattern right away.
+        compile_pattern(pattern, regex)
+
+        if rev is None:
+            commit = self._commit
+        else:
+            try:
+                commit = resolve_commit(self.repo, rev)
+            except KeyError:
+                raise RevisionNotFoundError('revision %s not found' % rev)
+        if commit is None:
+            return iter([])
+
+        try:
+            entries = iter_entries(self.repo, commit.tree, paths)
+        except KeyError:
+            raise PathNotFoundError('path not found in revision')
+
+        index = TrigramIndex(self.repo)
+        if not index.indexed(commit.tree):
+            index = None
+        results = search(self.repo, entries, pattern, regex, index)
+        if limit:
+            results = islice(results, limit)
+        return results
+
+    def ahead_behind(self, a, b):
+        """
+        Return a tuple with the number of commits reachable from the
+        revision a but not from b, and the number reachable from b but
+        not from a.
+        """
+
+        revs = []
+        for rev in (a, b):
+            try:
+                revs.append(revision_cache.resolve_commit(self.repo, rev))
+            except KeyError:
+                raise RevisionNotFoundError('revision %s not found' % rev)
+        return CommitGraph(self.repo).ahead_behind(*revs)
 
     def pathinfo(self, path):
+        info = self._manifest_pathinfo(path) or self._tree_pathinfo(path)
+        dates = self.last_modified([path])
+        if path in dates:
+            info['date'] = dates[path]['date']
+        return info
+
+    def _tree_pathinfo(self, path):
         obj = self._get_obj(path)
         if isinstance(obj, Blob):
             return self.format(**{
@@ -416,15 +1224,63 @@ class GitStorage(BaseStorage):
             'date': '',
         })
 
-    def branches(self):
-        return tuple(
-            (b, self.repo.lookup_branch(b).target.hex)
-            for b in self.repo.listall_branches()
-        )
+    def _references(self, base, prefix, sort, reverse, offset, limit,
+                    peeled):
+        snapshot = ref_snapshot(self.repo)
+        names = snapshot.list(
+            base + (prefix or ''), sort, reverse, offset, limit)
+        if peeled:
+            return tuple(
+                (n[len(base):], snapshot.target(n), snapshot.peeled(n))
+                for n in names
+            )
+        return tuple((n[len(base):], snapshot.target(n)) for n in names)
+
+    def branches(self, prefix=None, sort='name', reverse=False, offset=0,
+                 limit=None, peeled=False):
+        """
+        Return a tuple of the (name, target) of the branches, optionally
+        only the ones starting with prefix, sorted by name or by the
+        date of their commits ('date'), from offset and up to limit of
+        them.  With peeled, the id of the object ultimately pointed to
+        is included as the third item.
+        """
 
-    def tags(self):
-        return tuple(
-            (b[10:], self.repo.lookup_reference(b).target.hex)
-            for b in self.repo.listall_references()
-            if b.startswith('refs/tags')
-        )
+        return self._references(
+            'refs/heads/', prefix, sort, reverse, offset, limit, peeled)
+
+    def tags(self, prefix=None, sort='name', reverse=False, offset=0,
+             limit=None, peeled=False):
+        """
+        Return a tuple of the (name, target) of the tags, with the same
+        options as branches; the peeled target of an annotated tag is
+        the object it is for.
+        """
+
+        return self._references(
+            'refs/tags/', prefix, sort, reverse, offset, limit, peeled)
+
+
+class GitStorageSnapshot(GitStorage):
+    """
+    A GitStorage pinned to one revision, sharing the repository and the
+    indexes of the storage it was made from.  As it cannot be checked
+    out, one instance can serve reads from many threads at once.
+    """
+
+    def __init__(self, storage, commit):
+        self.context = storage.context
+        self.repo = storage.repo
+        self.manifests = storage.manifests
+        self.lastmod = storage.lastmod
+        self.changed_paths = storage.changed_paths
+        self.shallow = storage.shallow
+        self.datefmt = storage.datefmt
+        self.__commit = commit
+
+    @property
+    def _commit(self):
+        return self.__commit
+
+    def checkout(self, rev=None):
+        raise TypeError('a snapshot is pinned to its revision, use at()')
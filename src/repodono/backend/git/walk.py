@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from pygit2 import GIT_FILEMODE_BLOB
+from pygit2 import GIT_FILEMODE_BLOB_EXECUTABLE
+from pygit2 import GIT_FILEMODE_LINK
+from pygit2 import GIT_FILEMODE_TREE
+
+BLOB_FILEMODES = (
+    GIT_FILEMODE_BLOB,
+    GIT_FILEMODE_BLOB_EXECUTABLE,
+    GIT_FILEMODE_LINK,
+)
+
+
+def as_bytes(value):
+    """
+    Return value (e.g. a path) encoded as utf-8, if it is unicode.
+    """
+
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def as_text(value):
+    """
+    Return value (e.g. a path) decoded from utf-8, if it is bytes.
+    """
+
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+
+def walk_tree(repo, tree, base=None, max_depth=None):
+    """
+    Lazily walk tree depth-first in tree order, yielding a tuple of
+    (path, entry) for every entry that is not a tree.  Only the trees
+    are loaded from the repository.
+    """
+
+    stack = [(base, iter(tree), 1)]
+    while stack:
+        current, entries, depth = stack[-1]
+        for entry in entries:
+            if current:
+                name = '/'.join([current, entry.name])
+            else:
+                name = entry.name
+
+            if entry.filemode == GIT_FILEMODE_TREE:
+                if max_depth is None or depth < max_depth:
+                    stack.append((name, iter(repo.get(entry.id)), depth + 1))
+                    break
+                continue
+            yield name, entry
+        else:
+            stack.pop()
+
+
+def diff_deltas(diff):
+    """
+    Return the deltas of diff, also for the versions of pygit2 without
+    Diff.deltas.
+    """
+
+    deltas = getattr(diff, 'deltas', None)
+    if deltas is None:
+        deltas = (patch.delta for patch in diff)
+    return deltas
+
+
+def changed_paths(old_tree, new_tree):
+    """
+    Return the set of the paths of the files that differ between the
+    two trees.
+    """
+
+    paths = set()
+    for delta in diff_deltas(old_tree.diff_to_tree(new_tree)):
+        paths.add(delta.old_file.path)
+        paths.add(delta.new_file.path)
+    return paths